@@ -20,9 +20,17 @@ class BaseFrame:
         self.num_features = 0
 
     def add_features(self, features=[]):
-        """features is a list of (str, FeatureObject, str)"""
-        self.data.extend(features)
-        self.num_features += len(features)
+        """
+        features is a list (or any iterable) of (str, FeatureObject, str).
+        None of them are added if iterating them fails.
+        """
+        count = len(self.data)
+        try:
+            self.data.extend(features)
+        except:
+            del self.data[count:]
+            raise
+        self.num_features += len(self.data) - count
 
     def add_feature(self, feature_type, feature_key, feature_value):
         self.data.append((feature_type, feature_key, feature_value))
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import inspect as _inspect
+import logging
+import os
+
+import utils.dockerutils
+from utils.namespace import ALL_NAMESPACES
+
+logger = logging.getLogger('crawlutils')
+
+
+class ContainerContext(object):
+
+    """
+    Information about a container shared by all the plugins crawling it in
+    the same crawling iteration, so every plugin does not have to get it
+    again (docker inspect, rootfs path, cgroup paths, namespaces).
+
+    Container plugins get it through the `context` argument of `crawl`, if
+    they declare one. Everything is computed lazily, at most once.
+    """
+
+    def __init__(self, long_id, inspect=None, container=None,
+                 processes=None):
+        """
+        :param long_id: the container ID.
+        :param inspect: the docker inspect of the container, if we already
+        have it.
+        :param container: the Container object being crawled, if any.
+        :param processes: the procfs ProcessRecords of all the processes of
+        the container, if they were read from the host (see
+        `utils.host_processes`). Plugins can use them instead of entering
+        the container namespaces.
+        """
+        self.long_id = long_id
+        self.container = container
+        self.processes = processes
+        self._inspect = inspect
+        self._rootfs = None
+        self._cgroup_paths = {}
+        self._namespace_inodes = None
+
+    @classmethod
+    def from_container(cls, container, processes=None):
+        return cls(container.long_id,
+                   inspect=getattr(container, 'inspect', None),
+                   container=container,
+                   processes=processes)
+
+    @property
+    def inspect(self):
+        if self._inspect is None:
+            self._inspect = utils.dockerutils.exec_dockerinspect(
+                self.long_id)
+        return self._inspect
+
+    @property
+    def pid(self):
+        if self.container is not None:
+            return self.container.pid
+        return str(self.inspect['State']['Pid'])
+
+    @property
+    def rootfs(self):
+        if self._rootfs is None:
+            self._rootfs = (
+                getattr(self.container, 'root_fs', None) or
+                utils.dockerutils.get_docker_container_rootfs_path(
+                    self.long_id))
+        return self._rootfs
+
+    @property
+    def namespace_inodes(self):
+        """
+        Dictionary with the inode of every namespace of the container,
+        for the namespaces we could stat.
+        """
+        if self._namespace_inodes is None:
+            self._namespace_inodes = {}
+            for ns in ALL_NAMESPACES:
+                try:
+                    path = os.path.join('/proc', self.pid, 'ns', ns)
+                    self._namespace_inodes[ns] = os.stat(path).st_ino
+                except OSError as exc:
+                    logger.debug('Can not stat the %s namespace of %s: %s'
+                                 % (ns, self.long_id, exc))
+        return self._namespace_inodes
+
+    def get_cpu_cgroup_path(self, node='cpuacct.usage'):
+        return self._get_cgroup_path('get_cpu_cgroup_path', node)
+
+    def get_memory_cgroup_path(self, node='memory.stat'):
+        return self._get_cgroup_path('get_memory_cgroup_path', node)
+
+    def _get_cgroup_path(self, getter, node):
+        key = (getter, node)
+        if key not in self._cgroup_paths:
+            container = self._get_docker_container()
+            self._cgroup_paths[key] = getattr(container, getter)(node)
+        return self._cgroup_paths[key]
+
+    def _get_docker_container(self):
+        if self.container is None:
+            # Imported here as dockercontainer imports the plugins manager
+            from dockercontainer import DockerContainer
+            self.container = DockerContainer(self.long_id,
+                                             inspect=self.inspect)
+        return self.container
+
+
+def get_container_context(container_id, context=None):
+    """
+    Returns `context`, or a new ContainerContext for `container_id` if
+    there is none. Plugins use this to keep working when called without a
+    context (like when calling `crawl` directly).
+    """
+    if context is None:
+        context = ContainerContext(container_id)
+    return context
+
+
+def accepts_context(function):
+    """
+    Returns True if `function` has a `context` argument. Plugins written
+    before ContainerContext existed do not, so we do not pass it to them.
+    """
+    try:
+        return 'context' in _inspect.getargspec(function).args
+    except TypeError:
+        # Not a python function (e.g. a mock)
+        return False
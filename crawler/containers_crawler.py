@@ -1,6 +1,87 @@
+import itertools
+import logging
+import Queue
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
 from containers import poll_containers, get_containers
 import plugins_manager
 from base_crawler import BaseCrawler, BaseFrame
+from container_context import ContainerContext, accepts_context
+from utils.cgroup_utils import forget_container
+from utils.counter_rates import forget_entity
+from utils.dockerinventory import start_docker_inventory
+from utils.dockerutils import get_docker_api_latency
+from utils.fs_walker import walk_tree
+from utils.host_processes import scan_host_processes
+from utils.namespace import (run_as_another_namespace_batch,
+                             run_as_another_namespace_stream,
+                             NamespaceWorkersPool)
+
+# Seconds between checks for finished containers while waiting on the pool.
+# Queue.get() without a timeout can not be interrupted by signals (Ctrl-C)
+# in Python 2, so we poll instead.
+POOL_POLL_INTERVAL = 1
+
+logger = logging.getLogger('crawlutils')
+
+
+class _WalkFeatures(object):
+
+    """
+    Splits the (position, feature) items of a walk for many visitors into
+    an iterator of features per visitor, so each plugin reads its features
+    from the walk as it goes. The items of the visitors not being read are
+    kept until they are, and an error of the walk is raised by every
+    iterator once it gets there.
+    """
+
+    def __init__(self, items, count):
+        # generators only start walking when first read
+        self._items = iter(items)
+        self._pending = [deque() for _ in range(count)]
+        self._done = False
+        self._exc = None
+
+    def get(self, position):
+        """Returns the iterator of the features of visitor `position`."""
+        pending = self._pending[position]
+        while True:
+            if pending:
+                yield pending.popleft()
+            elif self._exc is not None:
+                raise self._exc
+            elif self._done:
+                return
+            else:
+                self._read()
+
+    def _read(self):
+        try:
+            (position, feature) = next(self._items)
+        except StopIteration:
+            self._done = True
+        except Exception as exc:
+            self._exc = exc
+        else:
+            self._pending[position].append(feature)
+
+    def close(self):
+        """Stops the walk, if it is not over."""
+        close = getattr(self._items, 'close', None)
+        if close is not None and not self._done:
+            close()
+        self._done = True
+
+
+def _call_plugin(method, context, **kwargs):
+    """
+    Calls a container plugin `method`, passing it the ContainerContext only
+    if the plugin supports it (see `accepts_context`).
+    """
+    if accepts_context(method):
+        kwargs['context'] = context
+    return method(**kwargs)
 
 
 class ContainerFrame(BaseFrame):
@@ -19,7 +100,38 @@ class ContainersCrawler(BaseCrawler):
                  user_list='ALL',
                  host_namespace='',
                  plugin_places=['plugins'],
-                 options={}):
+                 options={},
+                 numprocesses=1,
+                 ordered_frames=False,
+                 max_pending_frames=None,
+                 namespace_workers=False,
+                 docker_events=False,
+                 host_process_scan=False,
+                 shared_walk=False):
+        """
+        :param numprocesses: number of workers crawling containers
+        concurrently. 1 means crawling one container at a time.
+        :param ordered_frames: if True, frames are returned in the same
+        order as the containers list. Otherwise they are returned as soon
+        as each container is crawled.
+        :param max_pending_frames: max number of containers being crawled
+        or waiting to be emitted at any time. Defaults to twice
+        `numprocesses`.
+        :param namespace_workers: if True, keep a process attached to the
+        namespaces of every container for its whole lifetime, instead of
+        forking and attaching to them on every crawl.
+        :param docker_events: if True, keep the list of docker containers
+        up to date with the docker events, instead of listing and inspecting
+        all containers at every crawl. New containers are also crawled as
+        soon as they start (see `polling_crawl`).
+        :param host_process_scan: if True, read the processes of all
+        containers with a single scan of the host /proc at every crawl, and
+        give every container its share (see `ContainerContext.processes`),
+        instead of reading /proc inside every container namespace.
+        :param shared_walk: if True, walk the files of every container once
+        for all the plugins that walk them (like file, config and jar, see
+        `IContainerCrawler.get_walk_visitor`), instead of once per plugin.
+        """
 
         BaseCrawler.__init__(
             self,
@@ -33,6 +145,21 @@ class ContainersCrawler(BaseCrawler):
         self.environment = environment
         self.host_namespace = host_namespace
         self.user_list = user_list
+        self.numprocesses = max(1, numprocesses)
+        self.ordered_frames = ordered_frames
+        self.max_pending_frames = max(
+            self.numprocesses,
+            max_pending_frames or 2 * self.numprocesses)
+        self._pool = None
+        self._crawled_ids = set()
+        self._namespace_workers = None
+        self.host_process_scan = host_process_scan
+        self._host_processes = {}
+        self.shared_walk = shared_walk
+        if namespace_workers:
+            self._namespace_workers = NamespaceWorkersPool()
+        if docker_events:
+            start_docker_inventory()
 
     def crawl_container(self, container, ignore_plugin_exception=True):
         """
@@ -45,16 +172,149 @@ class ContainersCrawler(BaseCrawler):
         the plugins raised an exception (and ignore_plugin_exception was True).
         """
         frame = ContainerFrame(self.features, container)
-        for (plugin_obj, plugin_args) in self.plugins:
+        # Shared by all plugins, so they do not have to inspect the
+        # container again.
+        context = ContainerContext.from_container(
+            container, processes=self._host_processes.get(container.long_id))
+        walks = []
+        walk_results = {}
+        if self.shared_walk:
+            (walks, walk_results) = self._crawl_in_walk_session(container,
+                                                                context)
+        namespace_results = self._crawl_in_namespace_session(
+            container, context, skip=walk_results)
+        try:
+            for (index, (plugin_obj, plugin_args)) in enumerate(self.plugins):
+                try:
+                    if index in walk_results:
+                        features = self._get_walk_features(
+                            plugin_obj, plugin_args, context,
+                            walk_results[index])
+                    elif index in namespace_results:
+                        features = self._get_namespace_crawl_features(
+                            plugin_obj, plugin_args, context,
+                            namespace_results[index])
+                    else:
+                        features = _call_plugin(
+                            plugin_obj.crawl, context,
+                            container_id=container.long_id, **plugin_args)
+                    frame.add_features(features)
+                except Exception as exc:
+                    if not ignore_plugin_exception:
+                        raise exc
+        finally:
+            # the plugins that failed may not have read their features
+            for walk in walks:
+                walk.close()
+        return frame
+
+    def _crawl_in_walk_session(self, container, context=None):
+        """
+        Walks the files of the container once for the visitors of all the
+        plugins that walk them (see `IContainerCrawler.get_walk_visitor`):
+        once from the host for the visitors walking the container rootfs,
+        and once inside the container mount namespace for the others.
+
+        The walks are only done as the plugins read their features.
+
+        :param container: a Container object
+        :param context: its ContainerContext
+        :return: the list of _WalkFeatures to close once the plugins are
+        crawled, and a dict mapping the index (in self.plugins) of every
+        plugin crawled in the walk to its (features, exception) tuple.
+        """
+        walks = {}
+        results = {}
+        for (index, (plugin_obj, plugin_args)) in enumerate(self.plugins):
+            get_walk_visitor = getattr(plugin_obj, 'get_walk_visitor', None)
+            if get_walk_visitor is None:
+                continue
             try:
-                frame.add_features(
-                    plugin_obj.crawl(
-                        container_id=container.long_id,
-                        **plugin_args))
+                walk = _call_plugin(get_walk_visitor, context,
+                                    container_id=container.long_id,
+                                    **plugin_args)
             except Exception as exc:
-                if not ignore_plugin_exception:
-                    raise exc
-        return frame
+                results[index] = (None, exc)
+                continue
+            if walk is not None:
+                walks.setdefault(walk.avoid_setns, []).append(
+                    (index, walk.visitor))
+
+        walk_features = []
+        for (avoid_setns, visitors) in walks.iteritems():
+            (indexes, visitors) = zip(*visitors)
+            if avoid_setns:
+                items = walk_tree(visitors)
+            else:
+                items = run_as_another_namespace_stream(
+                    container.pid, ['mnt'], walk_tree, visitors)
+            features = _WalkFeatures(items, len(visitors))
+            walk_features.append(features)
+            results.update((index, (features.get(position), None))
+                           for (position, index) in enumerate(indexes))
+        return (walk_features, results)
+
+    def _get_walk_features(self, plugin_obj, plugin_args, context,
+                           walk_result):
+        (features, exc) = walk_result
+        if exc is not None:
+            raise exc
+        return _call_plugin(plugin_obj.crawl_from_walk, context,
+                            container_id=context.long_id,
+                            features=features, **plugin_args)
+
+    def _crawl_in_namespace_session(self, container, context=None, skip={}):
+        """
+        Runs the namespace functions of all plugins that need to enter the
+        container namespaces (see `IContainerCrawler.get_namespace_crawl`)
+        in a single namespace session, so we only fork once per container
+        instead of a few times per plugin.
+
+        :param container: a Container object
+        :param context: its ContainerContext
+        :param skip: the indexes of the plugins already crawled in a walk
+        session
+        :return: a dict mapping the index (in self.plugins) of every plugin
+        that was crawled in the session to its (result, exception) tuple.
+        """
+        calls = []
+        indexes = []
+        results = {}
+        for (index, (plugin_obj, plugin_args)) in enumerate(self.plugins):
+            get_namespace_crawl = getattr(plugin_obj, 'get_namespace_crawl',
+                                          None)
+            if get_namespace_crawl is None or index in skip:
+                continue
+            try:
+                call = _call_plugin(get_namespace_crawl, context,
+                                    container_id=container.long_id,
+                                    **plugin_args)
+            except Exception as exc:
+                results[index] = (None, exc)
+                continue
+            if call is not None:
+                calls.append(call)
+                indexes.append(index)
+
+        if self._namespace_workers:
+            session_results = self._namespace_workers.run(container.pid,
+                                                          calls)
+        else:
+            session_results = run_as_another_namespace_batch(container.pid,
+                                                             calls)
+        results.update(zip(indexes, session_results))
+        return results
+
+    def _get_namespace_crawl_features(self, plugin_obj, plugin_args,
+                                      context, namespace_result):
+        (result, exc) = namespace_result
+        if exc is not None:
+            return _call_plugin(plugin_obj.crawl_from_namespace_error,
+                                context, container_id=context.long_id,
+                                exc=exc, **plugin_args)
+        return _call_plugin(plugin_obj.crawl_from_namespace_result,
+                            context, container_id=context.long_id,
+                            result=result, **plugin_args)
 
     def polling_crawl(self, timeout, ignore_plugin_exception=True):
         """
@@ -83,5 +343,153 @@ class ContainersCrawler(BaseCrawler):
         containers_list = get_containers(
             user_list=self.user_list,
             host_namespace=self.host_namespace)
-        for container in containers_list:
-            yield self.crawl_container(container, ignore_plugin_exception)
+        if self._namespace_workers:
+            self._namespace_workers.reap()
+        self._forget_gone_containers(containers_list)
+        self._scan_host_processes(containers_list)
+        self._prepare_crawl(containers_list, ignore_plugin_exception)
+        if self.numprocesses == 1:
+            frames = (self.crawl_container(container, ignore_plugin_exception)
+                      for container in containers_list)
+        else:
+            frames = self._crawl_containers_in_pool(containers_list,
+                                                    ignore_plugin_exception)
+        for frame in frames:
+            yield frame
+        logger.debug('Docker API latency: %s' % get_docker_api_latency())
+
+    def _prepare_crawl(self, containers_list, ignore_plugin_exception=True):
+        """
+        Lets every plugin do its work for all the containers at once (see
+        `IContainerCrawler.prepare_crawl`) before crawling them one by one.
+        """
+        for (plugin_obj, plugin_args) in self.plugins:
+            prepare_crawl = getattr(plugin_obj, 'prepare_crawl', None)
+            if prepare_crawl is None:
+                continue
+            try:
+                prepare_crawl(containers=containers_list, **plugin_args)
+            except Exception as exc:
+                if not ignore_plugin_exception:
+                    raise exc
+
+    def _scan_host_processes(self, containers_list):
+        """
+        Reads the processes of all containers at once if host_process_scan
+        is set. Containers we could not scan (or started later) are crawled
+        from inside their namespaces as usual.
+        """
+        if not self.host_process_scan:
+            return
+        # only read what the features we crawl need
+        io = 'metric' in self.features
+        fds = 'process' in self.features or 'connection' in self.features
+        try:
+            self._host_processes = scan_host_processes(containers_list,
+                                                       io=io, fds=fds)
+        except Exception:
+            logger.error('Could not scan the host processes', exc_info=True)
+            self._host_processes = {}
+
+    def _forget_gone_containers(self, containers_list):
+        """
+        Drops the previous counters (used to compute rates) and the
+        cgroup dirs of the containers crawled last time that are not running
+        anymore.
+        """
+        long_ids = set(container.long_id for container in containers_list)
+        for long_id in self._crawled_ids - long_ids:
+            forget_entity(long_id)
+            forget_container(long_id)
+        self._crawled_ids = long_ids
+
+    def _crawl_container_task(self, index, container,
+                              ignore_plugin_exception, results):
+        """
+        Pool task: crawls `container` and puts (index, frame, exception)
+        into the `results` queue. It never raises, so the consumer always
+        gets a result for every submitted container.
+        """
+        try:
+            frame = self.crawl_container(container, ignore_plugin_exception)
+            results.put((index, frame, None))
+        except Exception as exc:
+            results.put((index, None, exc))
+
+    def _crawl_containers_in_pool(self, containers_list,
+                                  ignore_plugin_exception=True):
+        """
+        Crawls `containers_list` using a pool of `numprocesses` workers and
+        yields every frame as soon as it is ready (or in the containers list
+        order if `ordered_frames` is set).
+
+        No more than `max_pending_frames` containers are submitted and not
+        yet yielded at any time: if the consumer (the emitters) is slow,
+        the workers just wait for it instead of piling up frames.
+
+        The workers are threads, so all of them share the same plugin
+        objects and their caches (like the previous cpu times used to
+        compute rates). The expensive parts of a crawl (namespace forks,
+        reading /proc and cgroup files, docker API calls) do not hold the
+        GIL.
+
+        Forking from a thread is only safe if no other thread holds a lock
+        the child needs: the namespace children are forked holding the
+        logging locks (see `utils.namespace._Process`), and the functions
+        they run must not take any other lock shared with these threads.
+        With the fork server, all the forks are done by its single thread.
+
+        :param containers_list: list of Container objects
+        :param ignore_plugin_exception: just ignore exceptions in a plugin
+        :return: a list generator of Frame objects
+        """
+        if self._pool is None:
+            self._pool = ThreadPool(self.numprocesses)
+
+        results = Queue.Queue()
+        containers = enumerate(containers_list)
+        ready = {}
+        received = 0
+        next_frame = 0
+        pending = 0
+
+        while True:
+            pending += self._submit_containers(
+                containers, self.max_pending_frames - pending,
+                ignore_plugin_exception, results)
+            if pending == 0:
+                break
+
+            try:
+                (index, frame, exc) = results.get(
+                    timeout=POOL_POLL_INTERVAL)
+            except Queue.Empty:
+                continue
+
+            # Frames are released in `ready` key order: the containers
+            # list order, or just the order in which they were received.
+            ready[index if self.ordered_frames else received] = (frame, exc)
+            received += 1
+            while next_frame in ready:
+                (frame, exc) = ready.pop(next_frame)
+                next_frame += 1
+                pending -= 1
+                if exc:
+                    raise exc
+                yield frame
+
+    def _submit_containers(self, containers, count,
+                           ignore_plugin_exception, results):
+        """
+        Submits up to `count` containers from the `containers` iterator of
+        (index, container) to the pool.
+
+        :return: the number of containers submitted
+        """
+        submitted = 0
+        for (index, container) in itertools.islice(containers, count):
+            self._pool.apply_async(
+                self._crawl_container_task,
+                (index, container, ignore_plugin_exception, results))
+            submitted += 1
+        return submitted
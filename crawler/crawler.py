@@ -8,6 +8,10 @@ import os
 from worker import Worker
 from containers_crawler import ContainersCrawler
 from utils import misc
+from utils.dockerutils import (configure_docker_client,
+                               DEFAULT_MAX_CONNECTIONS)
+from utils.namespace import start_fork_server
+from utils.procfs import enable_procfs
 from crawlmodes import Modes
 from emitters_manager import EmittersManager
 from host_crawler import HostCrawler
@@ -165,8 +169,98 @@ def main():
         dest='numprocesses',
         type=int,
         default=1,
-        help='Number of processes used for container crawling. Defaults '
-             'to the number of cores. NOT SUPPORTED.'
+        help='Number of workers used to crawl containers concurrently. '
+             'Defaults to 1 (one container at a time). Only applies to the '
+             'OUTCONTAINER mode'
+    )
+    parser.add_argument(
+        '--orderedFrames',
+        dest='ordered_frames',
+        action='store_true',
+        default=False,
+        help='When crawling containers with more than one worker, emit the '
+             'frames in the containers list order instead of as soon as '
+             'each container is crawled.'
+    )
+    parser.add_argument(
+        '--maxPendingFrames',
+        dest='max_pending_frames',
+        type=int,
+        default=None,
+        help='Max number of containers being crawled or waiting to be '
+             'emitted at any time when using more than one worker. Defaults '
+             'to twice --numprocesses'
+    )
+    parser.add_argument(
+        '--namespaceWorkers',
+        dest='namespace_workers',
+        action='store_true',
+        default=False,
+        help='Keep a process attached to the namespaces of every container '
+             'for its whole lifetime, instead of attaching to them on every '
+             'crawl. Only applies to the OUTCONTAINER mode'
+    )
+    parser.add_argument(
+        '--forkServer',
+        dest='fork_server',
+        action='store_true',
+        default=False,
+        help='Use a small pre-forked process to spawn the processes that '
+             'crawl inside the containers namespaces, instead of forking '
+             'the whole crawler every time. Only applies to the OUTCONTAINER '
+             'mode'
+    )
+    parser.add_argument(
+        '--dockerEvents',
+        dest='docker_events',
+        action='store_true',
+        default=False,
+        help='Keep the list of docker containers up to date with the '
+             'docker events, instead of listing all of them at every crawl. '
+             'New containers are crawled as soon as they start. Only '
+             'applies to the OUTCONTAINER mode'
+    )
+    parser.add_argument(
+        '--hostProcessScan',
+        dest='host_process_scan',
+        action='store_true',
+        default=False,
+        help='Read the processes of all containers with a single scan of '
+             'the host /proc, instead of entering the namespaces of every '
+             'container for the process, metric and connection features. '
+             'Needs the crawler to run in the host pid namespace. Only '
+             'applies to the OUTCONTAINER mode'
+    )
+    parser.add_argument(
+        '--sharedWalk',
+        dest='shared_walk',
+        action='store_true',
+        default=False,
+        help='Walk the files of every container once for all the features '
+             'walking them (file, config, jar, python-package and '
+             'ruby-package), instead of once per feature. Only applies to '
+             'the OUTCONTAINER mode'
+    )
+    parser.add_argument(
+        '--dockerMaxConnections',
+        dest='docker_max_connections',
+        type=int,
+        default=DEFAULT_MAX_CONNECTIONS,
+        help='Max number of connections kept open to the docker daemon by '
+             'the docker client shared by the whole crawler. Should be at '
+             'least --numprocesses, or the connections of the extra '
+             'concurrent requests are not reused'
+    )
+    parser.add_argument(
+        '--procfs',
+        dest='procfs',
+        action='store_true',
+        default=False,
+        help='Crawl the process, metric and connection features reading '
+             'all processes from /proc in one pass, instead of going '
+             'through psutil for every process attribute. The container '
+             'interface and connection features are also read from the '
+             'host /proc, without entering the container namespaces'
     )
     parser.add_argument(
         '--extraMetadata',
@@ -191,6 +285,10 @@ def main():
     misc.setup_logger('crawlutils', args.logfile)
     misc.setup_logger('yapsy', 'yapsy.log')
 
+    configure_docker_client(max_connections=args.docker_max_connections)
+    if args.procfs:
+        enable_procfs()
+
     options = args.options
     options['avoid_setns'] = args.avoid_setns
     options['mountpoint'] = args.mountpoint
@@ -208,7 +306,17 @@ def main():
             user_list=args.crawlContainers,
             host_namespace=args.namespace,
             plugin_places=args.plugin_places,
-            options=options)
+            options=options,
+            numprocesses=args.numprocesses,
+            ordered_frames=args.ordered_frames,
+            max_pending_frames=args.max_pending_frames,
+            namespace_workers=args.namespace_workers,
+            docker_events=args.docker_events,
+            host_process_scan=args.host_process_scan,
+            shared_walk=args.shared_walk)
+        if args.fork_server:
+            # After loading the plugins, as the server needs their code
+            start_fork_server()
     elif args.crawlmode == 'INVM' or args.crawlmode == 'MOUNTPOINT':
         crawler = HostCrawler(
             features=args.features,
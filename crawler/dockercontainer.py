@@ -13,16 +13,17 @@ from requests.exceptions import HTTPError
 import plugins_manager
 from container import Container
 from utils import misc, namespace
+from utils.cgroup_utils import get_container_cgroup_path
 
 from utils.crawler_exceptions import (ContainerInvalidEnvironment,
                                       ContainerNonExistent,
                                       DockerutilsNoJsonLog,
-                                      DockerutilsException,
-                                      ContainerWithoutCgroups)
+                                      DockerutilsException)
 from utils.dockerutils import (exec_dockerps,
                                get_docker_container_json_logs_path,
                                get_docker_container_rootfs_path,
                                exec_dockerinspect)
+from utils.dockerinventory import get_docker_inventory
 
 try:
     basestring        # Python 2
@@ -39,26 +40,35 @@ DEFAULT_LOG_FILES = [{'name': '/var/log/messages',
                       'type': None}, ]
 
 
+def _in_user_list(long_id, user_list):
+    if user_list in ['ALL', 'all', 'All', None]:
+        return True
+    user_ctrs = [cid[:12] for cid in user_list.split(',')]
+    return long_id[:12] in user_ctrs
+
+
 def get_docker_containers(user_list=None, host_namespace=''):
     """
     Get the list of running Docker containers, as `DockerContainer` objects.
-    This is basically polling. Ideally, we should subscribe to Docker
-    events so we can keep the containers list up to date without having to
-    poll like this.
+    If the docker inventory was started, the containers come from it (kept
+    up to date with the docker events). Otherwise this is basically polling.
 
     :param host_namespace: string representing the host name (e.g. host IP)
     :param user_list: list of Docker container IDs. `None` means all
     containers.
     :return: a list of DockerContainer objects
     """
-    for inspect in exec_dockerps():
+    inventory = get_docker_inventory()
+    if inventory is not None:
+        inspects = inventory.get_inspects()
+    else:
+        inspects = exec_dockerps()
+
+    for inspect in inspects:
         long_id = inspect['Id']
 
-        if user_list not in ['ALL', 'all', 'All', None]:
-            user_ctrs = [cid[:12] for cid in user_list.split(',')]
-            short_id = long_id[:12]
-            if short_id not in user_ctrs:
-                continue
+        if not _in_user_list(long_id, user_list):
+            continue
 
         try:
             c = DockerContainer(long_id, inspect=inspect,
@@ -82,18 +92,21 @@ def poll_docker_containers(timeout, user_list=None, host_namespace=''):
     if timeout <= 0:
         return None
 
-    try:
-        # We are currently throttling docker events
-        # so instead of polling we will just sleep for timeout  interval
+    inventory = get_docker_inventory()
+    if inventory is None:
+        # Without the docker inventory we are not subscribed to the docker
+        # events, so instead of polling we will just sleep for timeout
         time.sleep(timeout)
-        # cEvent = poll_container_create_events(timeout)
-
-        # if not cEvent:
-        #    return None
-        # c = DockerContainer(cEvent.get_containerid(), inspect=None,
-        #                    host_namespace=host_namespace)
-        # if c.namespace:
-        #    return c
+        return None
+
+    inspect = inventory.poll_started(timeout)
+    if not inspect or not _in_user_list(inspect['Id'], user_list):
+        return None
+    try:
+        c = DockerContainer(inspect['Id'], inspect=inspect,
+                            host_namespace=host_namespace)
+        if c.namespace:
+            return c
     except ContainerInvalidEnvironment as e:
         logger.exception(e)
 
@@ -282,51 +295,13 @@ class DockerContainer(Container):
         elif not self.mounts and not self.volumes:
             self.mounts = []
 
-    # Find the mount point of the specified cgroup
-
-    def _get_cgroup_dir(self, devlist=[]):
-        for dev in devlist:
-            paths = [os.path.join('/cgroup/', dev),
-                     os.path.join('/sys/fs/cgroup/', dev)]
-            for path in paths:
-                if os.path.ismount(path):
-                    return path
-
-            # Try getting the mount point from /proc/mounts
-            for l in open('/proc/mounts', 'r'):
-                _type, mnt, _, _, _, _ = l.split(' ')
-                if _type == 'cgroup' and mnt.endswith('cgroup/' + dev):
-                    return mnt
-
-        raise ContainerWithoutCgroups('Can not find the cgroup dir')
-
-    def resolve_cont_cgroup_path_docker_k8(self, cgroup_dir, node):
-        cont_cgroup_path = os.path.join(
-            cgroup_dir, 'docker', self.long_id, node)
-        if os.path.exists(cont_cgroup_path):
-            return cont_cgroup_path
-
-        # k8 specific hack for now until k8 becomes first class citizen
-        # should use k8 python client to be cleaner
-        k8_cgroup_path = os.path.join(cgroup_dir, 'kubepods')
-        if not os.path.exists(k8_cgroup_path):
-            raise ContainerWithoutCgroups('Can not find the cgroup dir')
-
-        for (root_dirpath, dirs, files) in os.walk(k8_cgroup_path):
-            if self.long_id in dirs:
-                pod_cgroup_path = root_dirpath
-                return os.path.join(pod_cgroup_path, self.long_id, node)
-
-        raise ContainerWithoutCgroups('Can not find the cgroup dir')
-
     def get_memory_cgroup_path(self, node='memory.stat'):
-        cgroup_dir = self._get_cgroup_dir(['memory'])
-        return self.resolve_cont_cgroup_path_docker_k8(cgroup_dir, node)
+        return get_container_cgroup_path(['memory'], self.long_id, node)
 
     def get_cpu_cgroup_path(self, node='cpuacct.usage'):
         # In kernels 4.x, the node is actually called 'cpu,cpuacct'
-        cgroup_dir = self._get_cgroup_dir(['cpuacct', 'cpu,cpuacct'])
-        return self.resolve_cont_cgroup_path_docker_k8(cgroup_dir, node)
+        return get_container_cgroup_path(['cpuacct', 'cpu,cpuacct'],
+                                         self.long_id, node)
 
     def __str__(self):
         return str(self.__dict__)
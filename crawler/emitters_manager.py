@@ -54,13 +54,16 @@ class EmittersManager:
         :param frame: frame of type BaseFrame
         :param snapshot_num: iteration count (from worker.py). This is just
         used to differentiate successive frame files (when url is file://).
-        :return: None
+        :return: False if an emitter could not deliver the frame
         """
         if not isinstance(frame, BaseFrame):
             raise TypeError('frame is not of type BaseFrame')
 
         metadata = frame.metadata
         metadata.update(self.extra_metadata)
+        delivered = True
         for (emitter_obj, emitter_args) in self.emitter_plugins:
-            emitter_obj.emit(frame, self.compress,
-                             metadata, snapshot_num, **(emitter_args or {}))
+            if emitter_obj.emit(frame, self.compress, metadata, snapshot_num,
+                                **(emitter_args or {})) is False:
+                delivered = False
+        return delivered
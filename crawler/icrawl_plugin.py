@@ -15,9 +15,71 @@ class IContainerCrawler(IPlugin):
         Crawling function that should return a list of features for
         `container_id`. This function is called once for every container
         at every crawling interval.
+
+        Plugins that declare a `context` argument get a ContainerContext
+        (see container_context.py) with the information about the container
+        shared by all plugins during the crawling interval.
         """
         raise NotImplementedError()
 
+    def prepare_crawl(self, containers, **kwargs):
+        """
+        Called at every crawling interval with the list of containers about
+        to be crawled, before calling `crawl` for any of them. Plugins can
+        override this to do some work for all the containers at once.
+        """
+        pass
+
+    def get_namespace_crawl(self, container_id, avoid_setns=False, **kwargs):
+        """
+        Plugins that crawl by running a function inside the container
+        namespaces should return a `utils.namespace.NamespaceCrawl` with
+        that function. This lets the containers crawler run the functions
+        of all plugins in a single namespace session per container, and
+        then call `crawl_from_namespace_result` with each result instead
+        of `crawl`.
+
+        Returns None if this crawl does not need to enter the container
+        namespaces (the default).
+        """
+        return None
+
+    def crawl_from_namespace_result(self, container_id, result, **kwargs):
+        """
+        Returns the list of features for `container_id` given `result`:
+        the value returned by the `get_namespace_crawl` function.
+        """
+        return result
+
+    def crawl_from_namespace_error(self, container_id, exc, **kwargs):
+        """
+        Called instead of `crawl_from_namespace_result` when the
+        `get_namespace_crawl` function raised `exc`. Plugins can override
+        this to fall back to some other way of crawling.
+        """
+        raise exc
+
+    def get_walk_visitor(self, container_id, avoid_setns=False, **kwargs):
+        """
+        Plugins that crawl by walking the files of the container should
+        return a `utils.fs_walker.WalkCrawl` with the visitor crawling
+        every entry. With shared_walk, the containers crawler walks the
+        container files once for the visitors of all plugins, and then
+        calls `crawl_from_walk` with the features of each visitor instead
+        of `crawl`.
+
+        Returns None if this crawl does not walk the files (the default).
+        """
+        return None
+
+    def crawl_from_walk(self, container_id, features, **kwargs):
+        """
+        Returns the list of features for `container_id` given `features`:
+        an iterator of what the `get_walk_visitor` visitor returns, read
+        from the walk as it goes.
+        """
+        return features
+
     def get_feature(self):
         """
         Returns the feature type as a string.
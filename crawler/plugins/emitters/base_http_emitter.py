@@ -34,7 +34,7 @@ class BaseHttpEmitter:
         :param compress:
         :param metadata:
         :param snapshot_num:
-        :return: None
+        :return: False if some of the frame could not be posted
         """
         iostream = self.format(frame)
         if compress:
@@ -44,12 +44,14 @@ class BaseHttpEmitter:
             )
         if self.emit_per_line:
             iostream.seek(0)
+            delivered = True
             for line in iostream.readlines():
-                self.post(line, metadata)
-        else:
-            self.post(iostream.getvalue(), metadata)
+                delivered = self.post(line, metadata) and delivered
+            return delivered
+        return self.post(iostream.getvalue(), metadata)
 
     def post(self, content='', metadata={}):
+        """Returns False if `content` could not be posted."""
         headers = {'content-type': 'application/csv'}
         params = {}
         for attempt in range(self.max_retries):
@@ -62,7 +64,7 @@ class BaseHttpEmitter:
                 logger.error(
                     "POST to %s resulted in exception (attempt %d of %d), "
                     "Exiting." % (self.url, attempt + 1, self.max_retries))
-                break
+                return False
             except requests.exceptions.RequestException as e:
                 logger.exception(e)
                 logger.error(
@@ -77,4 +79,5 @@ class BaseHttpEmitter:
                               response.text, attempt + 1, self.max_retries))
                 time.sleep(2.0 ** attempt * 0.1)
             else:
-                break
+                return True
+        return False
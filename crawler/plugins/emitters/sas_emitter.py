@@ -34,7 +34,7 @@ class SasEmitter(BaseHttpEmitter, IEmitter):
         :param compress:
         :param metadata:
         :param snapshot_num:
-        :return: None
+        :return: False if some of the frame could not be posted
         """
         self.token_filepath = kwargs.get("token_filepath", "")
         self.access_group_filepath = kwargs.get("access_group_filepath", "")
@@ -61,10 +61,11 @@ class SasEmitter(BaseHttpEmitter, IEmitter):
             )
         if self.emit_per_line:
             iostream.seek(0)
+            delivered = True
             for line in iostream.readlines():
-                self.post(line, metadata)
-        else:
-            self.post(iostream.getvalue(), metadata)
+                delivered = self.post(line, metadata) and delivered
+            return delivered
+        return self.post(iostream.getvalue(), metadata)
 
     '''
     This function retrievs sas token information from k8s secrets.
@@ -137,6 +138,7 @@ class SasEmitter(BaseHttpEmitter, IEmitter):
         return (namespace, timestamp, features, system_type)
 
     def post(self, content='', metadata={}):
+        """Returns False if `content` could not be posted."""
         (namespace, timestamp, features, system_type) =\
             self.__parse_crawl_metadata(content)
         (token, cloudoe, access_group) = self.get_sas_tokens()
@@ -164,7 +166,7 @@ class SasEmitter(BaseHttpEmitter, IEmitter):
             logger.info("frame does not satisfy SAS required format")
             logger.info("source_type=container, namespace=%s",
                         params.get('namespace'))
-            return
+            return True
 
         logger.info("emit frame (namespace=%s)", params.get('namespace'))
         logger.info("content size: {0} byte".format(sys.getsizeof(content)))
@@ -184,7 +186,7 @@ class SasEmitter(BaseHttpEmitter, IEmitter):
                 logger.error(
                     "POST to %s resulted in exception (attempt %d of %d), "
                     "Exiting." % (self.url, attempt + 1, self.max_retries))
-                break
+                return False
             except requests.exceptions.RequestException as e:
                 logger.exception(e)
                 logger.error(
@@ -199,4 +201,5 @@ class SasEmitter(BaseHttpEmitter, IEmitter):
                               response.text, attempt + 1, self.max_retries))
                 time.sleep(2.0 ** attempt * 0.1)
             else:
-                break
+                return True
+        return False
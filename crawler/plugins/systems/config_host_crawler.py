@@ -1,13 +1,19 @@
 import logging
+import os
 
+import utils.misc
 from icrawl_plugin import IHostCrawler
-from utils.config_utils import crawl_config_files
+from utils.config_utils import crawl_config_files, crawl_watched_config_files
+from utils.file_watcher import TreeWatcher
 
 logger = logging.getLogger('crawlutils')
 
 
 class ConfigHostCrawler(IHostCrawler):
 
+    def __init__(self):
+        self._watcher = None
+
     def get_feature(self):
         return 'config'
 
@@ -35,9 +41,44 @@ class ConfigHostCrawler(IHostCrawler):
                 '/etc/ssh/sshd_config',
                 '/etc/sudoers'],
             discover_config_files=False,
+            watch='False',
             **kwargs):
+        """
+        :param watch: 'True' to crawl the config files once, and then only
+        the ones inotify reports as added, changed or removed since the
+        previous crawl (see `utils.file_watcher.TreeWatcher`). Only the dirs
+        of the known config files are watched, unless
+        discover_config_files is set.
+        """
+        if watch == 'True':
+            watcher = self._get_watcher(root_dir, exclude_dirs,
+                                        known_config_files,
+                                        discover_config_files)
+            if watcher is not None:
+                return crawl_watched_config_files(
+                    watcher,
+                    known_config_files=known_config_files,
+                    discover_config_files=discover_config_files)
         return crawl_config_files(
             root_dir=root_dir,
             exclude_dirs=exclude_dirs,
             known_config_files=known_config_files,
             discover_config_files=discover_config_files)
+
+    def _get_watcher(self, root_dir, exclude_dirs, known_config_files,
+                     discover_config_files):
+        if self._watcher is not None:
+            return self._watcher
+        dirs = None
+        if not discover_config_files:
+            dirs = sorted(set(os.path.dirname(
+                utils.misc.join_abs_paths(root_dir, f))
+                for f in known_config_files))
+        try:
+            self._watcher = TreeWatcher(
+                root_dir, [utils.misc.join_abs_paths(root_dir, d)
+                           for d in exclude_dirs], dirs)
+        except OSError as exc:
+            logger.warning('Can not watch the config files, crawling all '
+                           'of them: %s' % exc)
+        return self._watcher
@@ -1,22 +1,75 @@
 import logging
+import os
+import threading
 
-import utils.dockerutils
+from container_context import get_container_context
 from icrawl_plugin import IContainerCrawler
-from utils.connection_utils import crawl_connections
-from utils.namespace import run_as_another_namespace, ALL_NAMESPACES
+from utils import procfs
+from utils.connection_utils import (crawl_connections,
+                                    crawl_connections_from_records,
+                                    crawl_connections_from_sockets)
+from utils.namespace import (run_as_another_namespace, ALL_NAMESPACES,
+                             NamespaceCrawl)
 
 logger = logging.getLogger('crawlutils')
 
 
 class ConnectionContainerCrawler(IContainerCrawler):
 
+    """
+    With the procfs reader enabled, the connections are read from the host
+    /proc without entering the container namespaces: the sockets of every
+    network namespace from /proc/<pid>/net, and the processes with each
+    socket open from a sweep of /proc/*/fd done once per crawl for all
+    the containers (in `prepare_crawl`). Containers crawled without it,
+    like the ones found by polling, sweep again if they were not there.
+    """
+
+    def __init__(self):
+        self._socket_pids = {}
+        self._swept_ids = set()
+        # connections per network namespace inode, since the last sweep
+        self._connections = {}
+        self._sweeps = 0
+        # containers are crawled concurrently by the pool threads
+        self._lock = threading.Lock()
+
     def get_feature(self):
         return 'connection'
 
-    def crawl(self, container_id, avoid_setns=False, **kwargs):
-        inspect = utils.dockerutils.exec_dockerinspect(container_id)
-        state = inspect['State']
-        pid = str(state['Pid'])
+    def prepare_crawl(self, containers, **kwargs):
+        if procfs.use_procfs():
+            self._sweep_sockets(set(c.long_id for c in containers))
+
+    def _sweep_sockets(self, long_ids):
+        with self._lock:
+            self._sweep_sockets_locked(long_ids)
+
+    def _sweep_sockets_locked(self, long_ids):
+        self._socket_pids = procfs.read_socket_pids()
+        self._connections = {}
+        self._swept_ids = long_ids
+        self._sweeps += 1
+
+    def get_namespace_crawl(self, container_id, avoid_setns=False,
+                            context=None, **kwargs):
+        if (avoid_setns or procfs.use_procfs() or
+                (context and context.processes is not None)):
+            return None
+        return NamespaceCrawl(ALL_NAMESPACES, crawl_connections, ())
+
+    def crawl(self, container_id, avoid_setns=False, context=None, **kwargs):
+        context = get_container_context(container_id, context)
+        if context.processes is not None:
+            # The processes were read from the host /proc, and so is the
+            # network namespace of the container.
+            connections = procfs.read_connections(
+                os.path.join(procfs.PROC_DIR, str(context.pid)))
+            return list(crawl_connections_from_records(context.processes,
+                                                       connections))
+        if procfs.use_procfs():
+            return list(self._crawl_from_host(context))
+        pid = context.pid
         logger.debug(
             'Crawling %s for container %s' %
             (self.get_feature(), container_id))
@@ -24,6 +77,29 @@ class ConnectionContainerCrawler(IContainerCrawler):
         if avoid_setns:
             raise NotImplementedError('avoidsetns mode not implemented')
         else:  # in all other cases, including wrong mode set
-            return run_as_another_namespace(pid,
-                                            ALL_NAMESPACES,
-                                            crawl_connections)
+            call = self.get_namespace_crawl(container_id)
+            return run_as_another_namespace(pid, call.namespaces,
+                                            call.function, *call.args)
+
+    def _crawl_from_host(self, context):
+        namespaces = context.namespace_inodes
+        net_namespace = namespaces.get('net')
+        sweeps = self._sweeps
+        with self._lock:
+            if context.long_id not in self._swept_ids:
+                if self._sweeps == sweeps:
+                    # Not there at the last sweep, like containers just
+                    # started. Any sweep done since we got here found it.
+                    self._sweep_sockets_locked(self._swept_ids)
+                self._swept_ids.add(context.long_id)
+            socket_pids = self._socket_pids
+            connections = self._connections.get(net_namespace)
+        if connections is None:
+            connections = procfs.read_connections(
+                os.path.join(procfs.PROC_DIR, str(context.pid)))
+            if net_namespace is not None:
+                with self._lock:
+                    connections = self._connections.setdefault(
+                        net_namespace, connections)
+        return crawl_connections_from_sockets(connections, socket_pids,
+                                              namespaces.get('pid'))
@@ -1,7 +1,9 @@
 import logging
 
 from icrawl_plugin import IHostCrawler
+from utils import pid_resolver
 from utils.connection_utils import crawl_connections
+from utils.features import HostConnectionFeature
 
 logger = logging.getLogger('crawlutils')
 
@@ -11,7 +13,16 @@ class ConnectionHostCrawler(IHostCrawler):
     def get_feature(self):
         return 'connection'
 
-    def crawl(self, **kwargs):
+    def crawl(self, container_ids='False', **kwargs):
+        """
+        :param container_ids: 'True' to crawl HostConnectionFeatures, with
+        the ID of the container of the process with every socket open, and
+        its kubernetes pod.
+        """
         logger.debug('Crawling %s' % (self.get_feature()))
 
-        return crawl_connections()
+        features = crawl_connections()
+        if container_ids == 'True':
+            return pid_resolver.tag_containers(features,
+                                               HostConnectionFeature)
+        return features
@@ -2,41 +2,89 @@ import logging
 import re
 import time
 
-import psutil
-
 from dockercontainer import DockerContainer
 from icrawl_plugin import IContainerCrawler
+from utils import host_snapshot
+from utils.counter_rates import CounterRates
+from utils.crawler_exceptions import ContainerWithoutCgroups
 from utils.features import CpuFeature
 
 logger = logging.getLogger('crawlutils')
 
+# Seconds between the first two cpu usage samples of a container.
+FIRST_SAMPLE_INTERVAL = 0.1
+
 
 class CpuContainerCrawler(IContainerCrawler):
 
     """
-    To calculate rates like packets sent per second, we need to
-    store the last measurement. We store it in this dictionary.
+    To calculate the cpu usage, we need to store the last measurement of
+    the cpu time used by every container.
     """
 
     def __init__(self):
-        self._cached_values = {}
-
-    def _cache_put_value(self, key, value):
-        self._cached_values[key] = (value, time.time())
-
-    def _cache_get_value(self, key):
-        if key in self._cached_values:
-            return self._cached_values[key]
-        else:
-            return None, None
-
-    def _save_container_cpu_times(self, container_long_id, times):
-        cache_key = container_long_id
-        self._cache_put_value(cache_key, times)
+        self._cpu_rates = CounterRates()
+
+    def prepare_crawl(self, containers, per_cpu=False, **kwargs):
+        """
+        Takes a first sample of the cpu usage of all the containers without
+        one, and sleeps once for all of them, so that `crawl` does not have
+        to sleep for every new container.
+        """
+        stat_file_name = self._get_stat_file_name(per_cpu)
+        start = time.time()
+        samples = {}
+        for container in containers:
+            if self._cpu_rates.has_sample(container.long_id, stat_file_name):
+                continue
+            try:
+                samples[container.long_id] = {
+                    stat_file_name: self._read_cpu_usage(container,
+                                                         stat_file_name)}
+            except (IOError, OSError, ContainerWithoutCgroups) as exc:
+                # crawl() will fail for it too
+                logger.debug('Could not read the cpu usage of %s: %s'
+                             % (container.long_id, exc))
+        if samples:
+            self._cpu_rates.bulk_rates(samples)
+            logger.debug('Sleeping once for the first cpu sample of %d '
+                         'containers' % len(samples))
+            time.sleep(max(0, FIRST_SAMPLE_INTERVAL -
+                           (time.time() - start)))
+
+    def _get_stat_file_name(self, per_cpu):
+        if per_cpu:
+            return 'cpuacct.usage_percpu'
+        return 'cpuacct.usage'
+
+    def _read_cpu_usage(self, container, stat_file_name):
+        with open(container.get_cpu_cgroup_path(stat_file_name), 'r') as f:
+            return [float(usage) for usage in
+                    f.readline().strip().split(' ')]
+
+    def _get_cpu_usage_rates(self, container, stat_file_name):
+        """
+        Returns the nanoseconds of cpu used per second by the container (one
+        per cpu if `stat_file_name` is 'cpuacct.usage_percpu').
+        """
+        usage_t1 = self._read_cpu_usage(container, stat_file_name)
+        rates = self._cpu_rates.rate(container.long_id, stat_file_name,
+                                     usage_t1)
+        if rates is not None:
+            logger.debug('Using previous cpu times for container %s'
+                         % container.long_id)
+            return rates
 
-    def _get_prev_container_cpu_times(self, container_long_id):
-        cache_key = container_long_id
-        return self._cache_get_value(cache_key)
+        logger.debug(
+            'There are no previous cpu times for container %s '
+            'so we will be sleeping for 100 milliseconds' %
+            container.long_id)
+        interval = FIRST_SAMPLE_INTERVAL
+        time.sleep(interval)
+        usage_t2 = self._read_cpu_usage(container, stat_file_name)
+        # Store the cpu times for the next crawl
+        self._cpu_rates.rate(container.long_id, stat_file_name, usage_t2)
+        return [(t2 - t1) / interval for (t1, t2) in zip(usage_t1, usage_t2)]
 
     def _get_scaling_factor(self, container, per_cpu):
         if per_cpu:
@@ -66,17 +114,21 @@ class CpuContainerCrawler(IContainerCrawler):
     def get_feature(self):
         return 'cpu'
 
-    def crawl(self, container_id, avoid_setns=False, per_cpu=False, **kwargs):
+    def crawl(self, container_id, avoid_setns=False, per_cpu=False,
+              context=None, **kwargs):
         logger.debug(
             'Crawling %s for container %s' %
             (self.get_feature(), container_id))
 
         self.metric_type_absolute = kwargs.get('metric_type_absolute', 'False')
 
-        container = DockerContainer(container_id)
+        # The context has the cgroup paths of the container, so we do not
+        # need a DockerContainer if we have it.
+        container = context or DockerContainer(container_id)
 
         host_cpu_feature = {}
-        for (idx, cpu) in enumerate(psutil.cpu_times_percent(percpu=True)):
+        cpu_times_percent = host_snapshot.get_snapshot().cpu_times_percent
+        for (idx, cpu) in enumerate(cpu_times_percent):
             host_cpu_feature[idx] = CpuFeature(
                 cpu.idle,
                 cpu.nice,
@@ -87,38 +139,9 @@ class CpuContainerCrawler(IContainerCrawler):
                 cpu.steal,
                 100 - int(cpu.idle),
             )
-        if per_cpu:
-            stat_file_name = 'cpuacct.usage_percpu'
-        else:
-            stat_file_name = 'cpuacct.usage'
-
-        (cpu_usage_t1, prev_time) = (
-            self._get_prev_container_cpu_times(container.long_id))
+        stat_file_name = self._get_stat_file_name(per_cpu)
 
-        if cpu_usage_t1:
-            logger.debug('Using previous cpu times for container %s'
-                         % container.long_id)
-            interval = time.time() - prev_time
-        else:
-            logger.debug(
-                'There are no previous cpu times for container %s '
-                'so we will be sleeping for 100 milliseconds' %
-                container.long_id)
-
-            with open(container.get_cpu_cgroup_path(stat_file_name),
-                      'r') as f:
-                cpu_usage_t1 = f.readline().strip().split(' ')
-            interval = 0.1  # sleep for 100ms
-            time.sleep(interval)
-
-        with open(container.get_cpu_cgroup_path(stat_file_name),
-                  'r') as f:
-            cpu_usage_t2 = f.readline().strip().split(' ')
-
-        # Store the cpu times for the next crawl
-
-        self._save_container_cpu_times(container.long_id,
-                                       cpu_usage_t2)
+        cpu_usage_rates = self._get_cpu_usage_rates(container, stat_file_name)
 
         cpu_user_system = {}
         path = container.get_cpu_cgroup_path('cpuacct.stat')
@@ -129,20 +152,17 @@ class CpuContainerCrawler(IContainerCrawler):
                     cpu_user_system[m.group(1)] = \
                         float(m.group(2))
 
-        for (index, cpu_usage_ns) in enumerate(cpu_usage_t1):
-            usage_secs = (float(cpu_usage_t2[index]) -
-                          float(cpu_usage_ns)) / float(1e9)
-
-            # Interval is never 0 because of step 0 (forcing a sleep)
+        for (index, cpu_usage_rate) in enumerate(cpu_usage_rates):
+            # seconds of cpu used per second
+            usage = cpu_usage_rate / float(1e9)
 
             # for fractional / multicore container
             scaling_factor = self._get_scaling_factor(container, per_cpu)
             if self.metric_type_absolute == 'True':
-                usage_percent = usage_secs / interval * 100.0
-                idle = (scaling_factor * interval - usage_secs) / \
-                    interval * 100.0
+                usage_percent = usage * 100.0
+                idle = (scaling_factor - usage) * 100.0
             else:
-                usage_percent = usage_secs / scaling_factor / interval * 100.0
+                usage_percent = usage / scaling_factor * 100.0
                 idle = 100 - usage_percent
 
             if idle < 0:
@@ -1,9 +1,10 @@
 import logging
 
-import utils.dockerutils
+from container_context import get_container_context
 from icrawl_plugin import IContainerCrawler
 from utils.disk_utils import crawl_disk_partitions
-from utils.namespace import run_as_another_namespace, ALL_NAMESPACES
+from utils.namespace import (run_as_another_namespace, ALL_NAMESPACES,
+                             NamespaceCrawl)
 
 logger = logging.getLogger('crawlutils')
 
@@ -13,10 +14,14 @@ class DiskContainerCrawler(IContainerCrawler):
     def get_feature(self):
         return 'disk'
 
-    def crawl(self, container_id, avoid_setns=False, **kwargs):
-        inspect = utils.dockerutils.exec_dockerinspect(container_id)
-        state = inspect['State']
-        pid = str(state['Pid'])
+    def get_namespace_crawl(self, container_id, avoid_setns=False, **kwargs):
+        if avoid_setns:
+            return None
+        return NamespaceCrawl(ALL_NAMESPACES, crawl_disk_partitions, ())
+
+    def crawl(self, container_id, avoid_setns=False, context=None, **kwargs):
+        context = get_container_context(container_id, context)
+        pid = context.pid
         logger.debug(
             'Crawling %s for container %s' %
             (self.get_feature(), container_id))
@@ -24,6 +29,6 @@ class DiskContainerCrawler(IContainerCrawler):
         if avoid_setns:
             raise NotImplementedError('avoidsetns mode not implemented')
         else:  # in all other cases, including wrong mode set
-            return run_as_another_namespace(pid,
-                                            ALL_NAMESPACES,
-                                            crawl_disk_partitions)
+            call = self.get_namespace_crawl(container_id)
+            return run_as_another_namespace(pid, call.namespaces,
+                                            call.function, *call.args)
@@ -1,8 +1,8 @@
 import logging
-import time
 import psutil
 
 from icrawl_plugin import IHostCrawler
+from utils.counter_rates import CounterRates
 from utils.features import DiskioFeature
 
 logger = logging.getLogger('crawlutils')
@@ -15,17 +15,7 @@ class DiskioHostCrawler(IHostCrawler):
     '''
 
     def __init__(self):
-        self._cached_values = {}
-        self._previous_rates = {}
-
-    def _cache_put_value(self, key, value):
-        self._cached_values[key] = (value, time.time())
-
-    def _cache_get_value(self, key):
-        if key in self._cached_values:
-            return self._cached_values[key]
-        else:
-            return None, None
+        self._rates = CounterRates()
 
     def _crawl_disk_io_counters(self):
         try:
@@ -56,35 +46,17 @@ class DiskioHostCrawler(IHostCrawler):
 
             feature_key = '{0}-{1}'.format('diskio', device_name)
             cache_key = '{0}-{1}'.format('INVM', feature_key)
-            (prev_counters, prev_time) = self._cache_get_value(cache_key)
-            self._cache_put_value(cache_key, curr_counters)
-
-            if prev_counters and prev_time:
-                # Compute the rates (per second) for each attribute, namely:
-                #   read_op/s, write_op/s, read_bytes/s, and write_bytes/s
-                time_diff = time.time() - prev_time
-                rates = [
-                    round(
-                        (a - b) / time_diff,
-                        2) for (
-                        a,
-                        b) in zip(
-                        curr_counters,
-                        prev_counters)]
-                for i in range(len(rates)):
-                    if rates[i] < 0:
-                        # The corresponding OS counter has wrapped
-                        # For now, let's return the previous measurement
-                        # to avoid a huge drop on the metric graph
-                        rates[i] = self._previous_rates[device_name][i]
-                        logger.debug(
-                            u'Counter "{0}" for device {1} has wrapped'.
-                            format(i, device_name))
+            # Compute the rates (per second) for each attribute, namely:
+            #   read_op/s, write_op/s, read_bytes/s, and write_bytes/s
+            # If an OS counter wrapped, we get its previous rate, to avoid a
+            # huge drop on the metric graph.
+            rates = self._rates.rate(cache_key, None, curr_counters)
+            if rates is not None:
+                rates = [round(rate, 2) for rate in rates]
             else:
                 # first measurement
                 rates = [0] * 4
 
-            self._previous_rates[device_name] = rates
             logger.debug(
                 u'Disk I/O counters rates- {0}: {1}'.format(device_name,
                                                             rates))
@@ -11,7 +11,12 @@ class DockerhistoryContainerCrawler(IContainerCrawler):
     def get_feature(self):
         return 'dockerhistory'
 
-    def crawl(self, container_id, avoid_setns=False, **kwargs):
-        history = exec_docker_history(container_id)
+    def crawl(self, container_id, avoid_setns=False, context=None,
+              **kwargs):
+        if context is not None:
+            history = exec_docker_history(container_id,
+                                          inspect=context.inspect)
+        else:
+            history = exec_docker_history(container_id)
         image_id = history[0]['Id']
         yield (image_id, {'history': history}, 'dockerhistory')
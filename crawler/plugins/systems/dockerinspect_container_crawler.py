@@ -11,6 +11,10 @@ class DockerinspectContainerCrawler(IContainerCrawler):
     def get_feature(self):
         return 'dockerinspect'
 
-    def crawl(self, container_id, avoid_setns=False, **kwargs):
-        inspect = exec_dockerinspect(container_id)
+    def crawl(self, container_id, avoid_setns=False, context=None,
+              **kwargs):
+        if context is not None:
+            inspect = context.inspect
+        else:
+            inspect = exec_dockerinspect(container_id)
         yield (container_id, inspect, 'dockerinspect')
@@ -1,54 +1,171 @@
 import logging
 
-import utils.dockerutils
 import utils.misc
+from container_context import get_container_context
 from icrawl_plugin import IContainerCrawler
-from utils.file_utils import crawl_files
-from utils.namespace import run_as_another_namespace
+from utils import file_hashes, file_index
+from utils.file_utils import FileVisitor, crawl_files
+from utils.fs_walker import WalkCrawl
+from utils.namespace import run_as_another_namespace_stream, NamespaceCrawl
 
 logger = logging.getLogger('crawlutils')
 
+DEFAULT_EXCLUDE_DIRS = [
+    '/boot',
+    '/dev',
+    '/proc',
+    '/sys',
+    '/mnt',
+    '/tmp',
+    '/var/cache',
+    '/usr/share/man',
+    '/usr/share/doc',
+    '/usr/share/mime']
+
 
 class FileContainerCrawler(IContainerCrawler):
 
+    """
+    With incremental = True, the files crawled are saved in an index under
+    `index_dir`, and only the files added, changed or removed since the
+    previous crawl of the container are emitted (see
+    `utils.file_index.crawl_changed_files`).
+
+    With walk_workers > 1, the files are walked by that many threads.
+
+    With hash = True, the features get the `hash_algorithm` digest of the
+    content of the files matching `hash_include` (all if empty) of up to
+    `hash_max_size` bytes (any if 0). The digests are cached under
+    `hash_cache_dir`, so only the files whose stat changed since the
+    previous crawl are read (see `utils.file_hashes.FileHasher`). The
+    files are read from the host, through the container rootfs or
+    /proc/<pid>/root.
+    """
+
     def get_feature(self):
         return 'file'
 
+    def prepare_crawl(self, containers, incremental='False',
+                      index_dir=file_index.DEFAULT_INDEX_DIR, hash='False',
+                      hash_cache_dir=file_hashes.DEFAULT_CACHE_DIR, **kwargs):
+        container_ids = set(container.long_id for container in containers)
+        if incremental == 'True':
+            file_index.remove_indexes(index_dir, container_ids)
+        if hash == 'True':
+            file_index.remove_indexes(hash_cache_dir, container_ids)
+
+    def _get_namespace_crawl(
+            self,
+            container_id=None,
+            avoid_setns=False,
+            root_dir='/',
+            exclude_dirs=DEFAULT_EXCLUDE_DIRS,
+            walk_workers=1,
+            **kwargs):
+        if avoid_setns:
+            return None
+        return NamespaceCrawl(['mnt'], crawl_files,
+                              (root_dir, exclude_dirs, None, 0,
+                               int(walk_workers)))
+
+    def get_walk_visitor(
+            self,
+            container_id=None,
+            avoid_setns=False,
+            root_dir='/',
+            exclude_dirs=DEFAULT_EXCLUDE_DIRS,
+            context=None,
+            walk_workers=1,
+            **kwargs):
+        if not avoid_setns:
+            return WalkCrawl(FileVisitor(root_dir, exclude_dirs,
+                                         workers=int(walk_workers)), False)
+        rootfs_dir = get_container_context(container_id, context).rootfs
+        visitor = FileVisitor(
+            utils.misc.join_abs_paths(rootfs_dir, root_dir),
+            [utils.misc.join_abs_paths(rootfs_dir, d) for d in exclude_dirs],
+            root_dir_alias=root_dir,
+            workers=int(walk_workers))
+        return WalkCrawl(visitor, True)
+
+    def crawl_from_walk(self, container_id, features, context=None,
+                        **kwargs):
+        return self._get_changed_files(container_id, features,
+                                       context=context, **kwargs)
+
     def crawl(
             self,
             container_id=None,
             avoid_setns=False,
             root_dir='/',
-            exclude_dirs=[
-                '/boot',
-                '/dev',
-                '/proc',
-                '/sys',
-                '/mnt',
-                '/tmp',
-                '/var/cache',
-                '/usr/share/man',
-                '/usr/share/doc',
-                '/usr/share/mime'],
+            exclude_dirs=DEFAULT_EXCLUDE_DIRS,
+            context=None,
+            walk_workers=1,
             **kwargs):
-        inspect = utils.dockerutils.exec_dockerinspect(container_id)
-        state = inspect['State']
-        pid = str(state['Pid'])
+        features = self._crawl_files(container_id, avoid_setns, root_dir,
+                                     exclude_dirs, context,
+                                     int(walk_workers))
+        return self._get_changed_files(container_id, features,
+                                       avoid_setns=avoid_setns,
+                                       root_dir=root_dir, context=context,
+                                       **kwargs)
+
+    def _get_changed_files(
+            self,
+            container_id,
+            features,
+            avoid_setns=False,
+            root_dir='/',
+            context=None,
+            incremental='False',
+            index_dir=file_index.DEFAULT_INDEX_DIR,
+            full_resync_interval=0,
+            hash='False',
+            hash_algorithm='sha256',
+            hash_max_size=0,
+            hash_include=[],
+            hash_cache_dir=file_hashes.DEFAULT_CACHE_DIR,
+            **kwargs):
+        if hash != 'True' and incremental != 'True':
+            return features
+        if hash == 'True':
+            context = get_container_context(container_id, context)
+            if avoid_setns:
+                rootfs_dir = context.rootfs
+            else:
+                rootfs_dir = '/proc/%d/root' % context.pid
+            hasher = file_hashes.FileHasher(
+                file_index.get_index_path(hash_cache_dir, container_id,
+                                          root_dir),
+                hash_algorithm, int(hash_max_size), hash_include)
+            features = file_hashes.hash_files(features, rootfs_dir, hasher)
+        if incremental != 'True':
+            return features
+        return file_index.crawl_changed_files(
+            features,
+            file_index.get_index_path(index_dir, container_id, root_dir),
+            float(full_resync_interval))
+
+    def _crawl_files(self, container_id, avoid_setns, root_dir,
+                     exclude_dirs, context, walk_workers=1):
+        context = get_container_context(container_id, context)
+        pid = context.pid
         logger.debug('Crawling file for container %s' % container_id)
 
         if avoid_setns:
-            rootfs_dir = utils.dockerutils.get_docker_container_rootfs_path(
-                container_id)
+            rootfs_dir = context.rootfs
             exclude_dirs = [utils.misc.join_abs_paths(rootfs_dir, d)
                             for d in exclude_dirs]
             return crawl_files(
                 root_dir=utils.misc.join_abs_paths(rootfs_dir, root_dir),
                 exclude_dirs=exclude_dirs,
-                root_dir_alias=root_dir)
+                root_dir_alias=root_dir,
+                workers=walk_workers)
         else:  # in all other cases, including wrong mode set
-            return run_as_another_namespace(pid,
-                                            ['mnt'],
-                                            crawl_files,
-                                            root_dir,
-                                            exclude_dirs,
-                                            None)
+            call = self._get_namespace_crawl(container_id,
+                                             root_dir=root_dir,
+                                             exclude_dirs=exclude_dirs,
+                                             walk_workers=walk_workers)
+            # Streamed, as a container can have millions of files
+            return run_as_another_namespace_stream(pid, call.namespaces,
+                                                   call.function, *call.args)
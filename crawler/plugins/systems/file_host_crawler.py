@@ -1,9 +1,19 @@
+import logging
+import os
+
 from icrawl_plugin import IHostCrawler
-from utils.file_utils import crawl_files
+from utils import file_hashes, file_index
+from utils.file_utils import crawl_files, crawl_watched_files
+from utils.file_watcher import TreeWatcher
+
+logger = logging.getLogger('crawlutils')
 
 
 class FileHostCrawler(IHostCrawler):
 
+    def __init__(self):
+        self._watcher = None
+
     def get_feature(self):
         return 'file'
 
@@ -21,6 +31,60 @@ class FileHostCrawler(IHostCrawler):
                 '/usr/share/man',
                 '/usr/share/doc',
                 '/usr/share/mime'],
+            incremental='False',
+            index_dir=file_index.DEFAULT_INDEX_DIR,
+            full_resync_interval=0,
+            walk_workers=1,
+            watch='False',
+            hash='False',
+            hash_algorithm='sha256',
+            hash_max_size=0,
+            hash_include=[],
+            hash_cache_dir=file_hashes.DEFAULT_CACHE_DIR,
             **kwargs):
-        return crawl_files(root_dir=root_dir,
-                           exclude_dirs=exclude_dirs)
+        """
+        :param incremental: 'True' to only crawl the files added, changed
+        or removed since the previous crawl (see
+        `utils.file_index.crawl_changed_files`), saved under `index_dir`.
+        :param walk_workers: number of threads walking the files.
+        :param watch: 'True' to walk the files once, and then only crawl
+        the ones inotify reports as added, changed or removed since the
+        previous crawl (see `utils.file_watcher.TreeWatcher`).
+        :param hash: 'True' to add the `hash_algorithm` digest of the
+        content of the files matching `hash_include` (all if empty) of up
+        to `hash_max_size` bytes (any if 0), cached under `hash_cache_dir`
+        (see `utils.file_hashes.FileHasher`).
+        """
+        watcher = None
+        if watch == 'True':
+            watcher = self._get_watcher(root_dir, exclude_dirs)
+        if watcher is not None:
+            # already only the changed files
+            features = crawl_watched_files(watcher)
+            incremental = 'False'
+        else:
+            features = crawl_files(root_dir=root_dir,
+                                   exclude_dirs=exclude_dirs,
+                                   workers=int(walk_workers))
+        if hash == 'True':
+            hasher = file_hashes.FileHasher(
+                file_index.get_index_path(hash_cache_dir, 'host', root_dir),
+                hash_algorithm, int(hash_max_size), hash_include)
+            features = file_hashes.hash_files(features, '/', hasher,
+                                              complete=watcher is None)
+        if incremental != 'True':
+            return features
+        return file_index.crawl_changed_files(
+            features, file_index.get_index_path(index_dir, 'host', root_dir),
+            float(full_resync_interval))
+
+    def _get_watcher(self, root_dir, exclude_dirs):
+        if self._watcher is None:
+            try:
+                self._watcher = TreeWatcher(
+                    root_dir, [os.path.join(root_dir, d)
+                               for d in exclude_dirs])
+            except OSError as exc:
+                logger.warning('Can not watch the files, crawling all of '
+                               'them: %s' % exc)
+        return self._watcher
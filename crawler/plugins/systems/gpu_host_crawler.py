@@ -3,9 +3,8 @@ import ctypes
 import platform
 import os
 import sys
-import psutil
 from icrawl_plugin import IHostCrawler
-from utils.dockerutils import exec_dockerps
+from utils import pid_resolver
 from utils.misc import get_host_ipaddr
 
 logger = logging.getLogger('crawlutils')
@@ -51,15 +50,6 @@ class GPUHostCrawler(IHostCrawler):
         except pynvml.NVMLError, err:
             logger.debug('Failed to shutdown NVML: ', err)
 
-    def _get_children_pids(self, pid):
-        try:
-            p = psutil.Process(pid=pid)
-            child_pids = [c.pid for c in p.children(recursive=True)]
-            return child_pids
-        except:
-            logger.debug(sys.exc_info()[0])
-            return []
-
     def _get_container_label(self, envs):
         for env in envs:
             label = env.split("=")
@@ -70,24 +60,21 @@ class GPUHostCrawler(IHostCrawler):
         return None
 
     def _get_containerid_from_pid(self, pid):
-        # possible race conditions / stale info
-        for inspect in self.inspect_arr:
-            state = inspect['State']
-            cont_pid = int(state['Pid'])
-            cont_name = inspect['Name']
-            cont_child_pids = self._get_children_pids(cont_pid)
-            if pid in cont_child_pids:
-                labels = inspect['Config']['Labels']
-                envs = inspect['Config']['Env']
-                namespace = labels.get('io.kubernetes.pod.namespace', 'NA')
-                pod_name = labels.get('io.kubernetes.pod.name', cont_name)
-                # following change is specific to DlaaS usecase
-                label = self._get_container_label(envs)
-                if not label:
-                    label = pod_name
-                name = "{}.{}".format(namespace, label)
-                return name
-        return 'NA.NA'
+        long_id = pid_resolver.get_container_id(pid)
+        inspect = long_id and pid_resolver.get_container_inspect(long_id)
+        if not inspect:
+            return 'NA.NA'
+        cont_name = inspect['Name']
+        labels = inspect['Config']['Labels'] or {}
+        envs = inspect['Config']['Env'] or []
+        namespace = labels.get('io.kubernetes.pod.namespace', 'NA')
+        pod_name = labels.get('io.kubernetes.pod.name', cont_name)
+        # following change is specific to DlaaS usecase
+        label = self._get_container_label(envs)
+        if not label:
+            label = pod_name
+        name = "{}.{}".format(namespace, label)
+        return name
 
     def _get_container_id(self, gpuhandle):
         cont_ids = []
@@ -132,8 +119,6 @@ class GPUHostCrawler(IHostCrawler):
         if self._init_nvml() == -1:
             return
 
-        self.inspect_arr = exec_dockerps()
-
         num_gpus = pynvml.nvmlDeviceGetCount()
 
         for gpuid in range(0, num_gpus):
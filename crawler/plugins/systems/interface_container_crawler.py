@@ -1,84 +1,96 @@
 import logging
-import time
+import os
 
 import psutil
 
 from dockercontainer import DockerContainer
 from icrawl_plugin import IContainerCrawler
+from utils import procfs
+from utils.counter_rates import CounterRates
 from utils.features import InterfaceFeature
-from utils.namespace import run_as_another_namespace
+from utils.namespace import run_as_another_namespace, NamespaceCrawl
 
 logger = logging.getLogger('crawlutils')
 
 
+def crawl_interface_counters(counters=None):
+    """
+    Yields the (name, counters) of the interfaces in `counters` (as
+    psutil.net_io_counters(pernic=True) returns them), or of the network
+    namespace we are in. The rates are computed by the plugin, as this
+    runs inside the namespace of a container, maybe in another process.
+    """
+    if counters is None:
+        counters = psutil.net_io_counters(pernic=True)
+    for ifname in counters:
+        interface = counters[ifname]
+        curr_count = [
+            interface.bytes_sent,
+            interface.bytes_recv,
+            interface.packets_sent,
+            interface.packets_recv,
+            interface.errout,
+            interface.errin,
+        ]
+        yield (ifname, curr_count)
+
+
 class InterfaceContainerCrawler(IContainerCrawler):
 
     """
     To calculate rates like packets sent per second, we need to
-    store the last measurement. We store it in this dictionary.
+    store the last measurement. CounterRates does it for us.
     """
 
     def __init__(self):
-        self._cached_values = {}
-
-    def _cache_put_value(self, key, value):
-        self._cached_values[key] = (value, time.time())
-
-    def _cache_get_value(self, key):
-        if key in self._cached_values:
-            return self._cached_values[key]
-        else:
-            return None, None
-
-    def _crawl_interface_counters(self):
-        _counters = psutil.net_io_counters(pernic=True)
-        for ifname in _counters:
-            interface = _counters[ifname]
-            curr_count = [
-                interface.bytes_sent,
-                interface.bytes_recv,
-                interface.packets_sent,
-                interface.packets_recv,
-                interface.errout,
-                interface.errin,
-            ]
-            yield (ifname, curr_count)
+        self._rates = CounterRates()
 
     def get_feature(self):
         return 'interface'
 
-    def crawl(self, container_id, avoid_setns=False, **kwargs):
+    def get_namespace_crawl(self, container_id, avoid_setns=False, **kwargs):
+        if avoid_setns or procfs.use_procfs():
+            return None
+        return NamespaceCrawl(['net'], crawl_interface_counters, ())
+
+    def crawl_from_namespace_result(self, container_id, result,
+                                    context=None, **kwargs):
+        container = context or DockerContainer(container_id)
+        return self._get_interface_features(container, result)
+
+    def crawl(self, container_id, avoid_setns=False, context=None,
+              **kwargs):
 
         logger.debug(
             'Crawling %s for container %s' %
             (self.get_feature(), container_id))
 
-        container = DockerContainer(container_id)
+        container = context or DockerContainer(container_id)
 
-        if avoid_setns:
+        if procfs.use_procfs():
+            # /proc/<pid>/net/dev is the one of the container network
+            # namespace, so we do not need to enter it.
+            interfaces = crawl_interface_counters(procfs.read_net_dev(
+                os.path.join(procfs.PROC_DIR, str(container.pid))))
+        elif avoid_setns:
             raise NotImplementedError('avoidsetns mode not implemented')
         else:
+            call = self.get_namespace_crawl(container_id)
             interfaces = run_as_another_namespace(
-                container.pid, ['net'], self._crawl_interface_counters)
+                container.pid, call.namespaces, call.function, *call.args)
 
+        return self._get_interface_features(container, interfaces)
+
+    def _get_interface_features(self, container, interfaces):
         for (ifname, curr_count) in interfaces:
             feature_key = '{0}-{1}'.format('interface', ifname)
 
-            cache_key = '{0}-{1}-{2}'.format(container.long_id,
-                                             container.pid,
-                                             feature_key)
-
-            (prev_count, prev_time) = self._cache_get_value(cache_key)
-            self._cache_put_value(cache_key, curr_count)
-
-            if prev_count and prev_time:
-                d = time.time() - prev_time
-                diff = [(a - b) / d for (a, b) in zip(curr_count,
-                                                      prev_count)]
-            else:
-
+            # Per container, so they are all forgotten when it is gone
+            diff = self._rates.rate(container.long_id,
+                                    (container.pid, feature_key),
+                                    curr_count)
+            if diff is None:
                 # first measurement
-
                 diff = [0] * 6
 
             feature_attributes = InterfaceFeature._make(diff)
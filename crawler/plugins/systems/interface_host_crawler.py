@@ -1,9 +1,9 @@
 import logging
-import time
 
 import psutil
 
 from icrawl_plugin import IHostCrawler
+from utils.counter_rates import CounterRates
 from utils.features import InterfaceFeature
 
 logger = logging.getLogger('crawlutils')
@@ -13,20 +13,11 @@ class InterfaceHostCrawler(IHostCrawler):
 
     """
     To calculate rates like packets sent per second, we need to
-    store the last measurement. We store it in this dictionary.
+    store the last measurement. CounterRates does it for us.
     """
 
     def __init__(self):
-        self._cached_values = {}
-
-    def _cache_put_value(self, key, value):
-        self._cached_values[key] = (value, time.time())
-
-    def _cache_get_value(self, key):
-        if key in self._cached_values:
-            return self._cached_values[key]
-        else:
-            return None, None
+        self._rates = CounterRates()
 
     def _crawl_interface_counters(self):
         _counters = psutil.net_io_counters(pernic=True)
@@ -55,17 +46,9 @@ class InterfaceHostCrawler(IHostCrawler):
             feature_key = '{0}-{1}'.format('interface', ifname)
             cache_key = '{0}-{1}'.format('INVM', feature_key)
 
-            (prev_count, prev_time) = self._cache_get_value(cache_key)
-            self._cache_put_value(cache_key, curr_count)
-
-            if prev_count and prev_time:
-                d = time.time() - prev_time
-                diff = [(a - b) / d for (a, b) in zip(curr_count,
-                                                      prev_count)]
-            else:
-
+            diff = self._rates.rate(cache_key, None, curr_count)
+            if diff is None:
                 # first measurement
-
                 diff = [0] * 6
 
             feature_attributes = InterfaceFeature._make(diff)
@@ -1,7 +1,7 @@
 import logging
-import time
 
 from icrawl_plugin import IVMCrawler
+from utils.counter_rates import CounterRates
 from utils.features import InterfaceFeature
 
 try:
@@ -17,20 +17,11 @@ class InterfaceVmCrawler(IVMCrawler):
 
     """
     To calculate rates like packets sent per second, we need to
-    store the last measurement. We store it in this dictionary.
+    store the last measurement. CounterRates does it for us.
     """
 
     def __init__(self):
-        self._cached_values = {}
-
-    def _cache_put_value(self, key, value):
-        self._cached_values[key] = (value, time.time())
-
-    def _cache_get_value(self, key):
-        if key in self._cached_values:
-            return self._cached_values[key]
-        else:
-            return None, None
+        self._rates = CounterRates()
 
     def _crawl_interface_counters(self, vm_context):
         for interface in psvmi.interface_iter(vm_context):
@@ -63,19 +54,12 @@ class InterfaceVmCrawler(IVMCrawler):
 
         for (interface_name, curr_count) in interfaces:
             feature_key = '{0}-{1}'.format('interface', interface_name)
-            cache_key = '{0}-{1}'.format('OUTVM', feature_key)
-
-            (prev_count, prev_time) = self._cache_get_value(cache_key)
-            self._cache_put_value(cache_key, curr_count)
-
-            if prev_count and prev_time:
-                d = time.time() - prev_time
-                diff = [(a - b) / d for (a, b) in zip(curr_count,
-                                                      prev_count)]
-            else:
+            cache_key = '{0}-{1}-{2}'.format('OUTVM', domain_name,
+                                             feature_key)
 
+            diff = self._rates.rate(cache_key, None, curr_count)
+            if diff is None:
                 # first measurement
-
                 diff = [0] * 6
 
             feature_attributes = InterfaceFeature._make(diff)
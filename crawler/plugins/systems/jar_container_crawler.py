@@ -1,44 +1,75 @@
 import logging
 
-import utils.dockerutils
 import utils.misc
+from container_context import get_container_context
 from icrawl_plugin import IContainerCrawler
-from utils.jar_utils import crawl_jar_files
-from utils.namespace import run_as_another_namespace
+from utils.fs_walker import WalkCrawl
+from utils.jar_utils import JarVisitor, crawl_jar_files
+from utils.namespace import run_as_another_namespace_stream, NamespaceCrawl
 
 logger = logging.getLogger('crawlutils')
 
+DEFAULT_EXCLUDE_DIRS = [
+    '/boot',
+    '/dev',
+    '/proc',
+    '/sys',
+    '/mnt',
+    '/tmp',
+    '/var/cache',
+    '/usr/share/man',
+    '/usr/share/doc',
+    '/usr/share/mime']
+
 
 class JarContainerCrawler(IContainerCrawler):
 
     def get_feature(self):
         return 'jar'
 
+    def _get_namespace_crawl(
+            self,
+            container_id=None,
+            avoid_setns=False,
+            root_dir='/',
+            exclude_dirs=DEFAULT_EXCLUDE_DIRS,
+            **kwargs):
+        if avoid_setns:
+            return None
+        return NamespaceCrawl(['mnt'], crawl_jar_files,
+                              (root_dir, exclude_dirs, None))
+
+    def get_walk_visitor(
+            self,
+            container_id=None,
+            avoid_setns=False,
+            root_dir='/',
+            exclude_dirs=DEFAULT_EXCLUDE_DIRS,
+            context=None,
+            **kwargs):
+        if not avoid_setns:
+            return WalkCrawl(JarVisitor(root_dir, exclude_dirs), False)
+        rootfs_dir = get_container_context(container_id, context).rootfs
+        visitor = JarVisitor(
+            utils.misc.join_abs_paths(rootfs_dir, root_dir),
+            [utils.misc.join_abs_paths(rootfs_dir, d) for d in exclude_dirs],
+            root_dir_alias=root_dir)
+        return WalkCrawl(visitor, True)
+
     def crawl(
             self,
             container_id=None,
             avoid_setns=False,
             root_dir='/',
-            exclude_dirs=[
-                '/boot',
-                '/dev',
-                '/proc',
-                '/sys',
-                '/mnt',
-                '/tmp',
-                '/var/cache',
-                '/usr/share/man',
-                '/usr/share/doc',
-                '/usr/share/mime'],
+            exclude_dirs=DEFAULT_EXCLUDE_DIRS,
+            context=None,
             **kwargs):
-        inspect = utils.dockerutils.exec_dockerinspect(container_id)
-        state = inspect['State']
-        pid = str(state['Pid'])
+        context = get_container_context(container_id, context)
+        pid = context.pid
         logger.debug('Crawling jars for container %s' % container_id)
 
         if avoid_setns:
-            rootfs_dir = utils.dockerutils.get_docker_container_rootfs_path(
-                container_id)
+            rootfs_dir = context.rootfs
             exclude_dirs = [utils.misc.join_abs_paths(rootfs_dir, d)
                             for d in exclude_dirs]
             return crawl_jar_files(
@@ -46,9 +77,8 @@ class JarContainerCrawler(IContainerCrawler):
                 exclude_dirs=exclude_dirs,
                 root_dir_alias=root_dir)
         else:  # in all other cases, including wrong mode set
-            return run_as_another_namespace(pid,
-                                            ['mnt'],
-                                            crawl_jar_files,
-                                            root_dir,
-                                            exclude_dirs,
-                                            None)
+            call = self._get_namespace_crawl(container_id,
+                                             root_dir=root_dir,
+                                             exclude_dirs=exclude_dirs)
+            return run_as_another_namespace_stream(pid, call.namespaces,
+                                                   call.function, *call.args)
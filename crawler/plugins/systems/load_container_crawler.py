@@ -4,7 +4,8 @@ import os
 from dockercontainer import DockerContainer
 from icrawl_plugin import IContainerCrawler
 from utils.features import LoadFeature
-from utils.namespace import run_as_another_namespace, ALL_NAMESPACES
+from utils.namespace import (run_as_another_namespace, ALL_NAMESPACES,
+                             NamespaceCrawl)
 
 logger = logging.getLogger('crawlutils')
 
@@ -20,8 +21,14 @@ class LoadContainerCrawler(IContainerCrawler):
         feature_attributes = LoadFeature(load[0], load[1], load[1])
         yield (feature_key, feature_attributes, 'load')
 
-    def crawl(self, container_id, avoid_setns=False, **kwargs):
-        container = DockerContainer(container_id)
+    def get_namespace_crawl(self, container_id, avoid_setns=False, **kwargs):
+        if avoid_setns:
+            return None
+        return NamespaceCrawl(ALL_NAMESPACES, self.crawl_load, ())
+
+    def crawl(self, container_id, avoid_setns=False, context=None,
+              **kwargs):
+        container = context or DockerContainer(container_id)
         logger.debug(
             'Crawling %s for container %s' %
             (self.get_feature(), container_id))
@@ -29,6 +36,6 @@ class LoadContainerCrawler(IContainerCrawler):
         if avoid_setns:
             raise NotImplementedError()
         else:  # in all other cases, including wrong mode set
-            return run_as_another_namespace(container.pid,
-                                            ALL_NAMESPACES,
-                                            self.crawl_load)
+            call = self.get_namespace_crawl(container_id)
+            return run_as_another_namespace(container.pid, call.namespaces,
+                                            call.function, *call.args)
@@ -1,9 +1,8 @@
 import logging
 
-import psutil
-
 from dockercontainer import DockerContainer
 from icrawl_plugin import IContainerCrawler
+from utils import host_snapshot
 from utils.features import MemoryFeature
 
 logger = logging.getLogger('crawlutils')
@@ -14,8 +13,9 @@ class MemoryContainerCrawler(IContainerCrawler):
     def get_feature(self):
         return 'memory'
 
-    def crawl(self, container_id, avoid_setns=False, **kwargs):
-        container = DockerContainer(container_id)
+    def crawl(self, container_id, avoid_setns=False, context=None,
+              **kwargs):
+        container = context or DockerContainer(container_id)
 
         used = buffered = cached = free = 'unknown'
         with open(container.get_memory_cgroup_path('memory.stat'
@@ -35,7 +35,7 @@ class MemoryContainerCrawler(IContainerCrawler):
                 'memory.usage_in_bytes'), 'r') as f:
             used = int(f.readline().strip())
 
-        host_free = psutil.virtual_memory().free
+        host_free = host_snapshot.get_snapshot().virtual_memory.free
         container_total = used + min(host_free, limit - used)
         free = container_total - used
 
@@ -1,9 +1,13 @@
 import logging
 
-import utils.dockerutils
+from container_context import get_container_context
 from icrawl_plugin import IContainerCrawler
-from utils.metric_utils import crawl_metrics
-from utils.namespace import run_as_another_namespace, ALL_NAMESPACES
+from utils.metric_utils import (crawl_metric_samples,
+                                crawl_metrics_from_records,
+                                crawl_metrics_from_samples,
+                                get_known_processes)
+from utils.namespace import (run_as_another_namespace, ALL_NAMESPACES,
+                             NamespaceCrawl)
 
 logger = logging.getLogger('crawlutils')
 
@@ -13,10 +17,25 @@ class MetricContainerCrawler(IContainerCrawler):
     def get_feature(self):
         return 'metric'
 
-    def crawl(self, container_id, avoid_setns=False, **kwargs):
-        inspect = utils.dockerutils.exec_dockerinspect(container_id)
-        state = inspect['State']
-        pid = str(state['Pid'])
+    def get_namespace_crawl(self, container_id, avoid_setns=False,
+                            context=None, **kwargs):
+        if avoid_setns or (context and context.processes is not None):
+            return None
+        # the cpu times are kept here, and the sleep for the first sample
+        # of a process is only needed once
+        return NamespaceCrawl(ALL_NAMESPACES, crawl_metric_samples,
+                              (get_known_processes(container_id),))
+
+    def crawl_from_namespace_result(self, container_id, result, **kwargs):
+        return list(crawl_metrics_from_samples(result, container_id))
+
+    def crawl(self, container_id, avoid_setns=False, context=None, **kwargs):
+        context = get_container_context(container_id, context)
+        if context.processes is not None:
+            # already read from the host /proc
+            return list(crawl_metrics_from_records(context.processes,
+                                                   container_id))
+        pid = context.pid
         logger.debug(
             'Crawling %s for container %s' %
             (self.get_feature(), container_id))
@@ -24,6 +43,8 @@ class MetricContainerCrawler(IContainerCrawler):
         if avoid_setns:
             raise NotImplementedError('avoidsetns mode not implemented')
         else:  # in all other cases, including wrong mode set
-            return run_as_another_namespace(pid,
-                                            ALL_NAMESPACES,
-                                            crawl_metrics)
+            call = self.get_namespace_crawl(container_id)
+            return self.crawl_from_namespace_result(
+                container_id,
+                run_as_another_namespace(pid, call.namespaces, call.function,
+                                         *call.args))
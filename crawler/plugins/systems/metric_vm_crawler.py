@@ -1,9 +1,9 @@
 import logging
-import time
 
 import psutil
 
 from icrawl_plugin import IVMCrawler
+from utils.counter_rates import CounterRates
 from utils.features import MetricFeature
 
 try:
@@ -17,21 +17,12 @@ logger = logging.getLogger('crawlutils')
 class MetricVmCrawler(IVMCrawler):
 
     """
-    To calculate rates like packets sent per second, we need to
-    store the last measurement. We store it in this dictionary.
+    To calculate rates like the cpu usage of processes, we need to
+    store the last measurement. CounterRates does it for us.
     """
 
     def __init__(self):
-        self._cached_values = {}
-
-    def _cache_put_value(self, key, value):
-        self._cached_values[key] = (value, time.time())
-
-    def _cache_get_value(self, key):
-        if key in self._cached_values:
-            return self._cached_values[key]
-        else:
-            return None, None
+        self._rates = CounterRates()
 
     def _crawl_metrics_cpu_percent(self, process):
         p = process
@@ -42,25 +33,16 @@ class MetricVmCrawler(IVMCrawler):
 
         curr_proc_cpu_time, curr_sys_cpu_time = p.get_cpu_times()
 
-        (cputimeList, timestamp) = self._cache_get_value(cache_key)
-        self._cache_put_value(
-            cache_key, [curr_proc_cpu_time, curr_sys_cpu_time])
-
-        if cputimeList is not None:
-            prev_proc_cpu_time = cputimeList[0]
-            prev_sys_cpu_time = cputimeList[1]
-
-            if prev_proc_cpu_time and prev_sys_cpu_time:
-                if curr_proc_cpu_time == -1 or prev_proc_cpu_time == -1:
-                    cpu_percent = -1  # unsupported for this VM
-                else:
-                    if curr_sys_cpu_time == prev_sys_cpu_time:
-                        cpu_percent = 0
-                    else:
-                        cpu_percent = (float(curr_proc_cpu_time -
-                                             prev_proc_cpu_time) * 100 /
-                                       float(curr_sys_cpu_time -
-                                             prev_sys_cpu_time))
+        # One entity per process, so they are forgotten once they are gone
+        rates = self._rates.rate(
+            cache_key, None, [curr_proc_cpu_time, curr_sys_cpu_time])
+
+        if rates is not None:
+            (proc_cpu_rate, sys_cpu_rate) = rates
+            if curr_proc_cpu_time == -1:
+                cpu_percent = -1  # unsupported for this VM
+            elif sys_cpu_rate:
+                cpu_percent = proc_cpu_rate * 100 / sys_cpu_rate
 
         return cpu_percent
 
@@ -2,10 +2,11 @@ import logging
 import re
 import subprocess
 import os
-import utils.dockerutils
 
+from container_context import get_container_context
 from icrawl_plugin import IContainerCrawler
-from utils.namespace import run_as_another_namespace, ALL_NAMESPACES
+from utils.namespace import (run_as_another_namespace, ALL_NAMESPACES,
+                             NamespaceCrawl)
 
 logger = logging.getLogger('crawlutils')
 
@@ -74,15 +75,19 @@ class NodePackageCrawler(IContainerCrawler):
             packages += self.get_packages_by_cmd(location)
         return packages
 
-    def crawl(self, container_id, avoid_setns=False, **kwargs):
-        inspect = utils.dockerutils.exec_dockerinspect(container_id)
-        state = inspect['State']
-        pid = str(state['Pid'])
+    def get_namespace_crawl(self, container_id, avoid_setns=False, **kwargs):
+        if avoid_setns:
+            return None
+        return NamespaceCrawl(ALL_NAMESPACES, self.crawl_in_system, ())
+
+    def crawl(self, container_id, avoid_setns=False, context=None, **kwargs):
+        context = get_container_context(container_id, context)
+        pid = context.pid
         logger.debug('Crawling OS for container %s' % container_id)
 
         if avoid_setns:
             raise NotImplementedError()
         else:
-            return run_as_another_namespace(pid,
-                                            ALL_NAMESPACES,
-                                            self.crawl_in_system)
+            call = self.get_namespace_crawl(container_id)
+            return run_as_another_namespace(pid, call.namespaces,
+                                            call.function, *call.args)
@@ -1,8 +1,9 @@
 import logging
 
-import utils.dockerutils
+from container_context import get_container_context
 from icrawl_plugin import IContainerCrawler
-from utils.namespace import run_as_another_namespace, ALL_NAMESPACES
+from utils.namespace import (run_as_another_namespace, ALL_NAMESPACES,
+                             NamespaceCrawl)
 from utils.os_utils import crawl_os, crawl_os_mountpoint
 
 logger = logging.getLogger('crawlutils')
@@ -13,17 +14,20 @@ class OSContainerCrawler(IContainerCrawler):
     def get_feature(self):
         return 'os'
 
-    def crawl(self, container_id, avoid_setns=False, **kwargs):
-        inspect = utils.dockerutils.exec_dockerinspect(container_id)
-        state = inspect['State']
-        pid = str(state['Pid'])
+    def get_namespace_crawl(self, container_id, avoid_setns=False, **kwargs):
+        if avoid_setns:
+            return None
+        return NamespaceCrawl(ALL_NAMESPACES, crawl_os, ())
+
+    def crawl(self, container_id, avoid_setns=False, context=None, **kwargs):
+        context = get_container_context(container_id, context)
+        pid = context.pid
         logger.debug('Crawling OS for container %s' % container_id)
 
         if avoid_setns:
-            mp = utils.dockerutils.get_docker_container_rootfs_path(
-                container_id)
+            mp = context.rootfs
             return crawl_os_mountpoint(mp)
         else:  # in all other cases, including wrong mode set
-            return run_as_another_namespace(pid,
-                                            ALL_NAMESPACES,
-                                            crawl_os)
+            call = self.get_namespace_crawl(container_id)
+            return run_as_another_namespace(pid, call.namespaces,
+                                            call.function, *call.args)
@@ -1,11 +1,11 @@
 import logging
 
+from container_context import get_container_context
 from icrawl_plugin import IContainerCrawler
 from utils.crawler_exceptions import CrawlError
-from utils.dockerutils import (exec_dockerinspect,
-                               get_docker_container_rootfs_path)
 from utils.misc import join_abs_paths
-from utils.namespace import run_as_another_namespace, ALL_NAMESPACES
+from utils.namespace import (run_as_another_namespace, ALL_NAMESPACES,
+                             NamespaceCrawl)
 from utils.package_utils import crawl_packages
 
 logger = logging.getLogger('crawlutils')
@@ -16,34 +16,43 @@ class PackageContainerCrawler(IContainerCrawler):
     def get_feature(self):
         return 'package'
 
+    def get_namespace_crawl(self, container_id=None, avoid_setns=False,
+                            root_dir='/', **kwargs):
+        if avoid_setns:
+            return None
+        return NamespaceCrawl(ALL_NAMESPACES, crawl_packages,
+                              (None, root_dir, 0, False))
+
+    def crawl_from_namespace_error(self, container_id, exc, root_dir='/',
+                                   context=None, **kwargs):
+        if not isinstance(exc, CrawlError):
+            raise exc
+
+        # Retry the crawl avoiding the setns() syscall. This is
+        # needed for PPC where we can not jump into the container and
+        # run its apt or rpm commands.
+
+        context = get_container_context(container_id, context)
+        return crawl_packages(
+            root_dir=join_abs_paths(context.rootfs, root_dir),
+            reload_needed=True)
+
     def crawl(self, container_id=None, avoid_setns=False,
-              root_dir='/', **kwargs):
+              root_dir='/', context=None, **kwargs):
         logger.debug('Crawling packages for container %s' % container_id)
-        inspect = exec_dockerinspect(container_id)
-        state = inspect['State']
-        pid = str(state['Pid'])
+        context = get_container_context(container_id, context)
+        pid = context.pid
 
         if avoid_setns:
-            rootfs_dir = get_docker_container_rootfs_path(
-                container_id)
+            rootfs_dir = context.rootfs
             return crawl_packages(
                 root_dir=join_abs_paths(rootfs_dir, root_dir),
                 reload_needed=True)
         else:  # in all other cases, including wrong mode set
+            call = self.get_namespace_crawl(container_id, root_dir=root_dir)
             try:
-                return run_as_another_namespace(pid,
-                                                ALL_NAMESPACES,
-                                                crawl_packages,
-                                                None,
-                                                root_dir, 0, False)
-            except CrawlError:
-
-                # Retry the crawl avoiding the setns() syscall. This is
-                # needed for PPC where we can not jump into the container and
-                # run its apt or rpm commands.
-
-                rootfs_dir = get_docker_container_rootfs_path(
-                    container_id)
-                return crawl_packages(
-                    root_dir=join_abs_paths(rootfs_dir, root_dir),
-                    reload_needed=True)
+                return run_as_another_namespace(pid, call.namespaces,
+                                                call.function, *call.args)
+            except CrawlError as exc:
+                return self.crawl_from_namespace_error(
+                    container_id, exc, root_dir=root_dir, context=context)
@@ -1,114 +1,318 @@
 import logging
 import os
+from collections import Counter, namedtuple
+
 import psutil
 
-import utils.dockerutils
+from container_context import get_container_context
 from icrawl_plugin import IContainerCrawler
-from utils.features import ProcessFeature
-from utils.namespace import run_as_another_namespace, ALL_NAMESPACES
+from utils import procfs
+from utils.features import (ProcessFeature, ProcessUpdateFeature,
+                            ProcessExitFeature)
+from utils.namespace import (run_as_another_namespace, ALL_NAMESPACES,
+                             NamespaceCrawl)
 
 logger = logging.getLogger('crawlutils')
 
+# Number of paths in the summary of the open and mapped files of a process
+DEFAULT_FILES_SUMMARY_TOP = 10
+
+# The plugin options of a crawl (see `get_options`). They are passed to the
+# functions crawling inside the namespaces of a container, which may run in
+# another process, so they are a plain tuple rather than plugin attributes.
+ProcessOptions = namedtuple('ProcessOptions', [
+    'get_mmap_files', 'max_files', 'files_summary', 'files_summary_top',
+    'incremental'])
+
+
+def get_options(kwargs):
+    """
+    Returns the ProcessOptions in the plugin options `kwargs`:
+
+    get_mmap_files: 'True' to also crawl the files mapped by processes.
+    max_files: max number of open (and mapped) files per process, 0 for
+    no limit.
+    files_summary: 'True' to only crawl the number of open (and mapped)
+    files per process, and the `files_summary_top` paths with the most
+    fds (or mappings).
+    incremental: 'True' for the incremental mode.
+    """
+    return ProcessOptions(
+        get_mmap_files=str(kwargs.get('get_mmap_files')) == 'True',
+        max_files=int(kwargs.get('max_files', 0)),
+        files_summary=str(kwargs.get('files_summary')) == 'True',
+        files_summary_top=int(kwargs.get('files_summary_top',
+                                         DEFAULT_FILES_SUMMARY_TOP)),
+        incremental=str(kwargs.get('incremental')) == 'True')
+
 
 class ProcessContainerCrawler(IContainerCrawler):
 
+    """
+    In the incremental mode, the full process feature is only crawled for
+    the processes that are new since the previous crawl of a container.
+    The ones still running get a 'process-update' feature with just the
+    fields that change, and the ones that exited a 'process-exit' one.
+    """
+
+    def __init__(self):
+        # Per container ID, the feature key of every (pid, create time)
+        # crawled last time, in the incremental mode.
+        self._processes = {}
+
     def get_feature(self):
         return 'process'
 
-    def crawl(self, container_id, avoid_setns=False, **kwargs):
-        inspect = utils.dockerutils.exec_dockerinspect(container_id)
-        state = inspect['State']
-        pid = str(state['Pid'])
+    def prepare_crawl(self, containers, **kwargs):
+        long_ids = set(container.long_id for container in containers)
+        for long_id in set(self._processes) - long_ids:
+            del self._processes[long_id]
+
+    def _get_known_processes(self, container_id, options):
+        if not options.incremental:
+            return {}
+        return self._processes.get(container_id, {})
+
+    def get_namespace_crawl(self, container_id, avoid_setns=False,
+                            context=None, **kwargs):
+        if avoid_setns or (context and context.processes is not None):
+            return None
+        options = get_options(kwargs)
+        return NamespaceCrawl(ALL_NAMESPACES, crawl_processes,
+                              (options, self._get_known_processes(
+                                  container_id, options)))
+
+    def crawl_from_namespace_result(self, container_id, result, **kwargs):
+        return self._diff_processes(container_id, result,
+                                    get_options(kwargs))
+
+    def crawl(self, container_id, avoid_setns=False, context=None, **kwargs):
+        context = get_container_context(container_id, context)
+        options = get_options(kwargs)
+        if context.processes is not None:
+            # already read from the host /proc
+            features = crawl_records(
+                context.processes, options,
+                self._get_known_processes(container_id, options))
+            return self._diff_processes(container_id, features, options)
+        pid = context.pid
         logger.debug('Crawling Processes for container %s' % container_id)
 
         if avoid_setns:
             raise NotImplementedError()
 
-        self.get_mmap_files = kwargs.get('get_mmap_files', 'False')
-
-        return run_as_another_namespace(pid,
-                                        ALL_NAMESPACES,
-                                        self._crawl_in_system)
-
-    def _crawl_in_system(self):
-        created_since = -1
-        for p in psutil.process_iter():
-            create_time = (
-                p.create_time() if hasattr(
-                    p.create_time,
-                    '__call__') else p.create_time)
-            if create_time <= created_since:
-                continue
-            yield self._crawl_single_process(p)
-
-    def _get_mmap_files(self, p):
-        mmapfiles = []
-        if self.get_mmap_files == 'True':
-            for mmap in p.memory_maps():
-                mmap_path = getattr(mmap, 'path')
-                if os.path.isabs(mmap_path):
-                    mmapfiles.append(mmap_path)
-        return mmapfiles
-
-    def _crawl_single_process(self, p):
-        """Returns a ProcessFeature"""
+        call = self.get_namespace_crawl(container_id, **kwargs)
+        features = run_as_another_namespace(pid, call.namespaces,
+                                            call.function, *call.args)
+        return self._diff_processes(container_id, features, options)
+
+    def _diff_processes(self, container_id, features, options):
+        """
+        In the incremental mode, saves the processes crawled in `features`
+        for the next crawl of the container, and returns `features` plus a
+        'process-exit' feature for every process of the previous crawl
+        that is gone.
+        """
+        if not options.incremental:
+            self._processes.pop(container_id, None)
+            return features
+        features = list(features)
+        known = self._processes.get(container_id, {})
+        processes = {}
+        updated = set()
+        for (feature_key, feature, feature_type) in features:
+            if feature_type == 'process':
+                processes[(feature.pid, feature.created)] = feature_key
+            else:
+                updated.add(feature_key)
+        crawled_keys = updated | set(processes.itervalues())
+        for ((pid, create_time), feature_key) in known.iteritems():
+            if feature_key in updated:
+                processes[(pid, create_time)] = feature_key
+            elif feature_key not in crawled_keys:
+                # gone, and not replaced by a process with its pid
+                features.append((feature_key,
+                                 ProcessExitFeature(create_time, pid),
+                                 'process-exit'))
+        self._processes[container_id] = processes
+        return features
+
+
+def crawl_processes(options, known_processes=None):
+    """
+    Crawls the processes of the system with the ProcessOptions `options`.
+    The ones in `known_processes` (a dict of (pid, create time) to feature
+    key) only get an update.
+    """
+    known_processes = known_processes or {}
+    if procfs.use_procfs():
+        for feature in crawl_records(procfs.read_processes(fds=True),
+                                     options, known_processes):
+            yield feature
+        return
+
+    for p in psutil.process_iter():
         create_time = (
             p.create_time() if hasattr(
                 p.create_time,
                 '__call__') else p.create_time)
-
-        name = (p.name() if hasattr(p.name, '__call__'
-                                    ) else p.name)
-        cmdline = (p.cmdline() if hasattr(p.cmdline, '__call__'
-                                          ) else p.cmdline)
         pid = (p.pid() if hasattr(p.pid, '__call__') else p.pid)
-        status = (p.status() if hasattr(p.status, '__call__'
-                                        ) else p.status)
-        if status == psutil.STATUS_ZOMBIE:
-            cwd = 'unknown'  # invalid
+        feature_key = known_processes.get((pid, create_time))
+        if feature_key is None:
+            yield _crawl_single_process(p, options)
         else:
-            try:
-                cwd = (p.cwd() if hasattr(p, 'cwd') and
-                       hasattr(p.cwd, '__call__') else p.getcwd())
-            except Exception:
-                logger.error('Error crawling process %s for cwd'
-                             % pid, exc_info=True)
-                cwd = 'unknown'
-        ppid = (p.ppid() if hasattr(p.ppid, '__call__'
-                                    ) else p.ppid)
-        try:
-            if (hasattr(p, 'num_threads') and
-                    hasattr(p.num_threads, '__call__')):
-                num_threads = p.num_threads()
-            else:
-                num_threads = p.get_num_threads()
-        except:
-            num_threads = 'unknown'
+            yield _crawl_process_update(feature_key, pid, p, options)
 
+
+def crawl_records(records, options, known_processes):
+    """
+    Returns the features of the procfs ProcessRecords `records`, like
+    `crawl_processes`.
+    """
+    features = []
+    for record in records:
+        feature_key = known_processes.get((record.pid,
+                                           record.create_time))
+        if feature_key is None:
+            features.append(_crawl_process_record(record, options))
+        else:
+            features.append(_crawl_record_update(feature_key, record,
+                                                 options))
+    return features
+
+
+def _get_files(paths, options):
+    """
+    Returns the unique `paths` (open or mapped files, one per fd or
+    mapping), limited to `max_files`, or their summary.
+    """
+    if options.files_summary:
+        top = Counter(paths).most_common(options.files_summary_top)
+        return {'count': len(paths), 'top': [path for (path, _) in top]}
+    paths = sorted(set(paths))
+    if options.max_files > 0:
+        paths = paths[:options.max_files]
+    return paths
+
+
+def _get_open_files(pid, p, options):
+    paths = procfs.read_open_files(pid)
+    if paths is None:
+        paths = [f.path for f in p.get_open_files()]
+    return _get_files(paths, options)
+
+
+def _get_mmap_files(pid, options, p=None):
+    if not options.get_mmap_files:
+        return []
+    paths = procfs.read_maps(pid)
+    if paths is None and p is not None:
+        paths = [mmap.path for mmap in p.memory_maps()
+                 if os.path.isabs(mmap.path)]
+    return _get_files(paths or [], options)
+
+
+def _crawl_process_record(record, options):
+    """Returns a ProcessFeature from a procfs ProcessRecord"""
+    mmapfiles = _get_mmap_files(record.host_pid, options)
+
+    feature_key = '{0}/{1}'.format(record.name, record.pid)
+    return (feature_key, ProcessFeature(
+        str(' '.join(record.cmdline)),
+        record.create_time,
+        record.cwd,
+        record.name,
+        _get_files(record.open_files, options),
+        mmapfiles,
+        record.pid,
+        record.ppid,
+        record.num_threads,
+        record.username,
+    ), 'process')
+
+
+def _crawl_record_update(feature_key, record, options):
+    """Returns a ProcessUpdateFeature from a procfs ProcessRecord"""
+    return (feature_key, ProcessUpdateFeature(
+        _get_files(record.open_files, options),
+        _get_mmap_files(record.host_pid, options),
+        record.pid,
+        record.ppid,
+        record.num_threads,
+    ), 'process-update')
+
+
+def _crawl_process_update(feature_key, pid, p, options):
+    """Returns a ProcessUpdateFeature"""
+    ppid = (p.ppid() if hasattr(p.ppid, '__call__'
+                                ) else p.ppid)
+    return (feature_key, ProcessUpdateFeature(
+        _get_open_files(pid, p, options),
+        _get_mmap_files(pid, options, p),
+        pid,
+        ppid,
+        _get_num_threads(p),
+    ), 'process-update')
+
+
+def _get_num_threads(p):
+    try:
+        if (hasattr(p, 'num_threads') and
+                hasattr(p.num_threads, '__call__')):
+            return p.num_threads()
+        return p.get_num_threads()
+    except:
+        return 'unknown'
+
+
+def _crawl_single_process(p, options):
+    """Returns a ProcessFeature"""
+    create_time = (
+        p.create_time() if hasattr(
+            p.create_time,
+            '__call__') else p.create_time)
+
+    name = (p.name() if hasattr(p.name, '__call__'
+                                ) else p.name)
+    cmdline = (p.cmdline() if hasattr(p.cmdline, '__call__'
+                                      ) else p.cmdline)
+    pid = (p.pid() if hasattr(p.pid, '__call__') else p.pid)
+    status = (p.status() if hasattr(p.status, '__call__'
+                                    ) else p.status)
+    if status == psutil.STATUS_ZOMBIE:
+        cwd = 'unknown'  # invalid
+    else:
         try:
-            username = (p.username() if hasattr(p, 'username') and
-                        hasattr(p.username, '__call__') else
-                        p.username)
-        except:
-            username = 'unknown'
-
-        openfiles = []
-        for f in p.get_open_files():
-            openfiles.append(f.path)
-        openfiles.sort()
-
-        mmapfiles = self._get_mmap_files(p)
-
-        feature_key = '{0}/{1}'.format(name, pid)
-        return (feature_key, ProcessFeature(
-            str(' '.join(cmdline)),
-            create_time,
-            cwd,
-            name,
-            openfiles,
-            mmapfiles,
-            pid,
-            ppid,
-            num_threads,
-            username,
-        ), 'process')
+            cwd = (p.cwd() if hasattr(p, 'cwd') and
+                   hasattr(p.cwd, '__call__') else p.getcwd())
+        except Exception:
+            logger.error('Error crawling process %s for cwd'
+                         % pid, exc_info=True)
+            cwd = 'unknown'
+    ppid = (p.ppid() if hasattr(p.ppid, '__call__'
+                                ) else p.ppid)
+    num_threads = _get_num_threads(p)
+
+    try:
+        username = (p.username() if hasattr(p, 'username') and
+                    hasattr(p.username, '__call__') else
+                    p.username)
+    except:
+        username = 'unknown'
+
+    openfiles = _get_open_files(pid, p, options)
+    mmapfiles = _get_mmap_files(pid, options, p)
+
+    feature_key = '{0}/{1}'.format(name, pid)
+    return (feature_key, ProcessFeature(
+        str(' '.join(cmdline)),
+        create_time,
+        cwd,
+        name,
+        openfiles,
+        mmapfiles,
+        pid,
+        ppid,
+        num_threads,
+        username,
+    ), 'process')
@@ -3,7 +3,8 @@ import logging
 import psutil
 
 from icrawl_plugin import IHostCrawler
-from utils.features import ProcessFeature
+from utils import pid_resolver, procfs
+from utils.features import ProcessFeature, HostProcessFeature
 
 logger = logging.getLogger('crawlutils')
 
@@ -13,10 +14,22 @@ class ProcessHostCrawler(IHostCrawler):
     def get_feature(self):
         return 'process'
 
-    def crawl(self, **kwargs):
-        return self._crawl_in_system()
+    def crawl(self, container_ids='False', **kwargs):
+        """
+        :param container_ids: 'True' to crawl HostProcessFeatures, with the
+        ID of the container of every process, and its kubernetes pod.
+        """
+        features = self._crawl_in_system()
+        if container_ids == 'True':
+            return pid_resolver.tag_containers(features, HostProcessFeature)
+        return features
 
     def _crawl_in_system(self):
+        if procfs.use_procfs():
+            for record in procfs.read_processes(fds=True):
+                yield self._crawl_process_record(record)
+            return
+
         created_since = -1
         for p in psutil.process_iter():
             create_time = (
@@ -27,6 +40,24 @@ class ProcessHostCrawler(IHostCrawler):
                 continue
             yield self._crawl_single_process(p)
 
+    def _crawl_process_record(self, record):
+        """Returns a ProcessFeature from a procfs ProcessRecord"""
+        mmapfiles = []
+
+        feature_key = '{0}/{1}'.format(record.name, record.pid)
+        return (feature_key, ProcessFeature(
+            str(' '.join(record.cmdline)),
+            record.create_time,
+            record.cwd,
+            record.name,
+            record.open_files,
+            mmapfiles,
+            record.pid,
+            record.ppid,
+            record.num_threads,
+            record.username,
+        ), 'process')
+
     def _crawl_single_process(self, p):
         """Returns a ProcessFeature"""
         create_time = (
@@ -1,12 +1,13 @@
 import logging
-import os
 import re
 import subprocess
 
-import utils.dockerutils
 
+from container_context import get_container_context
 from icrawl_plugin import IContainerCrawler
-from utils.namespace import run_as_another_namespace, ALL_NAMESPACES
+from utils.fs_walker import SuffixVisitor, WalkCrawl, walk_tree
+from utils.namespace import (run_as_another_namespace, ALL_NAMESPACES,
+                             NamespaceCrawl)
 
 logger = logging.getLogger('crawlutils')
 
@@ -16,17 +17,7 @@ class PythonPackageCrawler(IContainerCrawler):
     def get_feature(self):
         return 'python-package'
 
-    def _crawl_files(self, path, extensions):
-        output = []
-        if os.path.isdir(path):
-            for (root_dirpath, dirs, files) in os.walk(path):
-                output += [
-                    f for ext in extensions for f in files if f.endswith(ext)]
-                output += [
-                    d for ext in extensions for d in dirs if d.endswith(ext)]
-        return output
-
-    def _get_packages_by_extension(self, mountpoint):
+    def _get_visitor(self, mountpoint):
         candidate_paths = [
             "usr/lib/",
             "usr/share/",
@@ -34,13 +25,14 @@ class PythonPackageCrawler(IContainerCrawler):
             "usr/local/share/",
             "usr/local/bundle/",
             "var/lib/"]
+        return SuffixVisitor(mountpoint, candidate_paths,
+                             ['.egg-info', '.dist-info'], dirs=True)
 
-        packages = []
-
-        for path in candidate_paths:
-            path = os.path.join(mountpoint, path)
-            packages += self._crawl_files(path, ['.egg-info', '.dist-info'])
+    def _get_packages_by_extension(self, mountpoint):
+        visitor = self._get_visitor(mountpoint)
+        return self._get_packages(pkg for (_, pkg) in walk_tree([visitor]))
 
+    def _get_packages(self, packages):
         for pkg in packages:
             pkg_name = None
             name_parts = re.match(
@@ -89,9 +81,7 @@ class PythonPackageCrawler(IContainerCrawler):
                     {"pkgname": pkg_name, "pkgversion": pkg_version},
                     'python-package')
 
-    def _crawl_without_setns(self, container_id):
-        mountpoint = utils.dockerutils.get_docker_container_rootfs_path(
-            container_id)
+    def _crawl_without_setns(self, mountpoint):
         return self._get_packages_by_extension(mountpoint)
 
     def _crawl_in_system(self):
@@ -101,16 +91,30 @@ class PythonPackageCrawler(IContainerCrawler):
         else:
             return self._get_packages_by_cmd()
 
-    def crawl(self, container_id, avoid_setns=False, **kwargs):
-        inspect = utils.dockerutils.exec_dockerinspect(container_id)
-        state = inspect['State']
-        pid = str(state['Pid'])
+    def get_namespace_crawl(self, container_id, avoid_setns=False, **kwargs):
+        if avoid_setns:
+            return None
+        self.get_packages_generic = False  # can be made an arg to crawl()
+        return NamespaceCrawl(ALL_NAMESPACES, self._crawl_in_system, ())
+
+    def get_walk_visitor(self, container_id, avoid_setns=False,
+                         context=None, **kwargs):
+        if not avoid_setns:
+            return None
+        context = get_container_context(container_id, context)
+        return WalkCrawl(self._get_visitor(context.rootfs), True)
+
+    def crawl_from_walk(self, container_id, features, **kwargs):
+        return self._get_packages(features)
+
+    def crawl(self, container_id, avoid_setns=False, context=None, **kwargs):
+        context = get_container_context(container_id, context)
+        pid = context.pid
         logger.debug('Crawling OS for container %s' % container_id)
 
         if avoid_setns:
-            return self._crawl_without_setns(container_id)
+            return self._crawl_without_setns(context.rootfs)
         else:  # in all other cases, including wrong mode set
-            self.get_packages_generic = False  # can be made an arg to crawl()
-            return run_as_another_namespace(pid,
-                                            ALL_NAMESPACES,
-                                            self._crawl_in_system)
+            call = self.get_namespace_crawl(container_id)
+            return run_as_another_namespace(pid, call.namespaces,
+                                            call.function, *call.args)
@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import logging
+import os
+import re
+import threading
+import time
+
+from crawler_exceptions import ContainerWithoutCgroups
+
+logger = logging.getLogger('crawlutils')
+
+# Directories (under every cgroup controller mount point) with the cgroups
+# of the containers: docker with the cgroupfs and systemd drivers, and
+# kubernetes with the cgroupfs and systemd drivers.
+CONTAINER_CGROUP_ROOTS = ['docker', 'system.slice', 'kubepods',
+                          'kubepods.slice']
+
+# Min seconds between two scans of the cgroups of a controller, so
+# containers without cgroups do not make us scan them on every lookup.
+MIN_RESCAN_INTERVAL = 1
+
+# 'abc..', 'docker-abc...scope', 'cri-containerd-abc...scope'
+_CONTAINER_DIR_RE = re.compile(
+    r'^(?:[a-z-]+-)?([0-9a-f]{64})(?:\.scope)?$')
+
+
+def get_cgroup_container_id(cgroups):
+    """
+    Returns the ID of the container a process is in given its `cgroups`
+    (the contents of /proc/<pid>/cgroup), or None if it is in no container.
+    """
+    for line in cgroups.splitlines():
+        # hierarchy-ID:controllers:path
+        path = line.split(':', 2)[-1]
+        match = _CONTAINER_DIR_RE.match(os.path.basename(path))
+        if match:
+            return match.group(1)
+    return None
+
+
+def _get_cgroup_mount(controllers, mounts_file='/proc/mounts'):
+    """
+    Returns the mount point of the first of `controllers` mounted.
+    """
+    for dev in controllers:
+        paths = [os.path.join('/cgroup/', dev),
+                 os.path.join('/sys/fs/cgroup/', dev)]
+        for path in paths:
+            if os.path.ismount(path):
+                return path
+
+        # Try getting the mount point from /proc/mounts
+        with open(mounts_file, 'r') as f:
+            for l in f:
+                _type, mnt, _, _, _, _ = l.split(' ')
+                if _type == 'cgroup' and mnt.endswith('cgroup/' + dev):
+                    return mnt
+
+    raise ContainerWithoutCgroups('Can not find the cgroup dir')
+
+
+def _scan_container_cgroups(mount):
+    """
+    Returns a dictionary with the cgroup dir of every container under the
+    `mount` cgroup hierarchy, indexed by container ID.
+    """
+    dirs = {}
+    for root in CONTAINER_CGROUP_ROOTS:
+        for (dirpath, dirnames, _) in os.walk(os.path.join(mount, root)):
+            for dirname in list(dirnames):
+                match = _CONTAINER_DIR_RE.match(dirname)
+                if match:
+                    dirs[match.group(1)] = os.path.join(dirpath, dirname)
+                    # no containers in a container cgroup
+                    dirnames.remove(dirname)
+    return dirs
+
+
+class CgroupIndex(object):
+
+    """
+    Index of the cgroup dirs of all containers, per cgroup controller.
+
+    The mount points are found once, and the container cgroups are found by
+    scanning all the containers cgroups of a controller at once. New
+    containers are added as they are looked up: with a stat for plain
+    docker, or with a new scan otherwise (like kubernetes pods). The ones
+    gone are dropped by a new scan, or by `forget`.
+    """
+
+    def __init__(self):
+        self._mounts = {}
+        self._dirs = {}
+        self._scan_times = {}
+        self._lock = threading.Lock()
+
+    def get_mount(self, controllers):
+        key = tuple(controllers)
+        if key not in self._mounts:
+            self._mounts[key] = _get_cgroup_mount(controllers)
+        return self._mounts[key]
+
+    def get_container_dir(self, controllers, long_id):
+        """
+        Returns the cgroup dir of container `long_id` for the first of
+        `controllers` mounted.
+        """
+        mount = self.get_mount(controllers)
+        with self._lock:
+            dirs = self._dirs.setdefault(mount, {})
+            if long_id not in dirs:
+                self._refresh(mount, dirs, long_id)
+            path = dirs.get(long_id)
+        if path is None:
+            raise ContainerWithoutCgroups('Can not find the cgroup dir')
+        return path
+
+    def _refresh(self, mount, dirs, long_id):
+        docker_dir = os.path.join(mount, 'docker', long_id)
+        if os.path.isdir(docker_dir):
+            dirs[long_id] = docker_dir
+            return
+        now = time.time()
+        if now - self._scan_times.get(mount, 0) < MIN_RESCAN_INTERVAL:
+            return
+        logger.debug('Scanning the container cgroups at %s' % mount)
+        self._scan_times[mount] = now
+        # Replaces the index, so we also forget the containers that are gone
+        dirs.clear()
+        dirs.update(_scan_container_cgroups(mount))
+
+    def forget(self, long_id):
+        """Drops the cgroup dirs of container `long_id` (that is gone)."""
+        with self._lock:
+            for dirs in self._dirs.itervalues():
+                dirs.pop(long_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._mounts.clear()
+            self._dirs.clear()
+            self._scan_times.clear()
+
+
+_index = CgroupIndex()
+
+
+def forget_container(long_id):
+    """Drops the cgroup dirs of container `long_id` from the index."""
+    _index.forget(long_id)
+
+
+def get_container_cgroup_path(controllers, long_id, node):
+    """
+    Returns the path to `node` (like 'cpuacct.usage') in the cgroup of
+    container `long_id`, for the first of `controllers` mounted.
+    """
+    return os.path.join(_index.get_container_dir(controllers, long_id),
+                        node)
@@ -1,11 +1,10 @@
 import codecs
-import fnmatch
 import logging
 import os
-import re
 
 import utils.misc
-from utils.features import ConfigFeature
+from utils.features import ConfigFeature, FileRemovedFeature
+from utils.fs_walker import WalkVisitor, get_lstat, walk_tree
 
 logger = logging.getLogger('crawlutils')
 
@@ -25,67 +24,109 @@ def crawl_config_files(
     if not os.path.isdir(root_dir):
         return
 
-    root_dir_alias = root_dir_alias or root_dir
-    exclude_dirs = [utils.misc.join_abs_paths(root_dir, d) for d in
-                    exclude_dirs]
-    exclude_regex = r'|'.join([fnmatch.translate(d) for d in
-                               exclude_dirs]) or r'$.'
-    known_config_files[:] = [utils.misc.join_abs_paths(root_dir, f) for f in
-                             known_config_files]
-    known_config_files[:] = [f for f in known_config_files
-                             if not re.match(exclude_regex, f)]
-    config_file_set = set()
-    for fpath in known_config_files:
-        if os.path.exists(fpath):
-            lstat = os.lstat(fpath)
-            if (lstat.st_atime > accessed_since or
-                    lstat.st_ctime > accessed_since):
-                config_file_set.add(fpath)
-
-    if discover_config_files:
-        discover_config_file_paths(accessed_since, config_file_set,
-                                   exclude_regex, root_dir)
-
-    for fpath in config_file_set:
-        (_, fname) = os.path.split(fpath)
-        # realpath sanitizes the path a bit, for example: '//abc/' to '/abc/'
-        frelpath = os.path.realpath(fpath.replace(root_dir, root_dir_alias, 1))
-        with codecs.open(filename=fpath, mode='r',
-                         encoding='utf-8', errors='ignore') as \
-                config_file:
-
-            # Encode the contents of config_file as utf-8.
-
-            yield (frelpath, ConfigFeature(fname,
-                                           config_file.read(),
-                                           frelpath), 'config')
-
-
-def discover_config_file_paths(accessed_since, config_file_set,
-                               exclude_regex, root_dir):
-    # Walk the directory hierarchy starting at 'root_dir' in BFS
-    # order looking for config files.
-    for (root_dirpath, dirs, files) in os.walk(root_dir):
-        dirs[:] = [os.path.join(root_dirpath, d) for d in
-                   dirs]
-        dirs[:] = [d for d in dirs
-                   if not re.match(exclude_regex, d)]
-        files = [os.path.join(root_dirpath, f) for f in
-                 files]
-        files = [f for f in files
-                 if not re.match(exclude_regex, f)]
-        for fpath in files:
-            if os.path.exists(fpath) \
-                    and _is_config_file(fpath):
-                lstat = os.lstat(fpath)
-                if lstat.st_atime > accessed_since \
-                        or lstat.st_ctime > accessed_since:
-                    config_file_set.add(fpath)
+    visitor = ConfigVisitor(root_dir, exclude_dirs, root_dir_alias,
+                            known_config_files, discover_config_files,
+                            accessed_since)
+    for (_, feature) in walk_tree([visitor]):
+        yield feature
 
 
-def _is_config_file(fpath):
+def crawl_watched_config_files(
+    watcher,
+    root_dir_alias=None,
+    known_config_files=[],
+    discover_config_files=False
+):
+    """
+    Crawls the config files changed under the root dir of `watcher` (a
+    `utils.file_watcher.TreeWatcher`) since the previous call, like
+    `crawl_config_files` does for all of them, plus a 'config-removed'
+    feature for every config file removed. The first call crawls all of
+    them.
+    """
+    root_dir = watcher.root_dir
+    visitor = ConfigVisitor(root_dir, root_dir_alias=root_dir_alias,
+                            known_config_files=known_config_files,
+                            discover_config_files=discover_config_files)
+    known_config_files = set(visitor.known_config_files)
+    (changed, removed) = watcher.get_changes()
+    for (path, entry) in changed:
+        if path in known_config_files:
+            if os.path.exists(path):
+                visitor.config_file_set.add(path)
+        elif discover_config_files:
+            visitor.visit_file(path, entry)
+    for feature in visitor.finish():
+        yield feature
+    for path in removed:
+        if path in known_config_files or (discover_config_files and
+                                          _has_config_ext(path)):
+            frelpath = os.path.realpath(
+                path.replace(root_dir, visitor.root_dir_alias, 1))
+            yield (frelpath, FileRemovedFeature(os.path.basename(frelpath),
+                                                frelpath), 'config-removed')
+
+
+class ConfigVisitor(WalkVisitor):
+
+    """
+    Crawls the `known_config_files`, and the config files discovered
+    under `root_dir` if `discover_config_files` is True, like
+    `crawl_config_files`, as part of a shared walk (see `utils.fs_walker`).
+    The files are read once the walk is done.
+    """
+
+    def __init__(self, root_dir='/', exclude_dirs=[], root_dir_alias=None,
+                 known_config_files=[], discover_config_files=False,
+                 accessed_since=0):
+        WalkVisitor.__init__(self, root_dir,
+                             [utils.misc.join_abs_paths(root_dir, d)
+                              for d in exclude_dirs])
+        self.root_dir_alias = root_dir_alias or root_dir
+        self.known_config_files = [utils.misc.join_abs_paths(root_dir, f)
+                                   for f in known_config_files]
+        self.walk = discover_config_files
+        self.accessed_since = accessed_since
+        self.config_file_set = set()
+
+    def _accessed(self, fpath, entry=None):
+        lstat = get_lstat(fpath, entry)
+        return (lstat.st_atime > self.accessed_since or
+                lstat.st_ctime > self.accessed_since)
+
+    def visit_root(self):
+        for fpath in self.known_config_files:
+            if (not self.excludes(fpath) and os.path.exists(fpath) and
+                    self._accessed(fpath)):
+                self.config_file_set.add(fpath)
+        return []
+
+    def visit_file(self, path, entry=None):
+        if _is_config_file(path) and self._accessed(path, entry):
+            self.config_file_set.add(path)
+        return []
+
+    def finish(self):
+        for fpath in self.config_file_set:
+            (_, fname) = os.path.split(fpath)
+            # realpath sanitizes the path a bit, for example: '//abc/' to
+            # '/abc/'
+            frelpath = os.path.realpath(
+                fpath.replace(self.root_dir, self.root_dir_alias, 1))
+            with codecs.open(filename=fpath, mode='r',
+                             encoding='utf-8', errors='ignore') as \
+                    config_file:
+
+                # Encode the contents of config_file as utf-8.
+
+                yield (frelpath, ConfigFeature(fname,
+                                               config_file.read(),
+                                               frelpath), 'config')
+
+
+def _has_config_ext(fpath):
     (_, ext) = os.path.splitext(fpath)
-    if os.path.isfile(fpath) and ext in [
+    return ext in [
         '.xml',
         '.ini',
         '.properties',
@@ -97,6 +138,12 @@ def _is_config_file(fpath):
         '.allow',
         '.deny',
         '.lst',
-    ] and os.path.getsize(fpath) <= 204800:
+    ]
+
+
+def _is_config_file(fpath):
+    # the extension first, as most files are not config files
+    if _has_config_ext(fpath) and os.path.isfile(fpath) and \
+            os.path.getsize(fpath) <= 204800:
         return True
     return False
@@ -1,9 +1,66 @@
 import psutil
 
+from utils import procfs
 from utils.features import ConnectionFeature
 
 
 def crawl_connections():
+    """
+    Crawls the inet connections of all the processes in sight, reading
+    /proc directly if the procfs reader is enabled, or with psutil
+    otherwise.
+    """
+    if procfs.use_procfs():
+        return _crawl_connections_procfs()
+    return _crawl_connections_psutil()
+
+
+def _crawl_connections_procfs():
+    return crawl_connections_from_records(procfs.read_processes(fds=True),
+                                          procfs.read_connections())
+
+
+def crawl_connections_from_records(records, connections):
+    """
+    Crawls the connections of the processes in `records` (procfs
+    ProcessRecords read with fds=True), given the `connections` of their
+    network namespace (see `procfs.read_connections`).
+    """
+    for record in records:
+        for inode in record.sockets:
+            conn = connections.get(inode)
+            if conn is not None:
+                yield crawl_single_connection(conn, record.pid, record.name)
+
+
+def crawl_connections_from_sockets(connections, socket_pids,
+                                   pid_namespace=None):
+    """
+    Crawls the `connections` of a network namespace (see
+    `procfs.read_connections`) from outside of it, getting the processes
+    with each socket open from `socket_pids` (see `procfs.read_socket_pids`).
+
+    :param pid_namespace: only crawl the connections of the processes in
+    this pid namespace (its inode), if given. Their pids are the ones seen
+    in it, or the ones seen from the host if the kernel does not tell (see
+    `procfs.ProcessRecord`).
+    """
+    records = {}
+    usernames = {}
+    for (inode, conn) in connections.iteritems():
+        for host_pid in socket_pids.get(inode, []):
+            if host_pid not in records:
+                records[host_pid] = procfs.read_process(
+                    host_pid, namespaces=True, usernames=usernames)
+            record = records[host_pid]
+            if record is None or (pid_namespace and
+                                  record.pid_namespace != pid_namespace):
+                continue
+            pid = record.host_pid if record.pid is None else record.pid
+            yield crawl_single_connection(conn, pid, record.name)
+
+
+def _crawl_connections_psutil():
     created_since = -1
 
     proc_list = psutil.process_iter()
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import time
+import weakref
+from array import array
+from collections import namedtuple
+
+from utils.misc import LRUCache
+
+# Seconds without new samples after which a key (or a whole entity) is
+# forgotten.
+DEFAULT_TTL = 3600
+
+# Max number of entities whose last samples we keep.
+DEFAULT_MAX_ENTITIES = 10000
+
+# Min seconds between two checks for expired samples.
+EXPIRE_INTERVAL = 60
+
+_Sample = namedtuple('_Sample', 'counters time rates')
+
+_all_counter_rates = weakref.WeakSet()
+
+
+class CounterRates(object):
+
+    """
+    Computes the per second rates of counters that only go up (like bytes
+    sent or cpu nanoseconds used), from the previous sample of the same
+    counters.
+
+    Samples belong to an entity (a container, a process, a disk...) and
+    have a key within it (like the interface name), so all the samples of
+    an entity can be forgotten at once when it goes away. Keys are also
+    forgotten if they have no new samples for `ttl` seconds (and entities
+    when they have no keys left), and entities if there are more than
+    `max_entities` of them (the least recently used first).
+
+    A counter going down means it wrapped or was reset. In that case its
+    previous rate is reported again, instead of a negative (or huge) one.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entities=DEFAULT_MAX_ENTITIES):
+        self.ttl = ttl
+        self._entities = LRUCache(max_entities)
+        self._last_expire = time.time()
+        _all_counter_rates.add(self)
+
+    def rate(self, entity, key, counters, now=None):
+        """
+        Saves the `counters` sample and returns the list of rates since the
+        previous one, or None if there is no previous sample.
+
+        :param now: time of the sample. Defaults to the current time.
+        """
+        return self.rates(entity, {key: counters}, now=now)[key]
+
+    def rates(self, entity, samples, now=None, forget_missing=False):
+        """
+        Like `rate`, but for many samples (a dictionary of key to counters)
+        of an entity at once. Returns a dictionary of key to rates.
+
+        :param forget_missing: True if `samples` has all the keys of the
+        entity (like all its processes), so the samples of the other keys
+        are forgotten.
+        """
+        return self.bulk_rates({entity: samples}, now=now,
+                               forget_missing=forget_missing)[entity]
+
+    def bulk_rates(self, samples, now=None, forget_missing=False):
+        """
+        Like `rates`, but for many entities at once: `samples` is a
+        dictionary of entity to dictionary of key to counters. Returns a
+        dictionary of entity to dictionary of key to rates.
+        """
+        if now is None:
+            now = time.time()
+        self._expire(now)
+        return dict((entity, self._get_rates(entity, entity_samples, now,
+                                             forget_missing))
+                    for (entity, entity_samples) in samples.iteritems())
+
+    def _get_rates(self, entity, samples, now, forget_missing):
+        previous = self._entities.get(entity)
+        if previous is None:
+            previous = {}
+            self._entities.put(entity, previous)
+        rates = {}
+        for (key, counters) in samples.iteritems():
+            counters = array('d', counters)
+            prev = previous.get(key)
+            if prev is not None and now <= prev.time:
+                # Nothing to compare with, keep the older sample
+                rates[key] = None
+                continue
+            curr_rates = _get_rates(prev, counters, now)
+            previous[key] = _Sample(counters, now, curr_rates)
+            rates[key] = curr_rates.tolist() if curr_rates else None
+        if forget_missing:
+            for key in set(previous) - set(samples):
+                del previous[key]
+        return rates
+
+    def has_sample(self, entity, key):
+        samples = self._entities.get(entity)
+        return samples is not None and key in samples
+
+    def get_keys(self, entity):
+        """
+        Returns the set of keys of `entity` with a previous sample.
+        """
+        return set(self._entities.get(entity) or ())
+
+    def forget(self, entity):
+        self._entities.pop(entity)
+
+    def __len__(self):
+        return len(self._entities)
+
+    def _expire(self, now):
+        if now - self._last_expire < EXPIRE_INTERVAL:
+            return
+        self._last_expire = now
+        for (entity, samples) in self._entities.items():
+            for (key, sample) in samples.items():
+                if now - sample.time > self.ttl:
+                    del samples[key]
+            if not samples:
+                self._entities.pop(entity)
+
+
+def _get_rates(prev, counters, now):
+    if prev is None or len(prev.counters) != len(counters):
+        return None
+    interval = now - prev.time
+    rates = array('d')
+    for (index, (curr, last)) in enumerate(zip(counters, prev.counters)):
+        if curr < last:
+            # wrapped or reset
+            rates.append(prev.rates[index] if prev.rates else 0.0)
+        else:
+            rates.append((curr - last) / interval)
+    return rates
+
+
+def forget_entity(entity):
+    """
+    Forgets the samples of `entity` (like a container that is gone) in all
+    the CounterRates.
+    """
+    for counter_rates in list(_all_counter_rates):
+        counter_rates.forget(entity)
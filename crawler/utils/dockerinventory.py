@@ -0,0 +1,158 @@
+#!usr/bin/python
+# -*- coding: utf-8 -*-
+import logging
+import Queue
+import threading
+
+import docker
+
+from crawler_exceptions import DockerutilsException
+from dockerutils import (DOCKER_SOCKET_URL,
+                         exec_dockerps,
+                         exec_dockerinspect)
+
+logger = logging.getLogger('crawlutils')
+
+# Container events after which we inspect the container again.
+UPDATE_EVENTS = ['start', 'rename', 'update']
+
+# Container events after which the container is not running anymore.
+REMOVE_EVENTS = ['die', 'destroy']
+
+# Seconds to wait before subscribing again after losing the events stream.
+RESUBSCRIBE_INTERVAL = 1
+
+_inventory = None
+
+
+class DockerContainersInventory(object):
+
+    """
+    In-memory list of the running docker containers (their docker inspects),
+    kept up to date by a thread subscribed to the docker events. Getting
+    the list costs nothing, and the docker daemon is only asked about the
+    containers that changed, instead of inspecting every container at every
+    crawl.
+
+    Until the thread is subscribed to the events (or if it loses them), the
+    containers are listed with `exec_dockerps` as before.
+    """
+
+    def __init__(self):
+        self._inspects = {}
+        self._started = Queue.Queue()
+        self._lock = threading.Lock()
+        self._synced = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name='docker-inventory')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def is_synced(self):
+        return self._synced
+
+    def get_inspects(self):
+        """
+        Returns the docker inspects of all running containers.
+        """
+        with self._lock:
+            if self._synced:
+                return self._inspects.values()
+        return exec_dockerps()
+
+    def poll_started(self, timeout):
+        """
+        Returns the inspect of the next container started, waiting up to
+        `timeout` seconds for one, or None.
+        """
+        try:
+            long_id = self._started.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+        with self._lock:
+            return self._inspects.get(long_id)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._subscribe()
+            except Exception as e:
+                logger.warning('Lost the docker events stream: %s' % e)
+            with self._lock:
+                self._synced = False
+            self._stopped.wait(RESUBSCRIBE_INTERVAL)
+
+    def _subscribe(self):
+        # A client of its own with no timeout, as the events stream is kept
+        # open for as long as the daemon is up, even with no events.
+        client = docker.Client(base_url=DOCKER_SOCKET_URL, version='auto',
+                               timeout=None)
+        # The request is sent here, so listing the containers after this
+        # point can not miss any event.
+        events = client.events(filters={'type': 'container'}, decode=True)
+        inspects = dict((inspect['Id'], inspect)
+                        for inspect in exec_dockerps())
+        with self._lock:
+            self._inspects = inspects
+            self._synced = True
+        logger.info('Subscribed to the docker events with %d containers'
+                    % len(inspects))
+        for event in events:
+            if self._stopped.is_set():
+                break
+            self._handle_event(event)
+
+    def _handle_event(self, event):
+        action = event.get('Action', event.get('status'))
+        long_id = event.get('id')
+        if not long_id:
+            return
+        if action in REMOVE_EVENTS:
+            with self._lock:
+                self._inspects.pop(long_id, None)
+        elif action in UPDATE_EVENTS:
+            try:
+                inspect = exec_dockerinspect(long_id)
+            except DockerutilsException:
+                # Already gone, we will get its destroy event
+                return
+            with self._lock:
+                if inspect['State']['Running']:
+                    self._inspects[long_id] = inspect
+                else:
+                    self._inspects.pop(long_id, None)
+            if action == 'start':
+                self._started.put(long_id)
+
+
+def start_docker_inventory():
+    """
+    Starts the docker containers inventory of this process. Once started,
+    the docker containers are listed from it.
+    """
+    global _inventory
+    if _inventory is None:
+        _inventory = DockerContainersInventory()
+        _inventory.start()
+    return _inventory
+
+
+def stop_docker_inventory():
+    global _inventory
+    if _inventory is not None:
+        _inventory.stop()
+        _inventory = None
+
+
+def get_docker_inventory():
+    """
+    Returns the docker containers inventory, or None if it was not started.
+    """
+    return _inventory
@@ -2,9 +2,13 @@
 # -*- coding: utf-8 -*-
 import logging
 import os
+import threading
+import time
+import urlparse
 
 import dateutil.parser as dp
 import docker
+from docker.transport.unixconn import UnixAdapter, UnixHTTPConnectionPool
 import semantic_version
 import itertools
 import re
@@ -22,6 +26,150 @@ logger = logging.getLogger('crawlutils')
 
 SUPPORTED_DRIVERS = ['btrfs', 'devicemapper', 'aufs', 'vfs']
 
+DOCKER_SOCKET_URL = 'unix://var/run/docker.sock'
+DOCKER_SOCKET_PATH = '/var/run/docker.sock'
+
+# Max number of connections to the daemon kept open by the shared docker
+# client. More concurrent requests (like from more crawler threads) open
+# connections that are closed once done.
+DEFAULT_MAX_CONNECTIONS = 25
+
+_client = None
+_client_pid = None
+_client_options = {'max_connections': DEFAULT_MAX_CONNECTIONS}
+_client_lock = threading.Lock()
+
+# endpoint -> [number of requests, total seconds, max seconds]
+_api_latency = {}
+_api_latency_lock = threading.Lock()
+
+# /containers/<id>/json -> /containers/{id}/json
+_ENDPOINT_ID_RE = re.compile(r'^/(\w+)/.+/(\w+)$')
+
+# Max number of images whose inspect and history we keep cached.
+IMAGE_CACHE_SIZE = 256
+
+# Min seconds between two checks of the docker image events.
+IMAGE_EVENTS_INTERVAL = 1
+
+# Image events after which the inspect (RepoTags) of an image is stale.
+IMAGE_EVENTS = ['delete', 'untag', 'tag', 'pull', 'import', 'load']
+
+# image ID -> {'inspect': image inspect, 'history': image history}
+_image_cache = misc.LRUCache(IMAGE_CACHE_SIZE)
+_image_events_since = None
+# True while a thread is getting the image events
+_image_events_checking = False
+_image_events_lock = threading.Lock()
+
+
+class _SocketAdapter(UnixAdapter):
+
+    """
+    The docker-py UnixAdapter keeps a connection pool per request URL (so
+    per container or image), and drops the least recently used ones past
+    its `num_pools`. This one keeps a single pool for the socket, of up to
+    `max_connections` connections, so they are reused by all the requests.
+    """
+
+    def __init__(self, socket_path, timeout, max_connections):
+        UnixAdapter.__init__(self, 'http+unix://' + socket_path, timeout,
+                             num_pools=1)
+        self.max_connections = max_connections
+
+    def get_connection(self, url, proxies=None):
+        with self.pools.lock:
+            pool = self.pools.get(self.socket_path)
+            if pool is None:
+                pool = UnixHTTPConnectionPool(url, self.socket_path,
+                                              self.timeout,
+                                              maxsize=self.max_connections)
+                self.pools[self.socket_path] = pool
+        return pool
+
+
+def configure_docker_client(max_connections=None, timeout=None):
+    """
+    Sets the options of the docker client shared by all the functions in
+    this module. The client is created again on its next use.
+
+    :param max_connections: max number of connections kept open to the
+    daemon.
+    :param timeout: seconds to wait for the docker daemon.
+    """
+    if max_connections is not None:
+        _client_options['max_connections'] = max_connections
+    if timeout is not None:
+        _client_options['timeout'] = timeout
+    reset_docker_client()
+
+
+def reset_docker_client():
+    global _client
+    with _client_lock:
+        _client = None
+
+
+def get_docker_client():
+    """
+    Returns the docker client shared by all the threads of this process.
+
+    Creating a client with version='auto' asks the daemon for its API
+    version, and every client opens its own connections, so we create it
+    once and keep its connections alive. A process forked from us does
+    not share our sockets, so it gets a client of its own.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            options = dict(_client_options)
+            max_connections = options.pop('max_connections')
+            client = docker.Client(base_url=DOCKER_SOCKET_URL,
+                                   version='auto', **options)
+            client.mount('http+docker://', _SocketAdapter(
+                DOCKER_SOCKET_PATH, client.timeout, max_connections))
+            client.hooks['response'].append(_record_api_latency)
+            _client = client
+            _client_pid = os.getpid()
+        return _client
+
+
+def _get_api_endpoint(response):
+    """
+    Returns something like 'GET /containers/{id}/json' for a docker API
+    response, without the API version and the container or image IDs.
+    """
+    path = urlparse.urlparse(response.request.url).path
+    path = re.sub(r'^/v[0-9.]+/', '/', path)
+    path = _ENDPOINT_ID_RE.sub(r'/\1/{id}/\2', path)
+    return '%s %s' % (response.request.method, path)
+
+
+def _record_api_latency(response, *args, **kwargs):
+    endpoint = _get_api_endpoint(response)
+    seconds = response.elapsed.total_seconds()
+    with _api_latency_lock:
+        stats = _api_latency.setdefault(endpoint, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+
+def get_docker_api_latency():
+    """
+    Returns the latency of the docker API calls made by this process, as a
+    dictionary like:
+
+        {'GET /containers/{id}/json': {'count': 10, 'avg': 0.002,
+                                       'max': 0.01}}
+    """
+    with _api_latency_lock:
+        return dict((endpoint, {'count': count,
+                                'avg': total / count,
+                                'max': max_seconds})
+                    for endpoint, (count, total, max_seconds)
+                    in _api_latency.iteritems())
+
 
 def exec_dockerps():
     """
@@ -30,8 +178,7 @@ def exec_dockerps():
     This call executes the `docker inspect` command every time it is invoked.
     """
     try:
-        client = docker.Client(
-            base_url='unix://var/run/docker.sock', version='auto')
+        client = get_docker_client()
         containers = client.containers()
         inspect_arr = []
         for container in containers:
@@ -44,18 +191,130 @@ def exec_dockerps():
     return inspect_arr
 
 
-def exec_docker_history(long_id):
+def _get_image_event_names(event):
+    """
+    Returns the image IDs and names an image event refers to. The ID is
+    sometimes a name (like 'ubuntu:latest' for a pull) and newer daemons
+    also put them in the 'Actor' of the event.
+    """
+    actor = event.get('Actor') or {}
+    names = set([event.get('id'), actor.get('ID'),
+                 (actor.get('Attributes') or {}).get('name')])
+    names.discard(None)
+    return names
+
+
+def _invalidate_image(event):
+    if event.get('Action', event.get('status')) not in IMAGE_EVENTS:
+        return
+    names = _get_image_event_names(event)
+    for image_id, metadata in _image_cache.items():
+        repotags = (metadata.get('inspect') or {}).get('RepoTags') or []
+        if image_id in names or names.intersection(repotags):
+            _image_cache.pop(image_id)
+
+
+def _sync_image_cache(client):
+    """
+    Drops the cached images that were deleted or (un)tagged since the last
+    check, according to the docker events. This is checked at most every
+    IMAGE_EVENTS_INTERVAL seconds, by one thread at a time: the others do
+    not wait for the docker daemon and use the cache as it is meanwhile.
+    """
+    global _image_events_since, _image_events_checking
+    with _image_events_lock:
+        now = int(time.time())
+        if _image_events_since is None:
+            # Anything cached before this point can not be trusted
+            _image_cache.clear()
+            _image_events_since = now
+            return
+        if (_image_events_checking or
+                now - _image_events_since < IMAGE_EVENTS_INTERVAL):
+            return
+        _image_events_checking = True
+        since = _image_events_since
+
+    events = None
+    try:
+        # Event times are whole seconds, so events can come after the
+        # previous check within its last second: get that second again.
+        events = list(client.events(since=since - 1, until=now,
+                                    filters={'type': 'image'}, decode=True))
+    except Exception as e:
+        logger.warning('Failed to get the docker image events: %s' % e)
+
+    with _image_events_lock:
+        _image_events_checking = False
+        if events is None:
+            # We can not tell which images changed, so forget all of them
+            _image_events_since = None
+            _image_cache.clear()
+            return
+        for event in events:
+            _invalidate_image(event)
+        _image_events_since = now
+
+
+def _get_image_metadata(client, image_id, key):
+    """
+    Returns the `key` ('inspect' or 'history') of image `image_id` from the
+    image cache, getting it from docker if it is not there. The returned
+    object is shared by all callers, so it should not be modified.
+    """
+    _sync_image_cache(client)
+    metadata = _image_cache.get(image_id)
+    if metadata is None:
+        metadata = {}
+        _image_cache.put(image_id, metadata)
+    if key not in metadata:
+        if key == 'inspect':
+            metadata[key] = client.inspect_image(image_id)
+        else:
+            metadata[key] = client.history(image_id)
+    return metadata[key]
+
+
+def exec_docker_image_inspect(image_id):
+    """
+    Returns the docker inspect of image `image_id`. It is cached until the
+    image is deleted or tagged.
+    """
+    try:
+        return _get_image_metadata(get_docker_client(), image_id, 'inspect')
+    except docker.errors.DockerException as e:
+        logger.warning(str(e))
+        raise DockerutilsException('Failed to exec docker image inspect')
+
+
+def exec_docker_image_history(image_id):
+    """
+    Returns the docker history of image `image_id`. It is cached until the
+    image is deleted or tagged.
+    """
     try:
-        client = docker.Client(base_url='unix://var/run/docker.sock',
-                               version='auto')
-        image = client.inspect_container(long_id)['Image']
-        history = client.history(image)
-        return history
+        return _get_image_metadata(get_docker_client(), image_id, 'history')
     except docker.errors.DockerException as e:
         logger.warning(str(e))
         raise DockerutilsException('Failed to exec dockerhistory')
 
 
+def exec_docker_history(long_id, inspect=None):
+    """
+    Returns the history of the image of container `long_id`.
+
+    :param inspect: the docker inspect of the container, if we already
+    have it.
+    """
+    if not inspect:
+        try:
+            inspect = get_docker_client().inspect_container(long_id)
+        except docker.errors.DockerException as e:
+            logger.warning(str(e))
+            raise DockerutilsException('Failed to exec dockerhistory')
+    return exec_docker_image_history(inspect['Image'])
+
+
 def _reformat_inspect(inspect):
     """Fixes some basic issues with the inspect json returned by docker.
     """
@@ -70,8 +329,7 @@ def _reformat_inspect(inspect):
 
 def exec_dockerinspect(long_id):
     try:
-        client = docker.Client(
-            base_url='unix://var/run/docker.sock', version='auto')
+        client = get_docker_client()
         inspect = client.inspect_container(long_id)
         _reformat_inspect(inspect)
     except docker.errors.DockerException as e:
@@ -79,7 +337,8 @@ def exec_dockerinspect(long_id):
         raise DockerutilsException('Failed to exec dockerinspect')
 
     try:
-        repotags = client.inspect_image(inspect['Image'])['RepoTags']
+        repotags = _get_image_metadata(client, inspect['Image'],
+                                       'inspect')['RepoTags']
         # get the first RepoTag
         inspect['RepoTag'] = repotags[0]
         # keep multiple RepoTags
@@ -100,8 +359,7 @@ def exec_dockernetwork(long_id):
     usesDocker0Bridge = False
     response = dict()
     try:
-        client = docker.Client(
-            base_url='unix://var/run/docker.sock', version='auto')
+        client = get_docker_client()
         networks = client.networks()
         for net in networks:
             name = net['Name']
@@ -145,8 +403,7 @@ def _get_docker_storage_driver():
     # Step 1, get it from "docker info"
 
     try:
-        client = docker.Client(
-            base_url='unix://var/run/docker.sock', version='auto')
+        client = get_docker_client()
         driver = client.info()['Driver']
     except (docker.errors.DockerException, KeyError):
         pass  # try to continue with the default of 'devicemapper'
@@ -231,8 +488,7 @@ def _get_docker_server_version():
     """Run the `docker info` command to get server version
     """
     try:
-        client = docker.Client(
-            base_url='unix://var/run/docker.sock', version='auto')
+        client = get_docker_client()
         return client.version()['Version']
     except (docker.errors.DockerException, KeyError) as e:
         logger.warning(str(e))
@@ -421,8 +677,7 @@ def get_docker_container_rootfs_path(long_id, inspect=None):
 
 def poll_container_create_events(timeout=0.1):
     try:
-        client = docker.Client(base_url='unix://var/run/docker.sock',
-                               version='auto')
+        client = get_docker_client()
         filters = dict()
         filters['type'] = 'container'
         filters['event'] = 'start'
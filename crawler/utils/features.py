@@ -24,6 +24,41 @@ FileFeature = namedtuple('FileFeature', [
     'type',
     'uid',
 ])
+# A file with the '<algorithm>:<hex digest>' hash of its content, or None
+# if it was not hashed (see utils/file_hashes.py)
+HashedFileFeature = namedtuple('HashedFileFeature',
+                               FileFeature._fields + ('hash',))
+
+
+class _WalkedFeature(object):
+
+    """
+    A file feature that also has the `inode` of the file, from the lstat of
+    the walk that crawled it. The inode is not a field, so it is not
+    emitted: the file indexes of the incremental crawls use it to tell
+    apart a file replaced by another one (see utils/file_index.py).
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, inode, *fields):
+        feature = super(_WalkedFeature, cls).__new__(cls, *fields)
+        feature.inode = inode
+        return feature
+
+    def __getnewargs__(self):
+        # to keep the inode when pickled out of a namespace crawl
+        return (self.inode,) + tuple(self)
+
+
+class WalkedFileFeature(_WalkedFeature, FileFeature):
+    pass
+
+
+class WalkedHashedFileFeature(_WalkedFeature, HashedFileFeature):
+    pass
+# A file gone since the previous crawl, for the incremental file crawls
+FileRemovedFeature = namedtuple('FileRemovedFeature', ['name', 'path'])
 ConfigFeature = namedtuple('ConfigFeature', ['name', 'content', 'path'])
 DiskFeature = namedtuple('DiskFeature', [
     'partitionname',
@@ -51,6 +86,16 @@ ProcessFeature = namedtuple('ProcessFeature', [
     'threads',
     'user',
 ])
+# The fields of a process that can change while it runs, and the process
+# that exited, for the incremental mode of the process container plugin
+ProcessUpdateFeature = namedtuple('ProcessUpdateFeature', [
+    'openfiles',
+    'mmapfiles',
+    'pid',
+    'ppid',
+    'threads',
+])
+ProcessExitFeature = namedtuple('ProcessExitFeature', ['created', 'pid'])
 MetricFeature = namedtuple('MetricFeature', [
     'cpupct',
     'mempct',
@@ -72,6 +117,16 @@ ConnectionFeature = namedtuple('ConnectionFeature', [
     'remoteport',
     'connstatus',
 ])
+# The process and connection features of the host, with the ID of the
+# container the process is in, and the kubernetes pod of the container, if
+# any (see utils/pid_resolver.py)
+HostProcessFeature = namedtuple(
+    'HostProcessFeature',
+    ProcessFeature._fields + ('container_id', 'pod_namespace', 'pod_name'))
+HostConnectionFeature = namedtuple(
+    'HostConnectionFeature',
+    ConnectionFeature._fields + ('container_id', 'pod_namespace',
+                                 'pod_name'))
 PackageFeature = namedtuple('PackageFeature', ['installed', 'pkgname',
                                                'pkgsize', 'pkgversion',
                                                'pkgarchitecture'])
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import errno
+import hashlib
+import logging
+import marshal
+import os
+import stat
+
+from utils.features import HashedFileFeature, WalkedHashedFileFeature
+from utils.fs_walker import get_exclude_regex, open_in_root
+
+logger = logging.getLogger('crawlutils')
+
+DEFAULT_CACHE_DIR = '/var/lib/crawler/file-hashes'
+
+# Bumped when the format of the cache files changes, so old ones are
+# ignored.
+CACHE_FORMAT = 2
+
+# Bytes read at a time from the files hashed
+READ_SIZE = 1 << 20
+
+
+def _load_cache(cache_path, algorithm):
+    """
+    Returns the dictionary of path to (file key, hex digest) of a cache, or
+    {} if there is none we can use.
+    """
+    try:
+        with open(cache_path, 'rb') as f:
+            (cache_format, cache_algorithm, digests) = marshal.load(f)
+    except IOError as exc:
+        if exc.errno != errno.ENOENT:
+            logger.warning('Can not read the file hash cache %s: %s'
+                           % (cache_path, exc))
+        return {}
+    except (EOFError, ValueError, TypeError) as exc:
+        logger.warning('Ignoring the corrupted file hash cache %s: %s'
+                       % (cache_path, exc))
+        return {}
+    if cache_format != CACHE_FORMAT or cache_algorithm != algorithm:
+        return {}
+    return digests
+
+
+def _save_cache(cache_path, algorithm, digests):
+    cache_dir = os.path.dirname(cache_path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # so a crawler killed while writing does not leave a partial cache
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        marshal.dump((CACHE_FORMAT, algorithm, digests), f)
+    os.rename(tmp_path, cache_path)
+
+
+def _get_key(lstat):
+    # Writing a file changes its mtime and ctime, even if the size stays
+    # the same. The inode tells apart a file replaced by another one.
+    return (lstat.st_dev, lstat.st_ino, lstat.st_size, lstat.st_mtime,
+            lstat.st_ctime)
+
+
+class FileHasher(object):
+
+    """
+    Hashes the content of files with `algorithm` (any of hashlib), keeping
+    the digests in a cache at `cache_path`: per path, the digest and the
+    key (device, inode, size, mtime and ctime) of the file hashed. Only the
+    files not in the cache (new or changed since they were hashed) are
+    read.
+
+    Only the regular files of up to `max_size` bytes (if positive) whose
+    path matches any of the `include` fnmatch patterns (if any) are hashed.
+    """
+
+    def __init__(self, cache_path, algorithm='sha256', max_size=0,
+                 include=[]):
+        # fail early with a ValueError for unknown algorithms
+        hashlib.new(algorithm)
+        self.cache_path = cache_path
+        self.algorithm = algorithm
+        self.max_size = max_size
+        if isinstance(include, basestring):
+            # a single glob in the config file
+            include = [include]
+        self.include_regex = get_exclude_regex(include) if include else None
+        self._previous = _load_cache(cache_path, algorithm)
+        self._digests = {}
+        self._removed = set()
+
+    def includes(self, path):
+        return (self.include_regex is None or
+                self.include_regex.match(path) is not None)
+
+    def get_hash(self, path, root_dir='/'):
+        """
+        Returns the '<algorithm>:<hex digest>' of the content of `path`
+        under `root_dir`, or None if it is not hashed.
+
+        The file is read without following symlinks (see
+        `utils.fs_walker.open_in_root`), so that a path under the rootfs
+        of a container changed into a symlink after the walk can not make
+        us read a file of the host.
+        """
+        try:
+            lstat = os.lstat(root_dir.rstrip('/') + path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(lstat.st_mode) or (
+                self.max_size > 0 and lstat.st_size > self.max_size):
+            return None
+        key = _get_key(lstat)
+        cached = self._digests.get(path) or self._previous.get(path)
+        if cached is not None and cached[0] == key:
+            digest = cached[1]
+        else:
+            digest = self._hash_file(root_dir, path, lstat)
+            if digest is None:
+                return None
+        self._digests[path] = (key, digest)
+        return '%s:%s' % (self.algorithm, digest)
+
+    def _hash_file(self, root_dir, path, lstat):
+        digest = hashlib.new(self.algorithm)
+        try:
+            with open_in_root(root_dir, path) as f:
+                fstat = os.fstat(f.fileno())
+                if (fstat.st_dev, fstat.st_ino) != (lstat.st_dev,
+                                                    lstat.st_ino):
+                    logger.debug('Not hashing %s, replaced since' % path)
+                    return None
+                for data in iter(lambda: f.read(READ_SIZE), ''):
+                    digest.update(data)
+        except (IOError, OSError) as exc:
+            logger.debug('Can not hash %s: %s' % (path, exc))
+            return None
+        return digest.hexdigest()
+
+    def forget(self, path):
+        """Forgets the digest of `path`, removed since."""
+        self._removed.add(path)
+
+    def save(self, complete=True):
+        """
+        Saves the digests of the files hashed since this was created. If
+        `complete` (all the files were hashed), the others are forgotten,
+        like files gone since. Otherwise the previous digests of the files
+        not hashed are kept, but the ones forgotten.
+        """
+        digests = self._digests
+        if not complete:
+            digests = dict((path, cached)
+                           for (path, cached) in self._previous.iteritems()
+                           if path not in self._removed)
+            digests.update(self._digests)
+        _save_cache(self.cache_path, self.algorithm, digests)
+
+
+def hash_files(features, root_dir, hasher, complete=True):
+    """
+    Returns the file `features` (as `crawl_files` returns them) with the
+    hash of their content, as HashedFileFeatures. Other features (like
+    'file-removed' ones) are returned as they are.
+
+    :param root_dir: where the paths of the features are, like the rootfs
+    of a container.
+    :param hasher: a FileHasher. Its cache is saved once all the
+    `features` are read.
+    :param complete: False if `features` are only the files changed, and
+    the 'file-removed' features of the ones gone, since the previous crawl
+    (as `crawl_watched_files` returns them).
+    """
+    for (feature_key, feature, feature_type) in features:
+        if feature_type == 'file':
+            digest = None
+            if hasher.includes(feature.path):
+                digest = hasher.get_hash(feature.path, root_dir)
+            fields = feature + (digest,)
+            if hasattr(feature, 'inode'):
+                feature = WalkedHashedFileFeature(feature.inode, *fields)
+            else:
+                feature = HashedFileFeature(*fields)
+        elif feature_type == 'file-removed':
+            hasher.forget(feature.path)
+        yield (feature_key, feature, feature_type)
+    hasher.save(complete)
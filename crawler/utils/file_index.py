@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import errno
+import hashlib
+import logging
+import marshal
+import os
+import time
+
+from utils.features import FileRemovedFeature
+
+logger = logging.getLogger('crawlutils')
+
+DEFAULT_INDEX_DIR = '/var/lib/crawler/file-index'
+
+# Bumped when the format of the index files changes, so old ones are
+# ignored (and replaced after a full crawl).
+INDEX_FORMAT = 2
+
+# Index path to the (full crawl time, signatures) to save once the frames
+# of the crawling iteration are emitted, or None if the indexes are saved
+# right away (see `defer_saves`).
+_deferred = None
+
+
+def get_index_path(index_dir, system_id, root_dir):
+    """
+    Returns the path of the index of the files under `root_dir` of system
+    `system_id` (a container ID, or 'host').
+    """
+    return os.path.join(index_dir, '%s-%s' % (
+        system_id, hashlib.sha1(root_dir).hexdigest()[:16]))
+
+
+def _load_index(index_path):
+    """
+    Returns the time of the last full crawl and the dictionary of path to
+    signature of an index, or (0, {}) if there is none we can use.
+    """
+    try:
+        with open(index_path, 'rb') as f:
+            (index_format, full_crawl_time, signatures) = marshal.load(f)
+    except IOError as exc:
+        if exc.errno != errno.ENOENT:
+            logger.warning('Can not read the file index %s: %s'
+                           % (index_path, exc))
+        return (0, {})
+    except (EOFError, ValueError, TypeError) as exc:
+        logger.warning('Ignoring the corrupted file index %s: %s'
+                       % (index_path, exc))
+        return (0, {})
+    if index_format != INDEX_FORMAT:
+        return (0, {})
+    return (full_crawl_time, signatures)
+
+
+def _save_index(index_path, full_crawl_time, signatures):
+    index_dir = os.path.dirname(index_path)
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    # so a crawler killed while writing does not leave a partial index
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        marshal.dump((INDEX_FORMAT, full_crawl_time, signatures), f)
+    os.rename(tmp_path, index_path)
+
+
+def defer_saves():
+    """
+    Starts a crawling iteration: the indexes updated from now on are only
+    saved by `save_deferred`, once their features are delivered, so the
+    changes of a crawl whose frames could not be emitted (or posted within
+    the retries of an http emitter) are crawled again next time. Without
+    it, they are saved once all the features are read.
+    """
+    global _deferred
+    _deferred = {}
+
+
+def save_deferred():
+    """Saves the indexes updated since `defer_saves`."""
+    global _deferred
+    (deferred, _deferred) = (_deferred or {}, None)
+    for (index_path, (full_crawl_time, signatures)) in deferred.iteritems():
+        _save_index(index_path, full_crawl_time, signatures)
+
+
+def discard_deferred():
+    """Drops the indexes updated since `defer_saves`."""
+    global _deferred
+    _deferred = None
+
+
+def _get_signature(feature):
+    # The ctime changes with the owner, mode or link target too. The
+    # atime is left out on purpose: reading a file does not change it.
+    # The inode, from the lstat of the walk (see
+    # `utils.features.WalkedFileFeature`), tells apart a file replaced by
+    # another one (say renamed over it) with the same times, size and mode.
+    return (feature.mtime, feature.ctime, feature.size, feature.mode,
+            getattr(feature, 'inode', 0))
+
+
+def crawl_changed_files(features, index_path, full_resync_interval=0):
+    """
+    Returns the file `features` (all the files under a root dir, as
+    `crawl_files` returns them) that were added or changed since the
+    previous crawl saved in the index at `index_path`, plus a
+    'file-removed' feature for every file that is gone.
+
+    All the `features` are returned if there is no index yet, or if the
+    last full crawl was over `full_resync_interval` seconds ago (if
+    positive). The index is only updated once all `features` are read (and
+    emitted, see `defer_saves`), so a failed crawl is repeated in full
+    next time.
+    """
+    (full_crawl_time, previous) = _load_index(index_path)
+    now = time.time()
+    full = (not previous or (full_resync_interval > 0 and
+                             now - full_crawl_time > full_resync_interval))
+    if full:
+        full_crawl_time = now
+
+    signatures = {}
+    for (feature_key, feature, feature_type) in features:
+        signature = _get_signature(feature)
+        signatures[feature.path] = signature
+        if full or previous.get(feature.path) != signature:
+            yield (feature_key, feature, feature_type)
+
+    for path in previous:
+        if path not in signatures:
+            yield (path, FileRemovedFeature(os.path.basename(path), path),
+                   'file-removed')
+
+    if _deferred is not None:
+        _deferred[index_path] = (full_crawl_time, signatures)
+    else:
+        _save_index(index_path, full_crawl_time, signatures)
+
+
+def remove_indexes(index_dir, system_ids):
+    """
+    Removes the indexes in `index_dir` of all containers but the ones in
+    `system_ids` (like the containers gone since the last crawl).
+    """
+    try:
+        names = os.listdir(index_dir)
+    except OSError:
+        return
+    for name in names:
+        system_id = name.rpartition('-')[0]
+        if len(system_id) == 64 and system_id not in system_ids:
+            try:
+                os.remove(os.path.join(index_dir, name))
+            except OSError as exc:
+                logger.debug('Can not remove the file index %s: %s'
+                             % (name, exc))
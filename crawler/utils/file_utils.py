@@ -1,10 +1,9 @@
-import fnmatch
 import logging
 import os
-import re
 import stat
 
-from utils.features import FileFeature
+from utils.features import FileRemovedFeature, WalkedFileFeature
+from utils.fs_walker import WalkVisitor, get_lstat, walk_tree
 
 logger = logging.getLogger('crawlutils')
 
@@ -13,7 +12,8 @@ def crawl_files(
         root_dir='/',
         exclude_dirs=[],
         root_dir_alias=None,
-        accessed_since=0):
+        accessed_since=0,
+        workers=1):
 
     if not os.path.isdir(root_dir):
         return
@@ -22,55 +22,93 @@ def crawl_files(
     logger.debug('crawl_files: %s' % (saved_args))
 
     assert os.path.isdir(root_dir)
-    if root_dir_alias is None:
-        root_dir_alias = root_dir
-    exclude_dirs = [os.path.join(root_dir, d) for d in
-                    exclude_dirs]
-    exclude_regex = r'|'.join([fnmatch.translate(d)
-                               for d in exclude_dirs]) or r'$.'
-
-    # walk the directory hierarchy starting at 'root_dir' in BFS
-    # order
-
-    feature = _crawl_file(root_dir, root_dir,
-                          root_dir_alias)
-    if feature and (feature.ctime > accessed_since or
-                    feature.atime > accessed_since):
-        yield (feature.path, feature, 'file')
-    for (root_dirpath, dirs, files) in os.walk(root_dir):
-        dirs[:] = [os.path.join(root_dirpath, d) for d in
-                   dirs]
-        dirs[:] = [d for d in dirs
-                   if not re.match(exclude_regex, d)]
-        files = [os.path.join(root_dirpath, f) for f in
-                 files]
-        files = [f for f in files
-                 if not re.match(exclude_regex, f)]
-        for fpath in files:
-            feature = _crawl_file(root_dir, fpath,
-                                  root_dir_alias)
-            if feature and (feature.ctime > accessed_since or
-                            feature.atime > accessed_since):
-                yield (feature.path, feature, 'file')
-        for fpath in dirs:
-            feature = _crawl_file(root_dir, fpath,
-                                  root_dir_alias)
-            if feature and (feature.ctime > accessed_since or
-                            feature.atime > accessed_since):
-                yield (feature.path, feature, 'file')
+    visitor = FileVisitor(root_dir, exclude_dirs, root_dir_alias,
+                          accessed_since, workers)
+    for (_, feature) in walk_tree([visitor]):
+        yield feature
+
+
+def crawl_watched_files(watcher, root_dir_alias=None):
+    """
+    Crawls the files changed under the root dir of `watcher` (a
+    `utils.file_watcher.TreeWatcher`) since the previous call, like
+    `crawl_files` does for all of them, plus a 'file-removed' feature for
+    every path removed. The first call crawls all of them.
+    """
+    root_dir = watcher.root_dir
+    root_dir_alias = root_dir_alias or root_dir
+    visitor = FileVisitor(root_dir, root_dir_alias=root_dir_alias)
+    (changed, removed) = watcher.get_changes()
+    for (path, entry) in changed:
+        try:
+            for feature in visitor.visit_file(path, entry):
+                yield feature
+        except OSError:
+            # removed since, we will get that event next time
+            continue
+    for path in removed:
+        frelpath = os.path.normpath(os.path.join(
+            root_dir_alias, os.path.relpath(path, root_dir)))
+        yield (frelpath, FileRemovedFeature(os.path.basename(frelpath),
+                                            frelpath), 'file-removed')
+
+
+class FileVisitor(WalkVisitor):
+
+    """
+    Crawls the metadata of every file and dir under `root_dir`, like
+    `crawl_files`, as part of a shared walk (see `utils.fs_walker`).
+    """
+
+    def __init__(self, root_dir='/', exclude_dirs=[], root_dir_alias=None,
+                 accessed_since=0, workers=1):
+        WalkVisitor.__init__(self, root_dir, [os.path.join(root_dir, d)
+                                              for d in exclude_dirs],
+                             workers)
+        self.root_dir_alias = root_dir_alias or root_dir
+        self.accessed_since = accessed_since
+        # The paths walked under a normalized root_dir are root_dir + a
+        # normalized relative path, so we can just replace the prefix
+        # instead of calling os.path.relpath and normpath for every file.
+        self._prefix = os.path.join(root_dir, '')
+        if os.path.join(os.path.normpath(root_dir), '') != self._prefix:
+            self._prefix = None
+        self._alias_prefix = os.path.join(
+            os.path.normpath(self.root_dir_alias), '')
+
+    def _crawl(self, fpath, entry=None):
+        frelpath = None
+        if (self._prefix and fpath.startswith(self._prefix) and
+                fpath != self._prefix):
+            frelpath = self._alias_prefix + fpath[len(self._prefix):]
+        feature = _crawl_file(self.root_dir, fpath, self.root_dir_alias,
+                              get_lstat(fpath, entry), frelpath)
+        if feature and (feature.ctime > self.accessed_since or
+                        feature.atime > self.accessed_since):
+            yield (feature.path, feature, 'file')
+
+    def visit_root(self):
+        return self._crawl(self.root_dir)
+
+    def visit_file(self, path, entry=None):
+        return self._crawl(path, entry)
+
+    def visit_dir(self, path, entry=None):
+        return self._crawl(path, entry)
+
+
+_filetypes = {
+    'l': 'link',
+    '-': 'file',
+    'b': 'block',
+    'd': 'dir',
+    'c': 'char',
+    'p': 'pipe',
+}
 
 
 def _filetype(fpath, fperm):
-    modebit = fperm[0]
-    ftype = {
-        'l': 'link',
-        '-': 'file',
-        'b': 'block',
-        'd': 'dir',
-        'c': 'char',
-        'p': 'pipe',
-    }.get(modebit)
-    return ftype
+    return _filetypes.get(fperm[0])
 
 _filemode_table = (
     (
@@ -96,12 +134,9 @@ _filemode_table = (
 )
 
 
-def _fileperm(mode):
-
-    # Convert a file's mode to a string of the form '-rwxrwxrwx'
-
+def _get_mode_chars(mode, tables):
     perm = []
-    for table in _filemode_table:
+    for table in tables:
         for (bit, char) in table:
             if mode & bit == bit:
                 perm.append(char)
@@ -110,6 +145,21 @@ def _fileperm(mode):
             perm.append('-')
     return ''.join(perm)
 
+# The type char of every S_IFMT(mode) >> 12, and the permission chars of
+# every mode & 07777, so every file does not go through the table above.
+_filetype_chars = [_get_mode_chars(fmt << 12, _filemode_table[:1])
+                   for fmt in range(16)]
+_fileperm_chars = [_get_mode_chars(bits, _filemode_table[1:])
+                   for bits in range(010000)]
+
+
+def _fileperm(mode):
+
+    # Convert a file's mode to a string of the form '-rwxrwxrwx'
+
+    return (_filetype_chars[stat.S_IFMT(mode) >> 12] +
+            _fileperm_chars[mode & 07777])
+
 
 def _is_executable(fpath):
     return os.access(fpath, os.X_OK)
@@ -121,8 +171,11 @@ def _crawl_file(
     root_dir,
     fpath,
     root_dir_alias,
+    lstat=None,
+    frelpath=None,
 ):
-    lstat = os.lstat(fpath)
+    if lstat is None:
+        lstat = os.lstat(fpath)
     fmode = lstat.st_mode
     fperm = _fileperm(fmode)
     ftype = _filetype(fpath, fperm)
@@ -139,17 +192,20 @@ def _crawl_file(
     fgroup = lstat.st_gid
     fuser = lstat.st_uid
 
-    # This replaces `/<root_dir>/a/b/c` with `/<root_dir_alias>/a/b/c`
+    if frelpath is None:
+
+        # This replaces `/<root_dir>/a/b/c` with `/<root_dir_alias>/a/b/c`
 
-    frelpath = os.path.join(root_dir_alias,
-                            os.path.relpath(fpath, root_dir))
+        frelpath = os.path.join(root_dir_alias,
+                                os.path.relpath(fpath, root_dir))
 
-    # This converts something like `/.` to `/`
+        # This converts something like `/.` to `/`
 
-    frelpath = os.path.normpath(frelpath)
+        frelpath = os.path.normpath(frelpath)
 
     (_, fname) = os.path.split(frelpath)
-    return FileFeature(
+    return WalkedFileFeature(
+        lstat.st_ino,
         lstat.st_atime,
         lstat.st_ctime,
         fgroup,
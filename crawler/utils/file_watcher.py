@@ -0,0 +1,366 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import ctypes
+import ctypes.util
+import errno
+import itertools
+import logging
+import os
+import select
+import struct
+import threading
+
+from utils.fs_walker import WalkVisitor, get_lstat, walk_tree
+
+logger = logging.getLogger('crawlutils')
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 02000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR |
+              IN_DONT_FOLLOW)
+
+# struct inotify_event, without the name that follows it
+_EVENT = struct.Struct('iIII')
+
+READ_SIZE = 65536
+
+# Seconds between checks for the watcher being closed
+READ_INTERVAL = 1
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return _libc
+
+
+def _check(ret):
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ret
+
+
+class Inotify(object):
+
+    """
+    An inotify instance. Raises OSError if the kernel does not support
+    inotify, or we have too many instances already.
+    """
+
+    def __init__(self):
+        self.fd = _check(_get_libc().inotify_init1(os.O_NONBLOCK |
+                                                   IN_CLOEXEC))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        return _check(_get_libc().inotify_add_watch(self.fd, path, mask))
+
+    def rm_watch(self, wd):
+        # fails if the watch is already gone, which is fine
+        _get_libc().inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """
+        Returns the list of (wd, mask, name) of the events ready to read.
+        """
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except OSError as exc:
+            if exc.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset < len(data):
+            (wd, mask, _, length) = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            events.append((wd, mask, data[offset:offset + length].rstrip(
+                '\0')))
+            offset += length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _is_under(path, dirpath):
+    return path == dirpath or path.startswith(os.path.join(dirpath, ''))
+
+
+def _get_signature(lstat):
+    # like the file index signatures, the atime is left out on purpose
+    return (lstat.st_mtime, lstat.st_ctime, lstat.st_size, lstat.st_mode,
+            lstat.st_ino)
+
+
+def _get_topmost(paths):
+    """
+    Returns the `paths` that are not under another one of them.
+    """
+    topmost = []
+    # by component, so the paths under a dir come right after it
+    for path in sorted(paths, key=lambda p: p.rstrip('/').split('/')):
+        if not topmost or not _is_under(path, topmost[-1]):
+            topmost.append(path)
+    return topmost
+
+
+class WatchVisitor(WalkVisitor):
+
+    """
+    Watches the dirs of a walk for a TreeWatcher, and returns the (path,
+    DirEntry) of every entry. If not `recursive`, it just watches
+    `root_dir` and lists its entries.
+    """
+
+    def __init__(self, watcher, root_dir, recursive=True):
+        WalkVisitor.__init__(self, root_dir, watcher.exclude_paths)
+        self.watcher = watcher
+        self.walk = recursive
+
+    def visit_root(self):
+        self.watcher.watch(self.root_dir)
+        if not os.path.lexists(self.root_dir):
+            return
+        yield (self.root_dir, None)
+        if self.walk:
+            return
+        try:
+            names = os.listdir(self.root_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.root_dir, name)
+            if not self.excludes(path):
+                yield (path, None)
+
+    def visit_file(self, path, entry=None):
+        yield (path, entry)
+
+    def visit_dir(self, path, entry=None):
+        self.watcher.watch(path)
+        yield (path, entry)
+
+
+class TreeWatcher(object):
+
+    """
+    Keeps inotify watches on the dirs under `root_dir` but the
+    `exclude_paths`, or only on `dirs` (not their subdirs) if given, and
+    accumulates the paths changed in them until `get_changes` is called.
+
+    The events are read as they come by a thread, so they do not pile up
+    in the kernel queue between two calls. If they still overflow it, all
+    the dirs are walked again. If we run out of watches (see
+    /proc/sys/fs/inotify/max_user_watches), the subtrees we could not
+    watch are walked again at every call. The paths found in these walks
+    are compared with the ones known from the previous calls, so only the
+    ones added, changed or removed since are returned.
+    """
+
+    def __init__(self, root_dir='/', exclude_paths=[], dirs=None):
+        self.root_dir = root_dir
+        self.exclude_paths = exclude_paths
+        self._exclusion = WalkVisitor(root_dir, exclude_paths)
+        if dirs is not None:
+            dirs = [d for d in dirs if not self.excludes(d)]
+        self.dirs = dirs
+        self._inotify = Inotify()
+        self._lock = threading.Lock()
+        self._wds = {}
+        self._unwatched = set()
+        self._changed = set()
+        self._removed = set()
+        # Path to the lstat signature (or None if only known from an event)
+        # of every path returned, and dir to the known paths in it. Only
+        # used by the thread calling get_changes.
+        self._known = {}
+        self._children = {}
+        # walked at the first call
+        self._rescan = set(self._get_roots())
+        self._closed = False
+        self._read_interval = READ_INTERVAL
+        self._thread = threading.Thread(target=self._read_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _get_roots(self):
+        return [self.root_dir] if self.dirs is None else self.dirs
+
+    def excludes(self, path):
+        return self._exclusion.excludes(path)
+
+    def watch(self, path):
+        try:
+            wd = self._inotify.add_watch(path)
+        except OSError as exc:
+            if exc.errno == errno.ENOSPC:
+                if not self._unwatched:
+                    logger.warning('Out of inotify watches, walking the '
+                                   'dirs we can not watch at every crawl')
+                with self._lock:
+                    self._unwatched.add(path)
+            elif exc.errno not in (errno.ENOENT, errno.ENOTDIR):
+                logger.debug('Can not watch %s: %s' % (path, exc))
+            return
+        with self._lock:
+            self._wds[wd] = path
+            self._unwatched.discard(path)
+
+    def get_changes(self):
+        """
+        Returns the changes since the previous call: the (path, DirEntry or
+        None) of every file and dir added or changed, and the list of paths
+        removed. The first call returns all the files and dirs.
+
+        The paths removed include the ones known under a removed (or moved
+        away) dir. Both are iterators, which walk the dirs to walk again as
+        they are read: the removed paths are to be read after the changed
+        ones.
+        """
+        with self._lock:
+            (changed, removed, rescan) = (self._changed, self._removed,
+                                          self._rescan | self._unwatched)
+            (self._changed, self._removed, self._rescan) = (set(), set(),
+                                                            set())
+        rescan = _get_topmost(rescan)
+        removed = sorted(set(itertools.chain.from_iterable(
+            self._forget(path) for path in removed)))
+        changed = sorted(path for path in changed
+                         if not any(_is_under(path, d) for d in rescan))
+        for path in changed:
+            self._remember(path, None)
+        seen = set()
+        walked = self._walk(rescan, seen)
+        return (itertools.chain(((path, None) for path in changed), walked),
+                itertools.chain(removed, self._get_unseen(rescan, walked,
+                                                          seen)))
+
+    def _walk(self, dirs, seen):
+        """
+        Walks `dirs` again, adding the paths found to `seen`, and yields the
+        (path, DirEntry) of the ones added or changed since they were known.
+        """
+        visitors = [WatchVisitor(self, d, self.dirs is None) for d in dirs]
+        for (_, (path, entry)) in walk_tree(visitors):
+            seen.add(path)
+            try:
+                signature = _get_signature(get_lstat(path, entry))
+            except OSError:
+                # removed since, we will get that event next time
+                continue
+            if path not in self._known or self._known[path] != signature:
+                self._remember(path, signature)
+                yield (path, entry)
+
+    def _get_unseen(self, dirs, walked, seen):
+        """
+        Yields the known paths under `dirs` not `seen` in their `walked`
+        walk (which is finished first), which are gone.
+        """
+        for _ in walked:
+            pass
+        unseen = []
+        for dirpath in dirs:
+            stack = [dirpath]
+            while stack:
+                path = stack.pop()
+                if path in self._known and path not in seen:
+                    unseen.append(path)
+                stack.extend(self._children.get(path, ()))
+        removed = set(itertools.chain.from_iterable(
+            self._forget(path) for path in _get_topmost(unseen)))
+        for path in sorted(removed):
+            yield path
+
+    def _remember(self, path, signature):
+        if path not in self._known:
+            self._children.setdefault(os.path.dirname(path), set()).add(path)
+        self._known[path] = signature
+
+    def _forget(self, path):
+        """
+        Forgets `path` and every known path under it, and returns them.
+        """
+        forgotten = []
+        stack = [path]
+        while stack:
+            known_path = stack.pop()
+            self._known.pop(known_path, None)
+            forgotten.append(known_path)
+            stack.extend(self._children.pop(known_path, ()))
+        self._children.get(os.path.dirname(path), set()).discard(path)
+        return forgotten
+
+    def close(self):
+        self._closed = True
+        self._thread.join()
+        self._inotify.close()
+
+    def _read_loop(self):
+        while not self._closed:
+            try:
+                (readable, _, _) = select.select([self._inotify.fd], [], [],
+                                                 self._read_interval)
+                events = self._inotify.read_events() if readable else []
+            except Exception:
+                logger.error('Error reading inotify events', exc_info=True)
+                with self._lock:
+                    self._rescan.update(self._get_roots())
+                continue
+            with self._lock:
+                for (wd, mask, name) in events:
+                    self._handle_event(wd, mask, name)
+
+    def _handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning('Lost inotify events, walking %s again'
+                           % self.root_dir)
+            self._rescan.update(self._get_roots())
+            return
+        dirpath = self._wds.get(wd)
+        if dirpath is None:
+            return
+        if mask & IN_IGNORED:
+            del self._wds[wd]
+            return
+        path = os.path.join(dirpath, name) if name else dirpath
+        if self.excludes(path):
+            return
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self._changed.discard(path)
+            self._removed.add(path)
+            if mask & IN_MOVED_FROM and mask & IN_ISDIR:
+                self._forget_dir(path)
+            return
+        self._removed.discard(path)
+        if (mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and
+                self.dirs is None):
+            # walk it, to watch it and find what was already in it
+            self._rescan.add(path)
+        else:
+            self._changed.add(path)
+
+    def _forget_dir(self, path):
+        # the watches under a dir moved away would report the old paths
+        for (wd, dirpath) in self._wds.items():
+            if _is_under(dirpath, path):
+                self._inotify.rm_watch(wd)
+                del self._wds[wd]
@@ -0,0 +1,400 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import fnmatch
+import logging
+import multiprocessing
+import os
+import re
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+# External dependencies that must be pip install'ed separately
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+logger = logging.getLogger('crawlutils')
+
+# Seconds between checks for interrupts while waiting on the walk threads
+POOL_POLL_INTERVAL = 1
+
+# Key of the trie nodes where a path ends
+_END = None
+
+# A visitor of a plugin for the shared walk of the files of a container,
+# and whether it walks the container rootfs from the host (avoid_setns)
+# or from inside its mount namespace.
+WalkCrawl = namedtuple('WalkCrawl', ['visitor', 'avoid_setns'])
+
+
+def get_exclude_regex(exclude_paths):
+    """
+    Returns the compiled regex matching any of the `exclude_paths`
+    (fnmatch patterns), or nothing if there are none.
+    """
+    return re.compile(r'|'.join([fnmatch.translate(p)
+                                 for p in exclude_paths]) or r'$.')
+
+
+def open_in_root(root_dir, path):
+    """
+    Opens `path` (a file under `root_dir`, like a container rootfs seen
+    from the host) for reading without following symlinks in any of its
+    components, which could point outside of `root_dir` otherwise. Every
+    component is opened relative to the fd of its parent dir, and the file
+    without blocking (if it is a fifo).
+
+    :raise OSError: if one of the components is a symlink.
+    """
+    names = [name for name in path.split('/') if name]
+    fd = os.open(root_dir, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        for (i, name) in enumerate(names):
+            flags = os.O_RDONLY | os.O_NOFOLLOW
+            if i < len(names) - 1:
+                flags |= os.O_DIRECTORY
+            else:
+                flags |= os.O_NONBLOCK
+            child_fd = os.open('/proc/self/fd/%d/%s' % (fd, name), flags)
+            os.close(fd)
+            fd = child_fd
+        return os.fdopen(fd, 'rb')
+    except BaseException:
+        os.close(fd)
+        raise
+
+
+def _is_pattern(path):
+    return any(c in path for c in '*?[')
+
+
+def get_lstat(path, entry=None):
+    """
+    Returns the lstat of `path`, reusing the one of its scandir `entry`
+    (which visitors of the same entry share) if there is one.
+    """
+    if entry is not None:
+        return entry.stat(follow_symlinks=False)
+    return os.lstat(path)
+
+
+class PathTrie(object):
+
+    """
+    The paths added, by component. The walk keeps the node of every dir,
+    so finding out if an entry is one of the paths (or on the way to one)
+    is a dict lookup of its name, whatever the number of paths.
+    """
+
+    def __init__(self, paths=[]):
+        self.root = {}
+        for path in paths:
+            self.add(path)
+
+    def add(self, path):
+        node = self.root
+        for name in path.split('/'):
+            node = node.setdefault(name, {})
+        node[_END] = True
+
+    def get(self, path):
+        """
+        Returns the node of `path`, or None if no path starts with it.
+        """
+        node = self.root
+        for name in path.rstrip('/').split('/'):
+            node = node.get(name)
+            if node is None:
+                return None
+        return node
+
+    def __contains__(self, path):
+        node = self.get(path)
+        return node is not None and _END in node
+
+
+class WalkVisitor(object):
+
+    """
+    Crawls features from the entries of a directory tree walked by
+    `walk_tree`, which can walk the tree once for many visitors.
+
+    Subclasses override the visit methods, which return (or yield) the
+    features found in every entry. Entries matching `exclude_paths` (and
+    everything under excluded dirs) are not visited. The visit methods
+    get the scandir DirEntry of the entry, if any, to reuse its lstat (see
+    `get_lstat`).
+
+    With `workers` > 1, the dirs are listed and visited by that many
+    threads, which helps on network or overlay filesystems where most of
+    the walk is spent waiting. Visitors are then called from many threads.
+    """
+
+    # False for visitors that only visit the root dir
+    walk = True
+
+    def __init__(self, root_dir='/', exclude_paths=[], workers=1):
+        self.root_dir = root_dir
+        self.workers = workers
+        # plain paths are looked up in a trie, fnmatch patterns with a regex
+        self.exclude_trie = PathTrie(p for p in exclude_paths
+                                     if not _is_pattern(p))
+        patterns = [p for p in exclude_paths if _is_pattern(p)]
+        self.exclude_regex = get_exclude_regex(patterns) if patterns \
+            else None
+
+    def excludes(self, path):
+        return path in self.exclude_trie or (
+            self.exclude_regex is not None and
+            self.exclude_regex.match(path) is not None)
+
+    def get_node(self, dirpath):
+        """
+        Returns the state of this visitor for the dir where the walk
+        starts, passed to `enter` for its entries.
+        """
+        return self.exclude_trie.get(dirpath)
+
+    def enter(self, node, name, path):
+        """
+        Returns (excluded, node) for the entry `name` (at `path`) of the dir
+        whose node is `node`.
+        """
+        child = node.get(name) if node else None
+        if child is not None and _END in child:
+            return (True, None)
+        return (self.exclude_regex is not None and
+                self.exclude_regex.match(path) is not None, child)
+
+    def visit_root(self):
+        return []
+
+    def visit_file(self, path, entry=None):
+        return []
+
+    def visit_dir(self, path, entry=None):
+        return []
+
+    def finish(self):
+        """Called once the walk is done."""
+        return []
+
+
+class SuffixVisitor(WalkVisitor):
+
+    """
+    Collects the names of the files (and dirs, if `dirs` is True) ending
+    with any of `suffixes`, in the `paths` under `root_dir`.
+    """
+
+    # node of the dirs under one of the paths
+    _INSIDE = {}
+
+    def __init__(self, root_dir, paths, suffixes, dirs=False):
+        WalkVisitor.__init__(self, root_dir)
+        self.paths = [os.path.join(root_dir, path).rstrip('/')
+                      for path in paths]
+        self.paths_trie = PathTrie(self.paths)
+        self.suffixes = tuple(suffixes)
+        self.dirs = dirs
+
+    def _in_paths(self, path):
+        return any(path.startswith(p + '/') for p in self.paths)
+
+    def excludes(self, path):
+        # walk the `paths`, and the dirs on the way to them
+        return not any(path == p or path.startswith(p + '/') or
+                       p.startswith(path + '/') for p in self.paths)
+
+    def get_node(self, dirpath):
+        if self._in_paths(dirpath) or dirpath.rstrip('/') in self.paths:
+            return self._INSIDE
+        return self.paths_trie.get(dirpath)
+
+    def enter(self, node, name, path):
+        if node is self._INSIDE:
+            return (False, node)
+        child = node.get(name) if node else None
+        if child is None:
+            return (True, None)
+        return (False, self._INSIDE if _END in child else child)
+
+    def visit_file(self, path, entry=None):
+        if path.endswith(self.suffixes) and self._in_paths(path):
+            yield os.path.basename(path)
+
+    def visit_dir(self, path, entry=None):
+        if self.dirs:
+            return self.visit_file(path)
+        return []
+
+
+def _visit(visitors, method, *args):
+    for (index, visitor) in visitors:
+        for feature in getattr(visitor, method)(*args):
+            yield (index, feature)
+
+
+def _enter(states, name, path):
+    entered = []
+    for (index, visitor, node) in states:
+        (excluded, child) = visitor.enter(node, name, path)
+        if not excluded:
+            entered.append((index, visitor, child))
+    return entered
+
+
+def _visit_entry(states, method, entry):
+    return [(index, feature) for (index, visitor, _) in states
+            for feature in getattr(visitor, method)(entry.path, entry)]
+
+
+def _scan_dir(dirpath, states):
+    """
+    Visits the entries of `dirpath` for the (index, visitor, node)
+    `states`, files first, like `_os_walk`.
+
+    :return: the list of (index, feature), and the list of (path, states)
+    of the subdirs to walk.
+    """
+    try:
+        entries = list(scandir(dirpath))
+    except OSError:
+        # like os.walk, skip the dirs we can not list
+        return ([], [])
+    files = []
+    dirs = []
+    for entry in entries:
+        entry_states = _enter(states, entry.name, entry.path)
+        if not entry_states:
+            continue
+        # like os.walk, links to dirs are dirs, but we do not follow them
+        if entry.is_dir():
+            dirs.append((entry, entry_states))
+        else:
+            files.append((entry, entry_states))
+    items = []
+    for (entry, entry_states) in files:
+        items.extend(_visit_entry(entry_states, 'visit_file', entry))
+    subdirs = []
+    for (entry, entry_states) in dirs:
+        items.extend(_visit_entry(entry_states, 'visit_dir', entry))
+        if not entry.is_symlink():
+            subdirs.append((entry.path, entry_states))
+    return (items, subdirs)
+
+
+def _scandir_walk(root_dir, states):
+    # depth first, like os.walk
+    stack = [(root_dir, states)]
+    while stack:
+        (items, subdirs) = _scan_dir(*stack.pop())
+        for item in items:
+            yield item
+        stack.extend(reversed(subdirs))
+
+
+def _get_result(result):
+    # AsyncResult.get() without a timeout can not be interrupted by signals
+    # in Python 2
+    while True:
+        try:
+            return result.get(POOL_POLL_INTERVAL)
+        except multiprocessing.TimeoutError:
+            continue
+
+
+def _parallel_walk(root_dir, states, workers):
+    """
+    Like `_scandir_walk`, but the dirs are scanned by a pool of `workers`
+    threads, with up to twice that many dirs being scanned at any time.
+    """
+    pool = ThreadPool(workers)
+    stack = [(root_dir, states)]
+    running = []
+    try:
+        while stack or running:
+            while stack and len(running) < 2 * workers:
+                running.append(pool.apply_async(_scan_dir, stack.pop()))
+            (items, subdirs) = _get_result(running.pop(0))
+            stack.extend(reversed(subdirs))
+            for item in items:
+                yield item
+    finally:
+        pool.terminate()
+
+
+def _walk(root_dir, visitors, workers=1):
+    """
+    Walks `root_dir` once for all the (index, visitor) `visitors`, and
+    yields (index, feature) for every feature they return.
+
+    The dirs are listed with scandir, if available, whose entries tell
+    the dirs apart without a stat, and keep the lstat shared by all the
+    visitors of the entry.
+    """
+    if scandir is None:
+        return _os_walk(root_dir, visitors)
+    states = [(index, visitor, visitor.get_node(root_dir))
+              for (index, visitor) in visitors]
+    if workers > 1:
+        return _parallel_walk(root_dir, states, workers)
+    return _scandir_walk(root_dir, states)
+
+
+def _os_walk(root_dir, visitors):
+    # The visitors of every dir to walk. A dir is only walked if some
+    # visitor does not exclude it.
+    dir_visitors = {root_dir: visitors}
+    for (dirpath, dirs, files) in os.walk(root_dir):
+        visitors_here = dir_visitors.pop(dirpath, visitors)
+        kept_dirs = []
+        for dirname in dirs:
+            path = os.path.join(dirpath, dirname)
+            path_visitors = [(index, visitor)
+                             for (index, visitor) in visitors_here
+                             if not visitor.excludes(path)]
+            if path_visitors:
+                dir_visitors[path] = path_visitors
+                kept_dirs.append(path)
+        # full paths, that os.walk joins with dirpath as they are
+        dirs[:] = kept_dirs
+        for filename in files:
+            path = os.path.join(dirpath, filename)
+            for item in _visit([(index, visitor)
+                                for (index, visitor) in visitors_here
+                                if not visitor.excludes(path)],
+                               'visit_file', path):
+                yield item
+        for path in kept_dirs:
+            for item in _visit(dir_visitors[path], 'visit_dir', path):
+                yield item
+
+
+def walk_tree(visitors):
+    """
+    Walks the trees of all `visitors` in one pass (one per root dir), and
+    yields (index, feature) for every feature they return, with the index
+    of the visitor in `visitors`.
+    """
+    visitors = list(enumerate(visitors))
+    for item in _visit(visitors, 'visit_root'):
+        yield item
+    root_dirs = []
+    for (_, visitor) in visitors:
+        if visitor.walk and visitor.root_dir not in root_dirs:
+            root_dirs.append(visitor.root_dir)
+    for root_dir in root_dirs:
+        logger.debug('Walking %s' % root_dir)
+        root_visitors = [(index, visitor) for (index, visitor) in visitors
+                         if visitor.walk and visitor.root_dir == root_dir]
+        workers = max(visitor.workers for (_, visitor) in root_visitors)
+        for item in _walk(root_dir, root_visitors, workers):
+            yield item
+    for item in _visit(visitors, 'finish'):
+        yield item
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import logging
+import os
+
+from utils import procfs
+from utils.fs_walker import open_in_root
+
+logger = logging.getLogger('crawlutils')
+
+
+def _get_pid_namespace(pid, proc_dir):
+    return os.stat(os.path.join(proc_dir, str(pid), 'ns', 'pid')).st_ino
+
+
+def _get_cgroup_container(host_pid, long_ids, proc_dir):
+    """
+    Returns the ID of the container in `long_ids` in whose cgroups process
+    `host_pid` is, or None.
+    """
+    try:
+        with open(os.path.join(proc_dir, str(host_pid), 'cgroup')) as f:
+            cgroups = f.read()
+    except IOError:
+        return None
+    return next((long_id for long_id in long_ids if long_id in cgroups),
+                None)
+
+
+def _get_usernames(container, proc_dir):
+    """
+    Returns the dictionary of uid to username of the /etc/passwd of the
+    container, or an empty one if we can not read it.
+    """
+    root_dir = os.path.join(proc_dir, str(container.pid), 'root')
+    try:
+        with open_in_root(root_dir, '/etc/passwd') as passwd:
+            return procfs.read_passwd(passwd)
+    except (IOError, OSError) as exc:
+        logger.debug('Can not read the /etc/passwd of %s: %s'
+                     % (container.long_id, exc))
+        return {}
+
+
+def _to_container_view(records, usernames):
+    """
+    Returns `records` (all the processes of a container) with their parent
+    pids as seen inside the container, and the usernames of their uids in
+    `usernames`. Parents outside of it (like the docker shim of the
+    container init) are 0, as they are for the init.
+    """
+    ns_pids = dict((record.host_pid, record.pid) for record in records)
+    return [record._replace(
+        ppid=ns_pids.get(record.ppid, 0),
+        username=usernames.get(int(record.username), record.username))
+        for record in records]
+
+
+def _map_containers(containers, host_namespace, proc_dir):
+    """
+    Returns a dictionary of pid namespace inode to container ID, and the
+    list of containers sharing the host pid namespace.
+    """
+    namespaces = {}
+    shared = []
+    for container in containers:
+        try:
+            namespace = _get_pid_namespace(container.pid, proc_dir)
+        except OSError as exc:
+            logger.debug('Can not stat the pid namespace of %s: %s'
+                         % (container.long_id, exc))
+            continue
+        if namespace == host_namespace:
+            shared.append(container.long_id)
+        else:
+            namespaces[namespace] = container.long_id
+    return (namespaces, shared)
+
+
+def scan_host_processes(containers, io=False, fds=False,
+                        proc_dir=procfs.PROC_DIR):
+    """
+    Reads all the processes of the host in one pass (see
+    `procfs.read_processes`) and splits them by container, instead of
+    entering the pid namespace of every container to read its /proc.
+
+    Processes belong to the container with the same pid namespace, or for
+    containers sharing the host pid namespace, to the container in whose
+    cgroup they are. Their pids are the ones seen inside the container, and
+    their usernames the ones in its /etc/passwd.
+
+    Kernels older than 4.1 do not tell the pids seen inside other pid
+    namespaces, so only containers sharing the host pid namespace are
+    scanned on them.
+
+    We need to be in the host pid namespace (with --pid=host in a
+    container) for this to work.
+
+    :param containers: list of Container objects.
+    :return: a dictionary of container ID to the list of its ProcessRecords,
+    for the containers whose pid namespace we found.
+    """
+    host_namespace = _get_pid_namespace('self', proc_dir)
+    (namespaces, shared) = _map_containers(containers, host_namespace,
+                                           proc_dir)
+    partition = dict((long_id, []) for long_id in namespaces.values())
+    partition.update((long_id, []) for long_id in shared)
+
+    for record in procfs.read_processes(io=io, fds=fds, namespaces=True,
+                                        proc_dir=proc_dir):
+        long_id = namespaces.get(record.pid_namespace)
+        if (long_id is None and shared and
+                record.pid_namespace == host_namespace):
+            long_id = _get_cgroup_container(record.host_pid, shared,
+                                            proc_dir)
+        if long_id is None or long_id not in partition:
+            continue
+        if record.pid is None:
+            if long_id in shared:
+                record = record._replace(pid=record.host_pid)
+            else:
+                # crawled from inside its namespaces instead
+                del partition[long_id]
+                continue
+        partition[long_id].append(record)
+
+    containers = dict((container.long_id, container)
+                      for container in containers)
+    return dict((long_id, _to_container_view(
+                 records, _get_usernames(containers[long_id], proc_dir)))
+                for (long_id, records) in partition.iteritems())
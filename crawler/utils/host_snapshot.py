@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+
+import psutil
+
+_current = None
+
+
+class HostSnapshot(object):
+
+    """
+    Values of the host shared by all the container plugins during a
+    crawling iteration, so every plugin does not read them again for every
+    container, and all containers get the same ones. In particular, the
+    cpu times percent are since the previous iteration, and not since the
+    previous container crawled.
+
+    Every value is read the first time a plugin uses it, or all of them at
+    once by `read`, so that they are from the time of the snapshot.
+    """
+
+    def __init__(self):
+        self.time = time.time()
+        self._values = {}
+        # containers can be crawled concurrently
+        self._lock = threading.Lock()
+
+    _NAMES = ('cpu_times_percent', 'virtual_memory', 'loadavg', 'uptime')
+
+    def read(self):
+        """Reads all the values now."""
+        for name in self._NAMES:
+            getattr(self, name)
+
+    def _get(self, name, read):
+        with self._lock:
+            if name not in self._values:
+                self._values[name] = read()
+            return self._values[name]
+
+    @property
+    def cpu_times_percent(self):
+        """The per cpu psutil.cpu_times_percent."""
+        return self._get('cpu_times_percent',
+                         lambda: psutil.cpu_times_percent(percpu=True))
+
+    @property
+    def virtual_memory(self):
+        return self._get('virtual_memory', psutil.virtual_memory)
+
+    @property
+    def loadavg(self):
+        return self._get('loadavg', os.getloadavg)
+
+    @property
+    def uptime(self):
+        """Seconds since the host booted, at the time of the snapshot."""
+        return self._get('uptime', lambda: self.time - psutil.boot_time())
+
+
+def take_snapshot():
+    """
+    Starts a new crawling iteration, with a new HostSnapshot of the values
+    of the host now.
+    """
+    global _current
+    snapshot = HostSnapshot()
+    snapshot.read()
+    _current = snapshot
+    return snapshot
+
+
+def clear_snapshot():
+    global _current
+    _current = None
+
+
+def get_snapshot():
+    """
+    Returns the HostSnapshot of the current crawling iteration, or a new
+    one if there is none (like when calling a plugin directly).
+    """
+    snapshot = _current
+    if snapshot is None:
+        snapshot = HostSnapshot()
+    return snapshot
@@ -1,11 +1,10 @@
-import fnmatch
 import logging
 import os
-import re
 import hashlib
 import zipfile
 
 from utils.features import JarFeature
+from utils.fs_walker import WalkVisitor, walk_tree
 
 logger = logging.getLogger('crawlutils')
 
@@ -23,32 +22,29 @@ def crawl_jar_files(
     logger.debug('crawl_jar_files: %s' % (saved_args))
 
     assert os.path.isdir(root_dir)
-    if root_dir_alias is None:
-        root_dir_alias = root_dir
-    exclude_dirs = [os.path.join(root_dir, d) for d in
-                    exclude_dirs]
-    exclude_regex = r'|'.join([fnmatch.translate(d)
-                               for d in exclude_dirs]) or r'$.'
-
-    # walk the directory hierarchy starting at 'root_dir' in BFS
-    # order
-
-    for (root_dirpath, dirs, files) in os.walk(root_dir):
-        dirs[:] = [os.path.join(root_dirpath, d) for d in
-                   dirs]
-        dirs[:] = [d for d in dirs
-                   if not re.match(exclude_regex, d)]
-        files = [os.path.join(root_dirpath, f) for f in
-                 files]
-        files = [f for f in files
-                 if not re.match(exclude_regex, f)]
-
-        for fpath in files:
-            if not fpath.endswith('.jar'):
-                continue
-            feature = _crawl_jar_file(root_dir, fpath, root_dir_alias)
-            if feature:
-                yield (feature.path, feature, 'jar')
+    visitor = JarVisitor(root_dir, exclude_dirs, root_dir_alias)
+    for (_, feature) in walk_tree([visitor]):
+        yield feature
+
+
+class JarVisitor(WalkVisitor):
+
+    """
+    Crawls the .jar files under `root_dir`, like `crawl_jar_files`, as
+    part of a shared walk (see `utils.fs_walker`).
+    """
+
+    def __init__(self, root_dir='/', exclude_dirs=[], root_dir_alias=None):
+        WalkVisitor.__init__(self, root_dir, [os.path.join(root_dir, d)
+                                              for d in exclude_dirs])
+        self.root_dir_alias = root_dir_alias or root_dir
+
+    def visit_file(self, path, entry=None):
+        if not path.endswith('.jar'):
+            return
+        feature = _crawl_jar_file(self.root_dir, path, self.root_dir_alias)
+        if feature:
+            yield (feature.path, feature, 'jar')
 
 
 # crawl a single file
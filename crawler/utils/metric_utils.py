@@ -1,35 +1,195 @@
+import time
+
 import psutil
 
+from utils import procfs
+from utils.counter_rates import CounterRates
 from utils.features import MetricFeature
 
+# Seconds between the two cpu times samples of the processes crawled for
+# the first time, to get their first cpu percent.
+FIRST_SAMPLE_INTERVAL = 0.1
+
+# cpu seconds used by every process crawled, per (pid, create_time). The
+# host is the None entity, and containers are their ID. They are kept in the
+# crawler process: the functions run in the container namespaces are given
+# the processes with a previous sample, and return their cpu times samples
+# (see `crawl_metric_samples`).
+_cpu_rates = CounterRates()
+
+
+def _get_cpu_time(process):
+    cpu_times = (
+        process.get_cpu_times() if hasattr(
+            process,
+            'get_cpu_times') else process.cpu_times())
+    return cpu_times.user + cpu_times.system
+
+
+def _get_cpu_time_or_none(process):
+    try:
+        return _get_cpu_time(process)
+    except psutil.NoSuchProcess:
+        return None
+
+
+def _sample_cpu_times(cpu_times, get_cpu_time, known_keys):
+    """
+    Returns the samples needed for the cpu percent of every process in
+    `cpu_times`, a dictionary of (pid, create_time) to the cpu seconds used
+    by the process: a list of (time, cpu_times) tuples.
+
+    The percents of the `known_keys` processes come from their previous
+    sample. The other processes are sampled again with `get_cpu_time(key)`
+    (None if the process is gone), sleeping once for all of them instead of
+    once per process.
+    """
+    samples = [(time.time(), cpu_times)]
+    new_keys = [key for key in cpu_times if key not in known_keys]
+    if new_keys:
+        time.sleep(FIRST_SAMPLE_INTERVAL)
+        new_cpu_times = {}
+        for key in new_keys:
+            cpu_time = get_cpu_time(key)
+            if cpu_time is not None:
+                new_cpu_times[key] = cpu_time
+        samples.append((time.time(), new_cpu_times))
+    return samples
+
+
+def _get_cpu_percents(cpu_samples, entity):
+    """
+    Returns a dictionary with the cpu percent of every process sampled in
+    `cpu_samples` (see `_sample_cpu_times`). The processes of `entity` that
+    are not in them are gone, so their samples are forgotten.
+    """
+    rates = {}
+    for (index, (now, cpu_times)) in enumerate(cpu_samples):
+        samples = dict((key, [cpu_time])
+                       for (key, cpu_time) in cpu_times.iteritems())
+        rates.update(_cpu_rates.rates(entity, samples, now=now,
+                                      forget_missing=(index == 0)))
+    return dict((key, rate[0] * 100 if rate else 0.0)
+                for (key, rate) in rates.iteritems())
+
+
+def crawl_metrics(entity=None):
+    """
+    Crawls the metrics of all the processes in sight, reading /proc directly
+    if the procfs reader is enabled, or with psutil otherwise.
+
+    :param entity: the container crawled (its ID), or None for the host.
+    Used to keep the cpu times of its processes between crawls.
+    """
+    return crawl_metrics_from_samples(
+        crawl_metric_samples(get_known_processes(entity)), entity)
+
+
+def get_known_processes(entity=None):
+    """
+    Returns the (pid, create_time) of the processes of `entity` with a
+    previous cpu times sample, for `crawl_metric_samples`.
+    """
+    return _cpu_rates.get_keys(entity)
+
+
+def crawl_metric_samples(known_processes=()):
+    """
+    Like `crawl_metrics`, but returns the metrics without their cpu percent,
+    for `crawl_metrics_from_samples` to add it. This is what runs inside the
+    container namespaces, while the cpu times are kept by the crawler.
 
-def _crawl_metrics_cpu_percent(process):
-    cpu_percent = (
-        process.get_cpu_percent(
-            interval=0.1) if hasattr(
-            process.get_cpu_percent,
-            '__call__') else process.cpu_percent)
-    return cpu_percent
+    :param known_processes: see `get_known_processes`.
+    :return: a (metrics, cpu_samples) tuple, where `metrics` is a list of
+    ((pid, create_time), feature key, MetricFeature).
+    """
+    if procfs.use_procfs():
+        return _crawl_metrics_procfs(known_processes)
+    return _crawl_metrics_psutil(known_processes)
 
 
-def crawl_metrics():
-    created_since = -1
+def crawl_metrics_from_samples(samples, entity=None):
+    """
+    Returns the metric features of the (metrics, cpu_samples) `samples`
+    returned by `crawl_metric_samples` for `entity`.
+    """
+    (metrics, cpu_samples) = samples
+    cpu_percents = _get_cpu_percents(cpu_samples, entity)
+    for (key, feature_key, feature) in metrics:
+        yield (feature_key,
+               feature._replace(cpupct=round(cpu_percents[key], 2)),
+               'metric')
 
+
+def _crawl_metrics_procfs(known_processes):
+    return _get_record_samples(procfs.read_processes(io=True),
+                               known_processes)
+
+
+def crawl_metrics_from_records(records, entity=None):
+    """
+    Crawls the metrics of the processes in `records`, procfs ProcessRecords
+    read with io=True.
+    """
+    return crawl_metrics_from_samples(
+        _get_record_samples(records, get_known_processes(entity)), entity)
+
+
+def _get_record_samples(records, known_processes):
+    records = dict(((record.pid, record.create_time), record)
+                   for record in records
+                   if record.status != psutil.STATUS_ZOMBIE)
+
+    cpu_samples = _sample_cpu_times(
+        dict((key, record.cpu_time) for (key, record) in records.iteritems()),
+        lambda key: procfs.read_cpu_time(records[key].host_pid),
+        known_processes)
+    mem_total = float(procfs.get_mem_total())
+
+    metrics = []
+    for (key, record) in records.iteritems():
+        feature_key = '{0}/{1}'.format(record.name, record.pid)
+        metrics.append((key, feature_key, MetricFeature(
+            None,
+            round(record.rss * 100 / mem_total, 2),
+            record.name,
+            record.pid,
+            record.read_bytes,
+            record.rss,
+            str(record.status),
+            record.username,
+            record.vms,
+            record.write_bytes,
+        )))
+    return (metrics, cpu_samples)
+
+
+def _crawl_metrics_psutil(known_processes):
+    processes = {}
+    statuses = {}
     for p in psutil.process_iter():
         create_time = (
             p.create_time() if hasattr(
                 p.create_time,
                 '__call__') else p.create_time)
-        if create_time <= created_since:
-            continue
-
-        name = (p.name() if hasattr(p.name, '__call__'
-                                    ) else p.name)
         pid = (p.pid() if hasattr(p.pid, '__call__') else p.pid)
         status = (p.status() if hasattr(p.status, '__call__'
                                         ) else p.status)
         if status == psutil.STATUS_ZOMBIE:
             continue
+        processes[(pid, create_time)] = p
+        statuses[pid] = status
+
+    cpu_samples = _sample_cpu_times(
+        dict((key, _get_cpu_time(p)) for (key, p) in processes.iteritems()),
+        lambda key: _get_cpu_time_or_none(processes[key]),
+        known_processes)
+
+    metrics = []
+    for ((pid, create_time), p) in processes.iteritems():
+        name = (p.name() if hasattr(p.name, '__call__'
+                                    ) else p.name)
+        status = statuses[pid]
         username = (
             p.username() if hasattr(
                 p.username,
@@ -43,16 +203,14 @@ def crawl_metrics():
                 p.get_io_counters,
                 '__call__') else p.io_counters)
 
-        cpu_percent = _crawl_metrics_cpu_percent(p)
-
         memory_percent = (
             p.get_memory_percent() if hasattr(
                 p.get_memory_percent,
                 '__call__') else p.memory_percent)
 
         feature_key = '{0}/{1}'.format(name, pid)
-        yield (feature_key, MetricFeature(
-            round(cpu_percent, 2),
+        metrics.append(((pid, create_time), feature_key, MetricFeature(
+            None,
             round(memory_percent, 2),
             name,
             pid,
@@ -62,4 +220,5 @@ def crawl_metrics():
             username,
             meminfo.vms,
             ioinfo.write_bytes,
-        ), 'metric')
+        )))
+    return (metrics, cpu_samples)
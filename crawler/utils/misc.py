@@ -10,6 +10,8 @@ import logging
 import logging.handlers
 import time
 import random
+import threading
+from collections import OrderedDict
 
 # Additional modules
 
@@ -251,3 +253,51 @@ def get_uint_arg(name, default, **kwargs):
     except:
         logger.error('Parameter %s is not an integer' % name)
         return default
+
+
+class LRUCache(object):
+
+    """
+    Thread-safe dictionary that keeps at most `maxsize` entries, evicting
+    the least recently used ones.
+    """
+
+    def __init__(self, maxsize=128):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                return default
+            self._entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def items(self):
+        with self._lock:
+            return self._entries.items()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
@@ -1,13 +1,26 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import os
+import atexit
 import multiprocessing
+# Imported by multiprocessing.Queue() on first use, which must not happen
+# after attaching to the mount namespace of a container.
+import multiprocessing.queues  # noqa
 import Queue
 import logging
 import sys
 import types
 import signal
 import ctypes
+import cPickle
+import pickle
+import threading
+import time
+import _multiprocessing
+from collections import namedtuple
+from cStringIO import StringIO
+from multiprocessing import reduction
+from multiprocessing.forking import ForkingPickler
 from crawler_exceptions import (CrawlTimeoutError,
                                 CrawlError,
                                 NamespaceFailedSetns)
@@ -24,6 +37,52 @@ except Exception as e:
 ALL_NAMESPACES = 'user pid uts ipc net mnt'.split()
 IN_PROCESS_TIMEOUT = 30
 
+# Number of items sent in every message by run_as_another_namespace_stream
+STREAM_CHUNK_SIZE = 1000
+(_STREAM_CHUNK, _STREAM_END, _STREAM_ERROR) = range(3)
+
+# Describes a function to be called inside the namespaces of a process:
+# `function(*args)` is called after attaching to `namespaces`.
+NamespaceCrawl = namedtuple('NamespaceCrawl',
+                            ['namespaces', 'function', 'args'])
+
+
+def _get_logging_locks():
+    locks = [logging._lock] if logging._lock else []
+    for ref in logging._handlerList:
+        handler = ref()
+        if handler is not None and handler.lock is not None:
+            locks.append(handler.lock)
+    return locks
+
+
+class _Process(multiprocessing.Process):
+    """
+    A multiprocessing.Process that can be started from any thread.
+
+    fork() only copies the calling thread, so a child forked while another
+    thread holds a lock would inherit it held, with nobody left to release
+    it. The logging locks are the ones every crawler thread takes, so they
+    are acquired around the fork, and released in the child where they are
+    held by its only thread. Functions run in the children must not take
+    any other lock shared with the crawler threads.
+    """
+
+    def start(self):
+        self._logging_locks = _get_logging_locks()
+        for lock in self._logging_locks:
+            lock.acquire()
+        try:
+            multiprocessing.Process.start(self)
+        finally:
+            for lock in reversed(self._logging_locks):
+                lock.release()
+
+    def run(self):
+        for lock in reversed(self._logging_locks):
+            lock.release()
+        multiprocessing.Process.run(self)
+
 
 def get_errno_msg():
     try:
@@ -92,21 +151,636 @@ def run_as_another_namespace(
     *args,
     **kwargs
 ):
-    hack_to_pre_load_modules()
-
     _args = (pid, namespaces, function)
     _kwargs = {'_args': tuple(args), '_kwargs': dict(kwargs)}
-    return run_as_another_process(_run_as_another_namespace, _args, _kwargs)
+    return _run_in_new_process(_run_as_another_namespace, _args, _kwargs)
+
+
+def run_as_another_namespace_batch(pid, calls):
+    """
+    Runs the `calls` in processes attached to the namespaces of `pid`
+    (namespace sessions), instead of paying for a couple of forks per call
+    like `run_as_another_namespace` does. The calls requesting the same
+    namespaces share a session, so every call sees exactly the namespaces
+    it asked for.
+
+    :param pid: pid of the process whose namespaces we attach to.
+    :param calls: list of NamespaceCrawl's.
+    :return: a list of (result, exception) tuples, one for each call and in
+    the same order as `calls`. If a whole session fails, every call in it
+    gets the session exception.
+    """
+    return _run_grouped_calls(
+        calls, lambda namespaces, group: _run_session(pid, namespaces,
+                                                      group))
+
+
+def _run_grouped_calls(calls, run_group):
+    """
+    Calls `run_group(namespaces, group)` for every group of `calls`
+    requesting the same namespaces, and returns the results of all of them
+    in the order of `calls`.
+    """
+    groups = {}
+    for (position, call) in enumerate(calls):
+        namespaces = tuple(ns for ns in ALL_NAMESPACES
+                           if ns in call.namespaces)
+        groups.setdefault(namespaces, []).append(position)
+
+    results = [None] * len(calls)
+    for (namespaces, positions) in sorted(groups.iteritems()):
+        group_results = run_group(list(namespaces),
+                                  [calls[position] for position in positions])
+        for (position, result) in zip(positions, group_results):
+            results[position] = result
+    return results
+
+
+def _run_session(pid, namespaces, calls):
+    timeout = IN_PROCESS_TIMEOUT * len(calls)
+
+    _args = (pid, namespaces, _run_calls)
+    _kwargs = {'_args': (calls,), '_kwargs': {}, 'timeout': timeout}
+    try:
+        return _run_in_new_process(_run_as_another_namespace, _args,
+                                   _kwargs, timeout=timeout)
+    except Exception as exc:
+        return [(None, exc)] * len(calls)
+
+
+def _run_calls(calls):
+    """
+    Calls every NamespaceCrawl in `calls` and returns a list with a
+    (result, exception) tuple for each of them.
+    """
+    results = []
+    for call in calls:
+        try:
+            result = call.function(*call.args)
+            if isinstance(result, types.GeneratorType):
+                result = list(result)
+            results.append((result, None))
+        except Exception as exc:
+            results.append((None, exc))
+    return results
+
+
+def _dumps(obj):
+    """
+    Pickles `obj` to be sent to another process. ForkingPickler can pickle
+    bound methods (like the plugin methods used as namespace functions) as
+    long as their objects can be pickled.
+    """
+    buf = StringIO()
+    try:
+        ForkingPickler(buf, pickle.HIGHEST_PROTOCOL).dump(obj)
+    except TypeError as exc:
+        raise pickle.PicklingError(str(exc))
+    return buf.getvalue()
+
+
+class NamespaceWorker(object):
+    """
+    A long-lived process attached to the namespaces of `pid` that serves
+    lists of NamespaceCrawl's sent over a pipe. Attaching (opening the
+    /proc/<pid>/ns/* files and calling setns) and forking is only done once
+    when the worker is started, so every request after that is just a round
+    trip over the pipe.
+
+    If attached to the pid namespace, the worker is made of two processes:
+    the one attached to the namespaces, and a child of it that actually
+    serves the requests, as that is the only way of being inside the
+    container pid namespace.
+    """
+
+    def __init__(self, pid, namespaces, timeout=None):
+        if timeout is None:
+            timeout = IN_PROCESS_TIMEOUT
+        self.pid = pid
+        self.namespaces = namespaces
+        self.pid_namespace = get_pid_namespace(pid)
+
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = _Process(
+            target=_namespace_worker,
+            args=(pid, namespaces, self._conn, child_conn))
+        # daemon, so we do not wait for workers when the crawler exits
+        self._process.daemon = True
+        self._process.start()
+        child_conn.close()
+
+        # The worker tells us if it managed to attach to the namespaces,
+        # and the pid of the process serving the requests.
+        self._server_pid = None
+        try:
+            self._server_pid = self._receive(timeout)
+        except Exception:
+            self.stop()
+            raise
+
+    def is_alive(self):
+        """
+        Returns False if the worker died, or if the process whose namespaces
+        we are attached to is gone (or its pid was reused by another
+        process).
+        """
+        return (self._process.is_alive() and
+                self.pid_namespace is not None and
+                get_pid_namespace(self.pid) == self.pid_namespace)
+
+    def run(self, calls, timeout=None):
+        """
+        Runs `calls` inside the worker.
+
+        :param calls: list of NamespaceCrawl's.
+        :param timeout: seconds to wait for the results. Defaults to
+        IN_PROCESS_TIMEOUT per call. The worker is stopped on timeout as it
+        is most probably stuck.
+        :return: a list of (result, exception) tuples, one for each call.
+        """
+        if timeout is None:
+            timeout = IN_PROCESS_TIMEOUT * len(calls)
+        request = _dumps(calls)
+        try:
+            self._conn.send_bytes(request)
+            return self._receive(timeout)
+        except (IOError, EOFError) as exc:
+            self.stop()
+            raise CrawlError('Namespace worker for pid %s died: %s' %
+                             (self.pid, exc))
+        except CrawlTimeoutError:
+            self.stop()
+            raise
+
+    def _receive(self, timeout):
+        if not self._conn.poll(timeout):
+            raise CrawlTimeoutError('Timed out waiting for the namespace '
+                                    'worker for pid %s.' % self.pid)
+        (result, exc) = self._conn.recv()
+        if exc is not None:
+            raise exc
+        return result
+
+    def stop(self):
+        self._conn.close()
+        # The serving process should die with its parent (PR_SET_PDEATHSIG),
+        # but kill it anyway just in case.
+        for pid in (self._server_pid, self._process.pid):
+            try:
+                if pid:
+                    os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        self._process.join()
+
+
+class NamespaceWorkersPool(object):
+    """
+    Keeps a NamespaceWorker for every (pid, namespaces) we crawl, so a
+    container is attached to only once during its lifetime instead of once
+    per crawl. Workers of containers that are gone are stopped by reap().
+    """
+
+    def __init__(self):
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def run(self, pid, calls):
+        """
+        Same as run_as_another_namespace_batch, but runs `calls` in the
+        workers attached to the namespaces of `pid`, starting them if
+        needed.
+        """
+        return _run_grouped_calls(
+            calls, lambda namespaces, group: self._run_group(
+                pid, namespaces, group))
+
+    def _run_group(self, pid, namespaces, calls):
+        key = (pid, tuple(namespaces))
+        try:
+            worker = self._get_worker(key)
+            return worker.run(calls)
+        except pickle.PicklingError:
+            # Some function or argument can not be sent to the worker
+            return run_as_another_namespace_batch(pid, calls)
+        except Exception as exc:
+            return [(None, exc)] * len(calls)
+
+    def _get_worker(self, key):
+        with self._lock:
+            worker = self._workers.pop(key, None)
+        if worker is not None and not worker.is_alive():
+            worker.stop()
+            worker = None
+        if worker is None:
+            (pid, namespaces) = key
+            worker = NamespaceWorker(pid, list(namespaces))
+        with self._lock:
+            self._workers[key] = worker
+        return worker
+
+    def reap(self):
+        """
+        Stops the workers whose containers are gone.
+        """
+        with self._lock:
+            dead = [key for (key, worker) in self._workers.iteritems()
+                    if not worker.is_alive()]
+            dead_workers = [self._workers.pop(key) for key in dead]
+        for worker in dead_workers:
+            worker.stop()
+
+    def stop(self):
+        with self._lock:
+            workers = self._workers.values()
+            self._workers = {}
+        for worker in workers:
+            worker.stop()
+
+
+def _namespace_worker(pid, namespaces, parent_conn, conn):
+    """
+    Main function of a NamespaceWorker process. Attaches to the namespaces
+    of `pid` and forks the process serving the requests sent over `conn`.
+    """
+    PR_SET_PDEATHSIG = 1
+    get_libc().prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+    parent_conn.close()
+
+    try:
+        context = ProcessContext(pid, namespaces)
+        context.attach()
+    except Exception as exc:
+        conn.send((None, exc))
+        sys.exit(1)
+
+    if 'pid' not in namespaces:
+        conn.send((os.getpid(), None))
+        _serve_namespace_calls(conn)
+        return
+
+    # We need a child to be inside the pid namespace
+    child_pid = os.fork()
+    if child_pid == 0:
+        get_libc().prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+        try:
+            _serve_namespace_calls(conn)
+        finally:
+            os._exit(0)
+    conn.send((child_pid, None))
+    conn.close()
+    os.waitpid(child_pid, 0)
+
+
+def _serve_namespace_calls(conn):
+    while True:
+        try:
+            calls = pickle.loads(conn.recv_bytes())
+        except (IOError, EOFError):
+            # The crawler closed its end of the pipe
+            return
+        try:
+            conn.send((_run_calls(calls), None))
+        except (cPickle.PicklingError, TypeError) as exc:
+            # Connection.send uses cPickle
+            conn.send((None, CrawlError(str(exc))))
+
+
+class ForkServer(object):
+    """
+    A small single-threaded process that forks the children used to run
+    functions in other namespaces, so the crawler does not have to fork
+    itself (and all its threads, caches and buffers) on every call.
+
+    The server is forked once and every request sends it the function to
+    run, plus the write end of a pipe where the child sends its pid and
+    then the (result, exception) tuple.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn, child_conn = multiprocessing.Pipe()
+        # Not a daemon, as daemonic processes can not have children. It is
+        # stopped at exit by stop_fork_server().
+        self._process = _Process(
+            target=_fork_server, args=(self._conn, child_conn))
+        self._process.start()
+        child_conn.close()
+
+    def is_alive(self):
+        return self._process.is_alive()
+
+    def run(self, function, _args=(), _kwargs={}, timeout=None):
+        """
+        Same as run_as_another_process, but the child is forked by the
+        server. Raises pickle.PicklingError if the function or its arguments
+        can not be sent to the server.
+        """
+        if timeout is None:
+            timeout = IN_PROCESS_TIMEOUT
+
+        reader = self.spawn(_send_result, (function, _args, _kwargs))
+        child_pid = None
+        try:
+            # Sent right after the fork, so we can wait for it without a
+            # timeout (we get EOFError if the child dies), and always know
+            # what to kill if the call then times out.
+            child_pid = reader.recv()
+            deadline = time.time() + timeout
+            (result, child_exception) = _recv_before(reader, deadline)
+        except EOFError:
+            raise CrawlError('Unknown crawl error.')
+        except CrawlTimeoutError:
+            _kill_process(child_pid)
+            raise
+        finally:
+            reader.close()
+
+        if result is None:
+            if child_exception:
+                raise child_exception
+            raise CrawlError('Unknown crawl error.')
+        return result
+
+    def spawn(self, target, args=()):
+        """
+        Forks a child calling `target(conn, *args)`, where `conn` is the
+        write end of a pipe. The child first sends its pid through the pipe,
+        before doing anything that could block.
+
+        :return: the read end of the pipe.
+        """
+        request = _dumps((target, args))
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        try:
+            with self._lock:
+                self._conn.send_bytes(request)
+                reduction.send_handle(self._conn, writer.fileno(),
+                                      self._process.pid)
+        except (IOError, OSError) as exc:
+            reader.close()
+            raise CrawlError('The fork server died: %s' % exc)
+        finally:
+            writer.close()
+        return reader
+
+    def stop(self):
+        self._conn.close()
+        self._process.terminate()
+        self._process.join()
+
+
+_fork_server_instance = None
+_fork_server_lock = threading.Lock()
+
+
+def start_fork_server():
+    """
+    Starts the fork server used by run_as_another_namespace,
+    run_as_another_namespace_batch and run_as_another_namespace_stream from
+    now on. It should be started after loading the plugins, as their
+    functions have to be known by the server.
+    """
+    global _fork_server_instance
+    with _fork_server_lock:
+        if _fork_server_instance is None:
+            _fork_server_instance = ForkServer()
+            atexit.register(stop_fork_server)
 
 
-def run_as_another_process(function, _args=(), _kwargs={}):
+def stop_fork_server():
+    global _fork_server_instance
+    with _fork_server_lock:
+        if _fork_server_instance is not None:
+            _fork_server_instance.stop()
+            _fork_server_instance = None
+
+
+def _get_fork_server():
+    """
+    Returns the fork server if it was started, restarting it if it died.
+    """
+    global _fork_server_instance
+    with _fork_server_lock:
+        server = _fork_server_instance
+        if server is not None and not server.is_alive():
+            logger.warning('The fork server died, restarting it.')
+            server.stop()
+            server = _fork_server_instance = ForkServer()
+        return server
+
+
+def _run_in_new_process(function, _args=(), _kwargs={}, timeout=None):
+    server = _get_fork_server()
+    if server is not None:
+        try:
+            return server.run(function, _args, _kwargs, timeout)
+        except pickle.PicklingError:
+            # The function can not be sent to the fork server, so fork
+            # ourselves.
+            pass
+    return run_as_another_process(function, _args, _kwargs, timeout)
+
+
+def _fork_server(parent_conn, conn):
+    PR_SET_PDEATHSIG = 1
+    get_libc().prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+    parent_conn.close()
+    # Let the kernel reap our children
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    while True:
+        try:
+            request = conn.recv_bytes()
+            fd = reduction.recv_handle(conn)
+        except (IOError, EOFError):
+            # The crawler closed its end of the pipe
+            return
+        if os.fork() == 0:
+            conn.close()
+            try:
+                _fork_server_child(request, fd)
+            finally:
+                os._exit(0)
+        os.close(fd)
+
+
+def _fork_server_child(request, fd):
+    # run_as_another_process has to wait for its own children
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    _run_target(_multiprocessing.Connection(fd), _run_request, (request,))
+
+
+def _run_request(conn, request):
+    # unpickled after sending our pid, as it can import modules
+    (target, args) = pickle.loads(request)
+    target(conn, *args)
+
+
+def _run_target(conn, target, args):
+    """
+    Entry point of the processes started by _spawn and ForkServer.spawn.
+    """
+    PR_SET_PDEATHSIG = 1
+    get_libc().prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+    # Our own process group, so _kill_process also kills our children
+    os.setpgid(0, 0)
+    conn.send(os.getpid())
+    target(conn, *args)
+
+
+def _send_result(conn, function, _args, _kwargs):
+    try:
+        result = function(*_args, **_kwargs)
+        if isinstance(result, types.GeneratorType):
+            result = list(result)
+        conn.send((result, None))
+    except Exception as e:
+        conn.send((None, e))
+
+
+def _spawn(target, args=()):
+    """
+    Starts a process calling `target(conn, *args)`, using the fork server
+    if it was started. See ForkServer.spawn.
+
+    :return: a (reader, process) tuple, where `reader` is the read end of
+    the pipe and `process` the multiprocessing.Process to join, if any.
+    """
+    server = _get_fork_server()
+    if server is not None:
+        try:
+            return (server.spawn(target, args), None)
+        except pickle.PicklingError:
+            pass
+
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    process = _Process(target=_run_target, args=(writer, target, args))
+    process.start()
+    writer.close()
+    return (reader, process)
+
+
+def _recv_before(conn, deadline):
+    if not conn.poll(max(0, deadline - time.time())):
+        errmsg = 'Timed out waiting for a crawl process.'
+        logger.error(errmsg)
+        raise CrawlTimeoutError(errmsg)
+    return conn.recv()
+
+
+def _kill_process(pid):
+    """
+    Kills a process started by _spawn or ForkServer.spawn, and its children.
+    """
+    if pid is None:
+        return
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def run_as_another_namespace_stream(
+    pid,
+    namespaces,
+    function,
+    *args,
+    **kwargs
+):
+    """
+    Like run_as_another_namespace, but for functions returning many items
+    (like crawl_files). Instead of sending a list with all the items once
+    the function is done, they are sent in chunks of STREAM_CHUNK_SIZE items
+    as they are generated, and this is a generator that receives them
+    lazily. The process is only started when the first item is requested,
+    and killed if the generator is closed before the end.
+
+    The timeout (IN_PROCESS_TIMEOUT) applies to every chunk, so a large
+    crawl does not time out as long as it makes progress. If it expires,
+    the items received so far are still generated before raising
+    CrawlTimeoutError.
+    """
+    timeout = IN_PROCESS_TIMEOUT
+    (reader, process) = _spawn(_stream_as_another_namespace,
+                               (pid, namespaces, function, args, kwargs))
+    child_pid = None
+    done = False
+    try:
+        # sent right after the fork, see ForkServer.spawn
+        child_pid = reader.recv()
+        while True:
+            (kind, value) = _recv_before(reader, time.time() + timeout)
+            if kind == _STREAM_END:
+                done = True
+                return
+            if kind == _STREAM_ERROR:
+                done = True
+                raise value
+            for item in value:
+                yield item
+    except EOFError:
+        done = True
+        raise CrawlError('Unknown crawl error.')
+    finally:
+        reader.close()
+        if not done:
+            # Timed out, or the generator was closed before the end
+            _kill_process(child_pid)
+        if process is not None:
+            process.join()
+
+
+def _stream_as_another_namespace(conn, pid, namespaces, function, _args,
+                                 _kwargs):
+    try:
+        context = ProcessContext(pid, namespaces)
+        context.attach()
+    except Exception as e:
+        conn.send((_STREAM_ERROR, e))
+        return
+
+    # We need a child to be inside the pid namespace. It writes the stream
+    # directly to `conn`.
+    child_process = _Process(
+        target=_stream_function,
+        args=(conn, function, _args, _kwargs))
+    child_process.start()
+    child_process.join()
+
+
+def _stream_function(conn, function, _args, _kwargs):
+    PR_SET_PDEATHSIG = 1
+    get_libc().prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+    chunk = []
+    try:
+        for item in function(*_args, **_kwargs):
+            chunk.append(item)
+            if len(chunk) == STREAM_CHUNK_SIZE:
+                conn.send((_STREAM_CHUNK, chunk))
+                chunk = []
+    except Exception as e:
+        # Send what we have so far before the error
+        if chunk:
+            conn.send((_STREAM_CHUNK, chunk))
+        conn.send((_STREAM_ERROR, e))
+        return
+    if chunk:
+        conn.send((_STREAM_CHUNK, chunk))
+    conn.send((_STREAM_END, None))
+
+
+def run_as_another_process(function, _args=(), _kwargs={}, timeout=None):
+    if timeout is None:
+        timeout = IN_PROCESS_TIMEOUT
+
     try:
         queue = multiprocessing.Queue(2 ** 15)
     except OSError:
         # try again with a smaller queue
         queue = multiprocessing.Queue(2 ** 14)
 
-    child_process = multiprocessing.Process(
+    child_process = _Process(
         target=_function_wrapper,
         args=(queue, function),
         kwargs={'_args': _args, '_kwargs': _kwargs})
@@ -114,13 +788,13 @@ def run_as_another_process(function, _args=(), _kwargs={}):
 
     child_exception, result = None, None
     try:
-        (result, child_exception) = queue.get(timeout=IN_PROCESS_TIMEOUT)
+        (result, child_exception) = queue.get(timeout=timeout)
     except Queue.Empty:
         child_exception = CrawlTimeoutError()
     except Exception as exc:
         logger.warn(exc)
 
-    child_process.join(IN_PROCESS_TIMEOUT)
+    child_process.join(timeout)
 
     # The join failed and the process might still be alive
 
@@ -188,31 +862,26 @@ def _run_as_another_namespace(
         namespaces,
         function,
         _args=(),
-        _kwargs={}
+        _kwargs={},
+        timeout=None
 ):
 
     # os.closerange(1, 1000)
     context = ProcessContext(pid, namespaces)
     context.attach()
     try:
-        return run_as_another_process(function, _args, _kwargs)
+        if 'pid' in namespaces:
+            # Only the children of a process enter the pid namespace it
+            # attached to, so this one takes a second fork.
+            return run_as_another_process(function, _args, _kwargs, timeout)
+        result = function(*_args, **_kwargs)
+        if isinstance(result, types.GeneratorType):
+            result = list(result)
+        return result
     finally:
         context.detach()
 
 
-def hack_to_pre_load_modules():
-    queue = multiprocessing.Queue()
-
-    def foo(queue):
-        queue.put('dummy')
-        pass
-
-    p = multiprocessing.Process(target=foo, args=(queue, ))
-    p.start()
-    queue.get()
-    p.join()
-
-
 def open_process_namespaces(pid, namespace_fd, namespaces):
     for ct_ns in namespaces:
         ns_path = os.path.join('/proc', pid, 'ns', ct_ns)
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import logging
+import os
+
+from utils import procfs
+from utils.cgroup_utils import get_cgroup_container_id
+from utils.dockerutils import exec_dockerinspect
+from utils.misc import LRUCache
+
+logger = logging.getLogger('crawlutils')
+
+# Max number of processes whose container we remember
+DEFAULT_MAX_PIDS = 10000
+
+# Max number of containers whose docker inspect we remember
+DEFAULT_MAX_CONTAINERS = 1000
+
+POD_NAMESPACE_LABEL = 'io.kubernetes.pod.namespace'
+POD_NAME_LABEL = 'io.kubernetes.pod.name'
+
+_NOT_CACHED = object()
+
+
+class PidResolver(object):
+
+    """
+    Finds the container a host process runs in from its cgroups, for the
+    host plugins to tag processes and sockets with their container.
+
+    The container of every process is cached by (pid, start time), so a
+    reused pid is looked up again. The docker inspect of the containers
+    (with the kubernetes pod labels) is cached by container ID, and so is
+    a failed one, as container IDs are not reused.
+    """
+
+    def __init__(self, max_pids=DEFAULT_MAX_PIDS,
+                 max_containers=DEFAULT_MAX_CONTAINERS,
+                 proc_dir=procfs.PROC_DIR):
+        self.proc_dir = proc_dir
+        self._container_ids = LRUCache(max_pids)
+        self._inspects = LRUCache(max_containers)
+
+    def get_container_id(self, pid):
+        """
+        Returns the ID of the container process `pid` runs in, or None if
+        it is in none (or gone).
+        """
+        start_time = procfs.read_start_time(pid, self.proc_dir)
+        if start_time is None:
+            return None
+        long_id = self._container_ids.get((pid, start_time), _NOT_CACHED)
+        if long_id is _NOT_CACHED:
+            long_id = self._read_container_id(pid)
+            self._container_ids.put((pid, start_time), long_id)
+        return long_id
+
+    def _read_container_id(self, pid):
+        try:
+            with open(os.path.join(self.proc_dir, str(pid), 'cgroup')) as f:
+                return get_cgroup_container_id(f.read())
+        except IOError:
+            return None
+
+    def get_container_inspect(self, long_id):
+        """
+        Returns the docker inspect of container `long_id`, or None if we
+        can not get it (like for a container that is gone).
+        """
+        inspect = self._inspects.get(long_id, _NOT_CACHED)
+        if inspect is _NOT_CACHED:
+            try:
+                inspect = exec_dockerinspect(long_id)
+            except Exception as exc:
+                logger.debug('Can not inspect container %s: %s'
+                             % (long_id, exc))
+                inspect = None
+            self._inspects.put(long_id, inspect)
+        return inspect
+
+    def get_pod_labels(self, long_id):
+        """
+        Returns the labels of container `long_id`, including the kubernetes
+        pod ones (POD_NAMESPACE_LABEL, POD_NAME_LABEL), or an empty
+        dictionary if we can not inspect it.
+        """
+        inspect = self.get_container_inspect(long_id)
+        if inspect is None:
+            return {}
+        return inspect['Config'].get('Labels') or {}
+
+
+_resolver = PidResolver()
+
+
+def get_container_id(pid):
+    """
+    Returns the ID of the container host process `pid` runs in, or None.
+    """
+    return _resolver.get_container_id(pid)
+
+
+def get_container_inspect(long_id):
+    return _resolver.get_container_inspect(long_id)
+
+
+def get_pod_labels(long_id):
+    return _resolver.get_pod_labels(long_id)
+
+
+def tag_containers(features, feature_class):
+    """
+    Returns `features` (of host processes or sockets, with a `pid` field)
+    as `feature_class` ones, with the ID of the container of the process
+    and the namespace and name of its kubernetes pod (or None) as the last
+    fields.
+    """
+    for (feature_key, feature, feature_type) in features:
+        long_id = get_container_id(feature.pid)
+        labels = get_pod_labels(long_id) if long_id else {}
+        yield (feature_key,
+               feature_class(*(feature + (long_id,
+                                          labels.get(POD_NAMESPACE_LABEL),
+                                          labels.get(POD_NAME_LABEL)))),
+               feature_type)
@@ -0,0 +1,495 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import base64
+import errno
+import logging
+import os
+import pwd
+import socket
+import stat
+import struct
+import sys
+from collections import namedtuple
+
+import psutil
+
+logger = logging.getLogger('crawlutils')
+
+PROC_DIR = '/proc'
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# Same values psutil returns for Process.status()
+PROC_STATUSES = {
+    'R': psutil.STATUS_RUNNING,
+    'S': psutil.STATUS_SLEEPING,
+    'D': psutil.STATUS_DISK_SLEEP,
+    'T': psutil.STATUS_STOPPED,
+    't': psutil.STATUS_TRACING_STOP,
+    'Z': psutil.STATUS_ZOMBIE,
+    'X': psutil.STATUS_DEAD,
+    'x': psutil.STATUS_DEAD,
+    'K': 'wake-kill',
+    'W': psutil.STATUS_WAKING,
+    'I': psutil.STATUS_IDLE,
+}
+
+# Same values psutil returns for the connections status
+TCP_STATUSES = {
+    '01': psutil.CONN_ESTABLISHED,
+    '02': psutil.CONN_SYN_SENT,
+    '03': psutil.CONN_SYN_RECV,
+    '04': psutil.CONN_FIN_WAIT1,
+    '05': psutil.CONN_FIN_WAIT2,
+    '06': psutil.CONN_TIME_WAIT,
+    '07': psutil.CONN_CLOSE,
+    '08': psutil.CONN_CLOSE_WAIT,
+    '09': psutil.CONN_LAST_ACK,
+    '0A': psutil.CONN_LISTEN,
+    '0B': psutil.CONN_CLOSING,
+}
+
+# /proc/net files read for the inet connections, like psutil's kind='inet'
+INET_SOCKET_FILES = [
+    ('tcp', socket.AF_INET, socket.SOCK_STREAM),
+    ('tcp6', socket.AF_INET6, socket.SOCK_STREAM),
+    ('udp', socket.AF_INET, socket.SOCK_DGRAM),
+    ('udp6', socket.AF_INET6, socket.SOCK_DGRAM),
+]
+
+# Everything we need of a process, read from a few /proc/<pid> files.
+# Fields we were not asked for are None: cwd, open_files and sockets (the
+# inodes of its sockets) with fds=True, read_bytes and write_bytes with
+# io=True, and pid_namespace (its inode) with namespaces=True. host_pid is
+# the pid in `proc_dir`, and pid the same one or, with namespaces=True, the
+# pid as seen inside the pid namespace of the process (None on kernels older
+# than 4.1, without NSpid). With namespaces=True, username is the uid, as
+# the process may have another /etc/passwd than ours (see `read_passwd`).
+ProcessRecord = namedtuple('ProcessRecord', [
+    'pid', 'ppid', 'name', 'cmdline', 'status', 'create_time',
+    'num_threads', 'username', 'cpu_time', 'rss', 'vms', 'read_bytes',
+    'write_bytes', 'cwd', 'open_files', 'sockets', 'host_pid',
+    'pid_namespace'])
+
+# Same fields as the psutil connections
+Connection = namedtuple('Connection', 'fd family type laddr raddr status')
+
+# Same fields as the psutil net_io_counters, for the ones we use
+NetIOCounters = namedtuple('NetIOCounters', [
+    'bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv', 'errout',
+    'errin'])
+
+_enabled = False
+
+# Boot time per proc dir, as it never changes
+_boot_times = {}
+
+# Whether we already warned that the kernel does not tell the pids of the
+# processes in their own namespaces
+_warned_no_nspid = False
+
+# Errors meaning the process is gone (or we can not see it)
+_GONE_ERRNOS = (errno.ENOENT, errno.ESRCH)
+
+
+def enable_procfs(enabled=True):
+    """
+    Makes the process, metric and connection features read /proc directly
+    instead of going through psutil.
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def use_procfs(proc_dir=PROC_DIR):
+    """
+    Returns True if the procfs reader is enabled and /proc is mounted, as
+    it may not be in the mount namespace of a container.
+    """
+    return _enabled and os.path.isfile(os.path.join(proc_dir, 'self', 'stat'))
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def get_boot_time(proc_dir=PROC_DIR):
+    if proc_dir in _boot_times:
+        return _boot_times[proc_dir]
+    for line in _read(os.path.join(proc_dir, 'stat')).splitlines():
+        if line.startswith('btime'):
+            _boot_times[proc_dir] = float(line.split()[1])
+            return _boot_times[proc_dir]
+    raise RuntimeError("line 'btime' not found")
+
+
+def get_mem_total(proc_dir=PROC_DIR):
+    """
+    Returns the total memory in bytes.
+    """
+    for line in _read(os.path.join(proc_dir, 'meminfo')).splitlines():
+        if line.startswith('MemTotal:'):
+            return int(line.split()[1]) * 1024
+    raise RuntimeError("line 'MemTotal' not found")
+
+
+def _parse_stat(data, boot_time):
+    name = data[data.find('(') + 1:data.rfind(')')]
+    # the fields after "pid (name) "
+    values = data[data.rfind(')') + 2:].split(' ')
+    return {
+        'name': name,
+        'status': PROC_STATUSES.get(values[0], '?'),
+        'ppid': int(values[1]),
+        'cpu_time': (float(values[11]) + float(values[12])) / CLOCK_TICKS,
+        'num_threads': int(values[17]),
+        'create_time': float(values[19]) / CLOCK_TICKS + boot_time,
+        'vms': int(values[20]),
+        'rss': int(values[21]) * PAGE_SIZE,
+    }
+
+
+def _parse_status(status):
+    """
+    Returns the real uid of a process, and its pid in its own pid namespace
+    (the last one in NSpid, or None if the kernel does not tell).
+    """
+    (uid, ns_pid) = (None, None)
+    for line in status.splitlines():
+        if line.startswith('Uid:'):
+            uid = int(line.split()[1])
+        elif line.startswith('NSpid:'):
+            ns_pid = int(line.split()[-1])
+    return (uid, ns_pid)
+
+
+def read_passwd(passwd):
+    """
+    Returns the dictionary of uid to username of the `passwd` file object.
+    """
+    usernames = {}
+    for line in passwd:
+        fields = line.split(':')
+        if len(fields) > 2 and fields[2].isdigit():
+            usernames.setdefault(int(fields[2]), fields[0])
+    return usernames
+
+
+def _get_username(uid, usernames):
+    if uid not in usernames:
+        try:
+            usernames[uid] = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            usernames[uid] = str(uid)
+    return usernames[uid]
+
+
+def _warn_no_nspid():
+    global _warned_no_nspid
+    if not _warned_no_nspid:
+        logger.warning('No NSpid in /proc/<pid>/status (Linux < 4.1): the '
+                       'pids of the processes in their own pid namespace '
+                       'are unknown')
+        _warned_no_nspid = True
+
+
+def _get_name(name, cmdline):
+    # Like psutil: the name is truncated to 15 characters, so we take the
+    # longer name in the cmdline if it starts the same way.
+    if len(name) >= 15 and cmdline:
+        extended_name = os.path.basename(cmdline[0])
+        if extended_name.startswith(name):
+            return extended_name
+    return name
+
+
+def _read_io(pid_dir):
+    """
+    Returns the (read_bytes, write_bytes) of a process, or (0, 0) if we
+    are not allowed to read them.
+    """
+    counters = {}
+    try:
+        for line in _read(os.path.join(pid_dir, 'io')).splitlines():
+            (name, _, value) = line.partition(': ')
+            counters[name] = int(value)
+    except IOError as exc:
+        if exc.errno in _GONE_ERRNOS:
+            raise
+    return (counters.get('read_bytes', 0), counters.get('write_bytes', 0))
+
+
+def _read_fds(pid_dir):
+    """
+    Returns the sorted paths of the regular files open by a process (the
+    same psutil's open_files returns), and the set of its socket inodes.
+
+    Every path is stat'ed once, however many fds have it open.
+    """
+    fd_dir = os.path.join(pid_dir, 'fd')
+    files = []
+    sockets = set()
+    try:
+        fds = os.listdir(fd_dir)
+    except OSError as exc:
+        if exc.errno in _GONE_ERRNOS:
+            raise
+        return ([], sockets)
+    for fd in fds:
+        fd_path = os.path.join(fd_dir, fd)
+        try:
+            path = os.readlink(fd_path)
+        except OSError:
+            # closed in the meantime
+            continue
+        if path.startswith('socket:['):
+            sockets.add(int(path[8:-1]))
+        elif path.startswith('/'):
+            files.append((path, fd_path))
+    # any of the fds of a path will do
+    regular_files = dict((path, _is_regular_file(fd_path))
+                         for (path, fd_path) in dict(files).iteritems())
+    open_files = sorted(path for (path, _) in files if regular_files[path])
+    return (open_files, sockets)
+
+
+def _is_regular_file(fd_path):
+    # Stats the open file itself, as `path` may be in the mount namespace
+    # of a container.
+    try:
+        return stat.S_ISREG(os.stat(fd_path).st_mode)
+    except OSError:
+        return False
+
+
+def _read_cwd(pid_dir):
+    try:
+        return os.readlink(os.path.join(pid_dir, 'cwd'))
+    except OSError as exc:
+        if exc.errno in _GONE_ERRNOS:
+            raise
+        return 'unknown'
+
+
+def _read_process(pid_dir, pid, boot_time, usernames, io, fds, namespaces):
+    record = _parse_stat(_read(os.path.join(pid_dir, 'stat')), boot_time)
+    cmdline = _read(os.path.join(pid_dir, 'cmdline'))
+    if cmdline.endswith('\x00'):
+        cmdline = cmdline[:-1]
+    cmdline = cmdline.split('\x00') if cmdline else []
+    (uid, ns_pid) = _parse_status(_read(os.path.join(pid_dir, 'status')))
+    record.update({
+        'pid': pid,
+        'host_pid': pid,
+        'pid_namespace': None,
+        'name': _get_name(record['name'], cmdline),
+        'cmdline': cmdline,
+        'username': str(uid) if namespaces else _get_username(uid, usernames),
+        'read_bytes': None,
+        'write_bytes': None,
+        'cwd': None,
+        'open_files': None,
+        'sockets': None,
+    })
+    if namespaces:
+        record['pid'] = ns_pid
+        if ns_pid is None:
+            _warn_no_nspid()
+        record['pid_namespace'] = os.stat(
+            os.path.join(pid_dir, 'ns', 'pid')).st_ino
+    if io:
+        (record['read_bytes'], record['write_bytes']) = _read_io(pid_dir)
+    if fds:
+        if record['status'] == psutil.STATUS_ZOMBIE:
+            record['cwd'] = 'unknown'
+            (record['open_files'], record['sockets']) = ([], set())
+        else:
+            record['cwd'] = _read_cwd(pid_dir)
+            (record['open_files'], record['sockets']) = _read_fds(pid_dir)
+    return ProcessRecord(**record)
+
+
+def read_processes(io=False, fds=False, namespaces=False,
+                   proc_dir=PROC_DIR):
+    """
+    Reads all the processes in `proc_dir` in one pass, and yields a
+    ProcessRecord for each of them. Processes that exit while being read
+    are skipped.
+
+    :param io: also read the io counters of the processes.
+    :param fds: also read their cwd, open files and sockets.
+    :param namespaces: also read their pid namespace, and their pid in it.
+    """
+    usernames = {}
+    for entry in os.listdir(proc_dir):
+        if not entry.isdigit():
+            continue
+        record = read_process(int(entry), io, fds, namespaces, proc_dir,
+                              usernames)
+        if record is not None:
+            yield record
+
+
+def read_process(pid, io=False, fds=False, namespaces=False,
+                 proc_dir=PROC_DIR, usernames=None):
+    """
+    Reads process `pid` like `read_processes`, or returns None if it is gone.
+
+    :param usernames: dictionary of uid to username, to reuse between calls.
+    """
+    if usernames is None:
+        usernames = {}
+    try:
+        return _read_process(os.path.join(proc_dir, str(pid)), pid,
+                             get_boot_time(proc_dir), usernames, io, fds,
+                             namespaces)
+    except (IOError, OSError) as exc:
+        if exc.errno not in _GONE_ERRNOS:
+            logger.debug('Error reading process %s: %s' % (pid, exc))
+        return None
+
+
+def read_open_files(pid, proc_dir=PROC_DIR):
+    """
+    Returns the sorted paths of the regular files open by process `pid`,
+    one per fd like psutil's open_files, or None if it is gone.
+    """
+    try:
+        return _read_fds(os.path.join(proc_dir, str(pid)))[0]
+    except OSError:
+        return None
+
+
+def read_maps(pid, proc_dir=PROC_DIR):
+    """
+    Returns the paths of the files mapped by process `pid`, one per mapping,
+    or None if it is gone.
+
+    Unlike psutil's memory_maps, this only reads /proc/<pid>/maps and not
+    the per mapping memory counters of /proc/<pid>/smaps.
+    """
+    try:
+        data = _read(os.path.join(proc_dir, str(pid), 'maps'))
+    except IOError:
+        return None
+    paths = []
+    for line in data.splitlines():
+        # address perms offset dev inode path, where path may have spaces
+        fields = line.split(None, 5)
+        if len(fields) == 6 and fields[5].startswith('/'):
+            paths.append(fields[5])
+    return paths
+
+
+def read_cpu_time(pid, proc_dir=PROC_DIR):
+    """
+    Returns the cpu seconds (user and system) used by process `pid`, or
+    None if it is gone.
+    """
+    try:
+        data = _read(os.path.join(proc_dir, str(pid), 'stat'))
+    except IOError:
+        return None
+    values = data[data.rfind(')') + 2:].split(' ')
+    return (float(values[11]) + float(values[12])) / CLOCK_TICKS
+
+
+def read_start_time(pid, proc_dir=PROC_DIR):
+    """
+    Returns the start time of process `pid` in clock ticks since boot, or
+    None if it is gone. With the pid, it identifies the process even if the
+    pid is reused.
+    """
+    try:
+        data = _read(os.path.join(proc_dir, str(pid), 'stat'))
+    except IOError:
+        return None
+    return int(data[data.rfind(')') + 2:].split(' ')[19])
+
+
+def read_socket_pids(proc_dir=PROC_DIR):
+    """
+    Returns a dictionary of socket inode to the list of pids with the
+    socket open, for all the processes in `proc_dir`.
+    """
+    socket_pids = {}
+    for entry in os.listdir(proc_dir):
+        if not entry.isdigit():
+            continue
+        fd_dir = os.path.join(proc_dir, entry, 'fd')
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        pid = int(entry)
+        for fd in fds:
+            try:
+                path = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if path.startswith('socket:['):
+                pids = socket_pids.setdefault(int(path[8:-1]), [])
+                if not pids or pids[-1] != pid:
+                    pids.append(pid)
+    return socket_pids
+
+
+def read_net_dev(proc_dir=PROC_DIR):
+    """
+    Returns a dictionary of interface name to its NetIOCounters, for the
+    network namespace of `proc_dir` (like /proc/<pid> for the one of
+    process `pid`).
+    """
+    counters = {}
+    lines = _read(os.path.join(proc_dir, 'net', 'dev')).splitlines()
+    for line in lines[2:]:
+        (name, _, values) = line.partition(':')
+        values = [int(value) for value in values.split()]
+        counters[name.strip()] = NetIOCounters(
+            bytes_sent=values[8],
+            bytes_recv=values[0],
+            packets_sent=values[9],
+            packets_recv=values[1],
+            errout=values[10],
+            errin=values[2])
+    return counters
+
+
+def _decode_address(addr, family):
+    (ip, port) = addr.split(':')
+    ip = base64.b16decode(ip)
+    if family == socket.AF_INET:
+        if sys.byteorder == 'little':
+            ip = ip[::-1]
+    elif sys.byteorder == 'little':
+        ip = struct.pack('>4I', *struct.unpack('<4I', ip))
+    return (socket.inet_ntop(family, ip), int(port, 16))
+
+
+def read_connections(proc_dir=PROC_DIR):
+    """
+    Returns a dictionary of socket inode to the Connection for every inet
+    socket in the network namespace of `proc_dir`.
+    """
+    connections = {}
+    for (name, family, _type) in INET_SOCKET_FILES:
+        try:
+            lines = _read(os.path.join(proc_dir, 'net', name)).splitlines()
+        except IOError:
+            # no ipv6
+            continue
+        for line in lines[1:]:
+            values = line.split()
+            (laddr, raddr, status, inode) = (values[1], values[2],
+                                             values[3], int(values[9]))
+            raddr = _decode_address(raddr, family)
+            if _type == socket.SOCK_STREAM:
+                status = TCP_STATUSES.get(status, psutil.CONN_NONE)
+            else:
+                status = psutil.CONN_NONE
+            connections[inode] = Connection(
+                -1, family, _type, _decode_address(laddr, family),
+                raddr if raddr[1] else (), status)
+    return connections
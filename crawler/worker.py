@@ -1,5 +1,7 @@
 import time
 
+from utils import file_index, host_snapshot
+
 
 class Worker:
 
@@ -31,24 +33,52 @@ class Worker:
         :return: None
         """
 
+        # The file indexes of the incremental crawls are saved once all the
+        # frames are delivered, so undelivered changes are crawled again.
+        file_index.defer_saves()
+        try:
+            delivered = self._iterate(timeout)
+        except:
+            file_index.discard_deferred()
+            raise
+        if delivered:
+            file_index.save_deferred()
+        else:
+            file_index.discard_deferred()
+
+    def _emit(self, frame):
+        """Returns False if an emitter could not deliver `frame`."""
+        if self.emitters is None:
+            return True
+        return self.emitters.emit(frame,
+                                  snapshot_num=self.iter_count) is not False
+
+    def _iterate(self, timeout):
+        """Returns False if some frame could not be delivered."""
+        delivered = True
         # Start by polling new systems created within `timeout` seconds
         end_time = time.time() + timeout
         while timeout > 0:
             # If polling is not implemented, this is a sleep(timeout)
             frame = self.crawler.polling_crawl(timeout)
-            if frame and self.emitters:
-                self.emitters.emit(frame, snapshot_num=self.iter_count)
+            if frame:
+                delivered = self._emit(frame) and delivered
             timeout = end_time - time.time()
             # just used for output purposes
             self.iter_count += 1
 
-        # Crawl all systems now
-        for frame in self.crawler.crawl():
-            if self.emitters is not None:
-                self.emitters.emit(frame, snapshot_num=self.iter_count)
+        # Crawl all systems now, with the host values shared by the plugins
+        # read right before
+        host_snapshot.take_snapshot()
+        try:
+            for frame in self.crawler.crawl():
+                delivered = self._emit(frame) and delivered
+        finally:
+            host_snapshot.clear_snapshot()
 
         # just used for output purposes
         self.iter_count += 1
+        return delivered
 
     def _get_next_iteration_time(self, snapshot_time):
         """
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import utils.cgroup_utils
+from utils.cgroup_utils import CgroupIndex, get_cgroup_container_id
+from utils.crawler_exceptions import ContainerWithoutCgroups
+
+DOCKER_ID = 'a' * 64
+K8S_ID = 'b' * 64
+SYSTEMD_ID = 'c' * 64
+NEW_K8S_ID = 'd' * 64
+
+
+class CgroupIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.mount = tempfile.mkdtemp()
+        self._mkdir('docker', DOCKER_ID)
+        self._mkdir('kubepods', 'burstable', 'pod1234', K8S_ID)
+        self._mkdir('kubepods.slice', 'kubepods-pod5678.slice',
+                    'docker-%s.scope' % SYSTEMD_ID)
+        self.index = CgroupIndex()
+        self.index._mounts[('cpuacct',)] = self.mount
+
+    def tearDown(self):
+        shutil.rmtree(self.mount)
+
+    def _mkdir(self, *dirs):
+        path = os.path.join(self.mount, *dirs)
+        os.makedirs(path)
+        return path
+
+    def test_get_container_dir(self):
+        for long_id, path in [
+                (DOCKER_ID, 'docker/' + DOCKER_ID),
+                (K8S_ID, 'kubepods/burstable/pod1234/' + K8S_ID),
+                (SYSTEMD_ID, 'kubepods.slice/kubepods-pod5678.slice/'
+                             'docker-%s.scope' % SYSTEMD_ID)]:
+            assert self.index.get_container_dir(
+                ['cpuacct'], long_id) == os.path.join(self.mount, path)
+
+    @mock.patch('utils.cgroup_utils._scan_container_cgroups',
+                wraps=utils.cgroup_utils._scan_container_cgroups)
+    def test_get_container_dir_scans_once(self, mock_scan):
+        for _ in range(3):
+            self.index.get_container_dir(['cpuacct'], K8S_ID)
+            self.index.get_container_dir(['cpuacct'], SYSTEMD_ID)
+        assert mock_scan.call_count == 1
+
+        # plain docker containers do not need a scan
+        new_id = 'e' * 64
+        self._mkdir('docker', new_id)
+        self.index.get_container_dir(['cpuacct'], new_id)
+        assert mock_scan.call_count == 1
+
+    @mock.patch('utils.cgroup_utils.time.time', side_effect=[100, 100.5, 102])
+    def test_get_container_dir_new_pod(self, *args):
+        self.index.get_container_dir(['cpuacct'], K8S_ID)
+        path = self._mkdir('kubepods', 'pod9', NEW_K8S_ID)
+        # too soon to scan again
+        with self.assertRaises(ContainerWithoutCgroups):
+            self.index.get_container_dir(['cpuacct'], NEW_K8S_ID)
+        assert self.index.get_container_dir(['cpuacct'], NEW_K8S_ID) == path
+
+    def test_forget(self):
+        self.index.get_container_dir(['cpuacct'], DOCKER_ID)
+        self.index.forget(DOCKER_ID)
+        assert DOCKER_ID not in self.index._dirs[self.mount]
+
+    def test_get_container_dir_without_cgroups(self):
+        with self.assertRaises(ContainerWithoutCgroups):
+            self.index.get_container_dir(['cpuacct'], 'f' * 64)
+
+
+class GetCgroupContainerIdTests(unittest.TestCase):
+
+    def test_get_cgroup_container_id(self):
+        assert get_cgroup_container_id(
+            '12:pids:/docker/%s\n' % DOCKER_ID) == DOCKER_ID
+        assert get_cgroup_container_id(
+            '11:memory:/kubepods.slice/kubepods-pod5678.slice/'
+            'docker-%s.scope\n' % SYSTEMD_ID) == SYSTEMD_ID
+        assert get_cgroup_container_id('0::/%s\n' % K8S_ID) == K8S_ID
+        assert get_cgroup_container_id(
+            '12:pids:/user.slice\n1:name=systemd:/init.scope\n') is None
+
+
+if __name__ == '__main__':
+    unittest.main()
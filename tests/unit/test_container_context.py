@@ -0,0 +1,62 @@
+import mock
+import unittest
+
+from container_context import (ContainerContext, get_container_context,
+                               accepts_context)
+
+
+class ContainerContextTests(unittest.TestCase):
+
+    @mock.patch('utils.dockerutils.get_docker_container_rootfs_path',
+                side_effect=lambda long_id: '/rootfs/' + long_id)
+    @mock.patch('utils.dockerutils.exec_dockerinspect',
+                side_effect=lambda long_id: {'State': {'Pid': 123}})
+    def test_context_lazy(self, mock_inspect, mock_rootfs):
+        context = ContainerContext('abc')
+        assert mock_inspect.call_count == 0
+        assert context.pid == '123'
+        assert context.pid == '123'
+        assert context.rootfs == '/rootfs/abc'
+        assert context.rootfs == '/rootfs/abc'
+        assert mock_inspect.call_count == 1
+        assert mock_rootfs.call_count == 1
+
+    @mock.patch('utils.dockerutils.exec_dockerinspect')
+    def test_context_from_container(self, mock_inspect):
+        container = mock.Mock(long_id='abc', pid='456', root_fs='/a/b',
+                              inspect={'Id': 'abc'})
+        context = ContainerContext.from_container(container)
+        assert context.pid == '456'
+        assert context.rootfs == '/a/b'
+        assert context.inspect == {'Id': 'abc'}
+        assert mock_inspect.call_count == 0
+
+    def test_context_cgroup_path(self):
+        container = mock.Mock(long_id='abc')
+        container.get_cpu_cgroup_path.side_effect = lambda node: '/cg/' + node
+        context = ContainerContext('abc', container=container)
+        assert context.get_cpu_cgroup_path('cpuacct.stat') == \
+            '/cg/cpuacct.stat'
+        assert context.get_cpu_cgroup_path('cpuacct.stat') == \
+            '/cg/cpuacct.stat'
+        assert container.get_cpu_cgroup_path.call_count == 1
+
+    def test_get_container_context(self):
+        context = ContainerContext('abc')
+        assert get_container_context('abc', context) is context
+        assert get_container_context('abc').long_id == 'abc'
+
+    def test_accepts_context(self):
+        def new_crawl(container_id, context=None, **kwargs):
+            pass
+
+        def old_crawl(container_id, **kwargs):
+            pass
+
+        assert accepts_context(new_crawl)
+        assert not accepts_context(old_crawl)
+        assert not accepts_context(mock.Mock())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,10 @@
 import mock
+import time
 import unittest
+from container_context import ContainerContext
 from containers_crawler import ContainersCrawler
+from utils.fs_walker import WalkCrawl, WalkVisitor
+from utils.namespace import NamespaceCrawl
 
 
 class MockedOSCrawler:
@@ -15,6 +19,27 @@ class MockedCPUCrawler:
         return [('cpu-0', {'used': 100}, 'cpu')]
 
 
+class MockedContextCrawler:
+
+    def crawl(self, container_id, context=None, **kwargs):
+        assert isinstance(context, ContainerContext)
+        assert context.long_id == container_id
+        return [('context', {'pid': context.pid}, 'context')]
+
+
+class MockedPreparedCrawler:
+
+    def __init__(self):
+        self.prepared = []
+
+    def prepare_crawl(self, containers, **kwargs):
+        self.prepared = [c.long_id for c in containers]
+
+    def crawl(self, container_id, **kwargs):
+        assert container_id in self.prepared
+        return [('prepared', {'value': 1}, 'prepared')]
+
+
 class MockedOSCrawlerFailure:
 
     def crawl(self, container_id, **kwargs):
@@ -24,6 +49,117 @@ class MockedOSCrawlerFailure:
             return [('linux', {'os': 'some_os'}, 'os')]
 
 
+class MockedSlowCrawler:
+
+    def crawl(self, container_id, **kwargs):
+        # the first containers take longer, so they finish last
+        time.sleep({'aaa': 0.3, 'bbb': 0.2}.get(container_id, 0))
+        return [('linux', {'os': 'some_os'}, 'os')]
+
+
+class MockedNamespaceCrawler:
+
+    def __init__(self, namespaces, value):
+        self.namespaces = namespaces
+        self.value = value
+
+    def get_namespace_crawl(self, container_id, **kwargs):
+        return NamespaceCrawl(self.namespaces, lambda: self.value, ())
+
+    def crawl_from_namespace_result(self, container_id, result, **kwargs):
+        return [('ns', {'value': result}, 'ns')]
+
+    def crawl_from_namespace_error(self, container_id, exc, **kwargs):
+        raise exc
+
+    def crawl(self, container_id, **kwargs):
+        raise AssertionError('should be crawled in the namespace session')
+
+
+class MockedProcessesCrawler:
+
+    def get_namespace_crawl(self, container_id, context=None, **kwargs):
+        if context.processes is not None:
+            return None
+        return NamespaceCrawl(['pid'], lambda: 'in namespace', ())
+
+    def crawl_from_namespace_result(self, container_id, result, **kwargs):
+        return [('procs', {'value': result}, 'procs')]
+
+    def crawl(self, container_id, context=None, **kwargs):
+        return [('procs', {'value': context.processes}, 'procs')]
+
+
+class MockedRootVisitor(WalkVisitor):
+
+    walk = False
+
+    def __init__(self, value):
+        WalkVisitor.__init__(self)
+        self.value = value
+
+    def visit_root(self):
+        return [self.value]
+
+
+class MockedLoggingVisitor(WalkVisitor):
+
+    walk = False
+
+    def __init__(self, value, log, fail=False):
+        WalkVisitor.__init__(self)
+        self.value = value
+        self.log = log
+        self.fail = fail
+
+    def visit_root(self):
+        self.log.append('visit ' + self.value)
+        return [self.value]
+
+    def finish(self):
+        self.log.append('finish ' + self.value)
+        if self.fail:
+            raise OSError()
+        return []
+
+
+class MockedStreamWalkCrawler:
+
+    def __init__(self, visitor):
+        self.visitor = visitor
+
+    def get_walk_visitor(self, container_id, **kwargs):
+        return WalkCrawl(self.visitor, False)
+
+    def crawl_from_walk(self, container_id, features, **kwargs):
+        for feature in features:
+            self.visitor.log.append('read ' + feature)
+            yield ('walk', {'value': feature}, 'walk')
+
+
+class MockedWalkCrawler:
+
+    def __init__(self, avoid_setns, value):
+        self.avoid_setns = avoid_setns
+        self.value = value
+
+    def get_walk_visitor(self, container_id, **kwargs):
+        return WalkCrawl(MockedRootVisitor(self.value), self.avoid_setns)
+
+    def crawl_from_walk(self, container_id, features, **kwargs):
+        return [('walk', {'value': list(features)}, 'walk')]
+
+    def get_namespace_crawl(self, container_id, **kwargs):
+        raise AssertionError('should be crawled in the walk session')
+
+    def crawl(self, container_id, **kwargs):
+        raise AssertionError('should be crawled in the walk session')
+
+
+def mocked_run_as_another_namespace_batch(pid, calls):
+    return [(call.function(*call.args), None) for call in calls]
+
+
 class MockedDockerContainer:
 
     def __init__(self, short_id='short_id', pid=777):
@@ -57,6 +193,11 @@ class MockedDockerContainer:
 
 class ContainersCrawlerTests(unittest.TestCase):
 
+    def _stop_pool(self, crawler):
+        # its threads would otherwise run (and sleep) in the later tests
+        if crawler._pool is not None:
+            crawler._pool.terminate()
+
     @mock.patch(
         'containers_crawler.plugins_manager.get_container_crawl_plugins',
         side_effect=lambda features: [(MockedOSCrawler(), {}),
@@ -134,6 +275,300 @@ class ContainersCrawlerTests(unittest.TestCase):
         assert args[0].call_count == 1
         assert args[1].call_count == 1
 
+    @mock.patch(
+        'containers_crawler.plugins_manager.get_container_crawl_plugins',
+        side_effect=lambda features: [(MockedSlowCrawler(), {}),
+                                      (MockedCPUCrawler(), {})])
+    @mock.patch('containers_crawler.get_containers',
+                side_effect=lambda host_namespace, user_list: [
+                    MockedDockerContainer(
+                        short_id='aaa',
+                        pid=101),
+                    MockedDockerContainer(
+                        short_id='bbb',
+                        pid=102),
+                    MockedDockerContainer(
+                        short_id='ccc',
+                        pid=103)])
+    def test_containers_crawler_pool(self, *args):
+        crawler = ContainersCrawler(features=['os'], numprocesses=3)
+        self.addCleanup(self._stop_pool, crawler)
+        frames = list(crawler.crawl())
+        namespaces = [f.metadata['namespace'] for f in frames]
+        # frames are returned as soon as they are ready
+        assert namespaces == ['ccc', 'bbb', 'aaa']
+        features_count = sorted([f.num_features for f in frames])
+        assert features_count == sorted([2, 2, 2])
+
+    @mock.patch(
+        'containers_crawler.plugins_manager.get_container_crawl_plugins',
+        side_effect=lambda features: [(MockedSlowCrawler(), {}),
+                                      (MockedCPUCrawler(), {})])
+    @mock.patch('containers_crawler.get_containers',
+                side_effect=lambda host_namespace, user_list: [
+                    MockedDockerContainer(
+                        short_id='aaa',
+                        pid=101),
+                    MockedDockerContainer(
+                        short_id='bbb',
+                        pid=102),
+                    MockedDockerContainer(
+                        short_id='ccc',
+                        pid=103)])
+    def test_containers_crawler_pool_ordered(self, *args):
+        crawler = ContainersCrawler(features=['os'], numprocesses=3,
+                                    ordered_frames=True)
+        self.addCleanup(self._stop_pool, crawler)
+        frames = list(crawler.crawl())
+        namespaces = [f.metadata['namespace'] for f in frames]
+        assert namespaces == ['aaa', 'bbb', 'ccc']
+
+    @mock.patch(
+        'containers_crawler.plugins_manager.get_container_crawl_plugins',
+        side_effect=lambda features: [(MockedCPUCrawler(), {})])
+    @mock.patch('containers_crawler.get_containers',
+                side_effect=lambda host_namespace, user_list: [
+                    MockedDockerContainer(
+                        short_id=str(i),
+                        pid=i) for i in range(10)])
+    def test_containers_crawler_pool_max_pending(self, *args):
+        crawler = ContainersCrawler(features=['os'], numprocesses=2,
+                                    max_pending_frames=3)
+        self.addCleanup(self._stop_pool, crawler)
+        submitted = []
+        crawl_container = crawler.crawl_container
+
+        def _crawl_container(container, ignore_plugin_exception):
+            submitted.append(container.short_id)
+            return crawl_container(container, ignore_plugin_exception)
+        crawler.crawl_container = _crawl_container
+
+        frames = crawler.crawl()
+        next(frames)
+        time.sleep(0.2)
+        # no more containers are crawled until the frames are consumed
+        assert len(submitted) == 3
+        assert len(list(frames)) == 9
+        assert len(submitted) == 10
+
+    @mock.patch(
+        'containers_crawler.plugins_manager.get_container_crawl_plugins',
+        side_effect=lambda features: [(MockedOSCrawlerFailure(), {}),
+                                      (MockedCPUCrawler(), {})])
+    @mock.patch('containers_crawler.get_containers',
+                side_effect=lambda host_namespace, user_list: [
+                    MockedDockerContainer(
+                        short_id='aaa',
+                        pid=101),
+                    MockedDockerContainer(
+                        short_id='errorid',
+                        pid=102),
+                    MockedDockerContainer(
+                        short_id='ccc',
+                        pid=103)])
+    def test_failed_containers_crawler_pool(self, *args):
+        crawler = ContainersCrawler(features=['os'], numprocesses=2)
+        self.addCleanup(self._stop_pool, crawler)
+        with self.assertRaises(OSError):
+            list(crawler.crawl(ignore_plugin_exception=False))
+
+        frames = list(crawler.crawl())
+        features_count = sorted([f.num_features for f in frames])
+        assert features_count == sorted([2, 1, 2])
+
+    @mock.patch(
+        'containers_crawler.run_as_another_namespace_batch',
+        side_effect=mocked_run_as_another_namespace_batch)
+    @mock.patch(
+        'containers_crawler.plugins_manager.get_container_crawl_plugins',
+        side_effect=lambda features: [
+            (MockedNamespaceCrawler(['mnt'], 1), {}),
+            (MockedCPUCrawler(), {}),
+            (MockedNamespaceCrawler(['net'], 2), {})])
+    @mock.patch('containers_crawler.get_containers',
+                side_effect=lambda host_namespace, user_list: [
+                    MockedDockerContainer(
+                        short_id='aaa',
+                        pid=101),
+                    MockedDockerContainer(
+                        short_id='bbb',
+                        pid=102)])
+    def test_containers_crawler_namespace_session(self, *args):
+        crawler = ContainersCrawler(features=['os'])
+        frames = list(crawler.crawl(ignore_plugin_exception=False))
+        for frame in frames:
+            assert frame.data == [('ns', {'value': 1}, 'ns'),
+                                  ('cpu-0', {'used': 100}, 'cpu'),
+                                  ('ns', {'value': 2}, 'ns')]
+        # one namespace session per container for both plugins
+        assert args[2].call_count == 2
+        pids = [call[0][0] for call in args[2].call_args_list]
+        assert pids == [101, 102]
+        assert len(args[2].call_args_list[0][0][1]) == 2
+
+    @mock.patch('containers_crawler.NamespaceWorkersPool')
+    @mock.patch(
+        'containers_crawler.run_as_another_namespace_batch',
+        side_effect=mocked_run_as_another_namespace_batch)
+    @mock.patch(
+        'containers_crawler.plugins_manager.get_container_crawl_plugins',
+        side_effect=lambda features: [
+            (MockedNamespaceCrawler(['mnt'], 1), {}),
+            (MockedCPUCrawler(), {})])
+    @mock.patch('containers_crawler.get_containers',
+                side_effect=lambda host_namespace, user_list: [
+                    MockedDockerContainer(
+                        short_id='aaa',
+                        pid=101)])
+    def test_containers_crawler_namespace_workers(self, *args):
+        workers_pool = args[3].return_value
+        workers_pool.run.side_effect = mocked_run_as_another_namespace_batch
+        crawler = ContainersCrawler(features=['os'], namespace_workers=True)
+        for _ in range(2):
+            frames = list(crawler.crawl(ignore_plugin_exception=False))
+            assert frames[0].data == [('ns', {'value': 1}, 'ns'),
+                                      ('cpu-0', {'used': 100}, 'cpu')]
+        assert args[2].call_count == 0
+        assert workers_pool.run.call_count == 2
+        assert workers_pool.reap.call_count == 2
+
+    @mock.patch(
+        'containers_crawler.plugins_manager.get_container_crawl_plugins',
+        side_effect=lambda features: [(MockedContextCrawler(), {}),
+                                      (MockedOSCrawler(), {})])
+    @mock.patch('containers_crawler.get_containers',
+                side_effect=lambda host_namespace, user_list: [
+                    MockedDockerContainer(
+                        short_id='aaa',
+                        pid=101)])
+    def test_containers_crawler_context(self, *args):
+        crawler = ContainersCrawler(features=['os'])
+        frames = list(crawler.crawl(ignore_plugin_exception=False))
+        assert frames[0].data == [('context', {'pid': 101}, 'context'),
+                                  ('linux', {'os': 'some_os'}, 'os')]
+
+    @mock.patch('containers_crawler.forget_container')
+    @mock.patch('containers_crawler.forget_entity')
+    @mock.patch(
+        'containers_crawler.plugins_manager.get_container_crawl_plugins',
+        side_effect=lambda features: [(MockedOSCrawler(), {})])
+    @mock.patch('containers_crawler.get_containers',
+                side_effect=[[MockedDockerContainer(short_id='aaa', pid=101),
+                              MockedDockerContainer(short_id='bbb', pid=102)],
+                             [MockedDockerContainer(short_id='bbb', pid=102)]])
+    def test_containers_crawler_forget_gone_containers(self, *args):
+        crawler = ContainersCrawler(features=['os'])
+        assert len(list(crawler.crawl())) == 2
+        assert args[2].call_count == 0
+        assert len(list(crawler.crawl())) == 1
+        args[2].assert_called_once_with('aaa')
+        args[3].assert_called_once_with('aaa')
+
+    @mock.patch('containers_crawler.get_containers',
+                side_effect=lambda host_namespace, user_list: [
+                    MockedDockerContainer(short_id='aaa', pid=101),
+                    MockedDockerContainer(short_id='bbb', pid=102)])
+    def test_containers_crawler_prepare_crawl(self, *args):
+        plugin = MockedPreparedCrawler()
+        with mock.patch('containers_crawler.plugins_manager.'
+                        'get_container_crawl_plugins',
+                        side_effect=lambda features: [(plugin, {})]):
+            crawler = ContainersCrawler(features=['os'])
+        frames = list(crawler.crawl(ignore_plugin_exception=False))
+        assert plugin.prepared == ['aaa', 'bbb']
+        assert [f.num_features for f in frames] == [1, 1]
+
+    @mock.patch('containers_crawler.scan_host_processes',
+                side_effect=lambda containers, io, fds: {'aaa': ['init']})
+    @mock.patch(
+        'containers_crawler.run_as_another_namespace_batch',
+        side_effect=mocked_run_as_another_namespace_batch)
+    @mock.patch(
+        'containers_crawler.plugins_manager.get_container_crawl_plugins',
+        side_effect=lambda features: [(MockedProcessesCrawler(), {})])
+    @mock.patch('containers_crawler.get_containers',
+                side_effect=lambda host_namespace, user_list: [
+                    MockedDockerContainer(short_id='aaa', pid=101),
+                    MockedDockerContainer(short_id='bbb', pid=102)])
+    def test_containers_crawler_host_process_scan(self, *args):
+        crawler = ContainersCrawler(features=['process'],
+                                    host_process_scan=True)
+        frames = list(crawler.crawl(ignore_plugin_exception=False))
+        assert frames[0].data == [('procs', {'value': ['init']}, 'procs')]
+        # bbb was not found in the scan
+        assert frames[1].data == [('procs', {'value': 'in namespace'},
+                                   'procs')]
+        assert [(call[0][0], len(call[0][1]))
+                for call in args[2].call_args_list] == [(101, 0), (102, 1)]
+        args[3].assert_called_once_with(mock.ANY, io=False, fds=True)
+
+    @mock.patch(
+        'containers_crawler.run_as_another_namespace_stream',
+        side_effect=lambda pid, namespaces, function, *args: function(*args))
+    @mock.patch(
+        'containers_crawler.plugins_manager.get_container_crawl_plugins',
+        side_effect=lambda features: [(MockedWalkCrawler(False, 'a'), {}),
+                                      (MockedWalkCrawler(True, 'b'), {}),
+                                      (MockedWalkCrawler(False, 'c'), {}),
+                                      (MockedOSCrawler(), {})])
+    @mock.patch('containers_crawler.get_containers',
+                side_effect=lambda host_namespace, user_list: [
+                    MockedDockerContainer(short_id='aaa', pid=101)])
+    def test_containers_crawler_shared_walk(self, *args):
+        crawler = ContainersCrawler(features=['file'], shared_walk=True)
+        [frame] = list(crawler.crawl(ignore_plugin_exception=False))
+        assert frame.data == [('walk', {'value': ['a']}, 'walk'),
+                              ('walk', {'value': ['b']}, 'walk'),
+                              ('walk', {'value': ['c']}, 'walk'),
+                              ('linux', {'os': 'some_os'}, 'os')]
+        # one walk inside the container for both a and c
+        assert args[2].call_count == 1
+        assert args[2].call_args[0][:2] == (101, ['mnt'])
+
+    @mock.patch(
+        'containers_crawler.run_as_another_namespace_stream',
+        side_effect=lambda pid, namespaces, function, *args: function(*args))
+    @mock.patch('containers_crawler.get_containers',
+                side_effect=lambda host_namespace, user_list: [
+                    MockedDockerContainer(short_id='aaa', pid=101)])
+    def test_containers_crawler_shared_walk_stream(self, *args):
+        log = []
+        plugins = [(MockedStreamWalkCrawler(MockedLoggingVisitor('a', log)),
+                    {}),
+                   (MockedStreamWalkCrawler(MockedLoggingVisitor('b', log)),
+                    {})]
+        with mock.patch('containers_crawler.plugins_manager.'
+                        'get_container_crawl_plugins',
+                        side_effect=lambda features: plugins):
+            crawler = ContainersCrawler(features=['file'], shared_walk=True)
+            [frame] = list(crawler.crawl(ignore_plugin_exception=False))
+        assert frame.num_features == 2
+        # a read its feature while the walk went on
+        assert log == ['visit a', 'read a', 'visit b', 'finish a',
+                       'finish b', 'read b']
+
+    @mock.patch(
+        'containers_crawler.run_as_another_namespace_stream',
+        side_effect=lambda pid, namespaces, function, *args: function(*args))
+    @mock.patch('containers_crawler.get_containers',
+                side_effect=lambda host_namespace, user_list: [
+                    MockedDockerContainer(short_id='aaa', pid=101)])
+    def test_containers_crawler_shared_walk_failed(self, *args):
+        log = []
+        plugins = [(MockedStreamWalkCrawler(MockedLoggingVisitor('a', log)),
+                    {}),
+                   (MockedStreamWalkCrawler(
+                       MockedLoggingVisitor('b', log, fail=True)), {}),
+                   (MockedOSCrawler(), {})]
+        with mock.patch('containers_crawler.plugins_manager.'
+                        'get_container_crawl_plugins',
+                        side_effect=lambda features: plugins):
+            crawler = ContainersCrawler(features=['file'], shared_walk=True)
+            [frame] = list(crawler.crawl())
+        # both plugins of the walk failed, with none of their features
+        assert frame.data == [('linux', {'os': 'some_os'}, 'os')]
+        assert frame.num_features == 1
+
 
 if __name__ == '__main__':
     unittest.main()
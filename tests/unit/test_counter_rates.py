@@ -0,0 +1,90 @@
+import unittest
+
+from utils.counter_rates import CounterRates, forget_entity
+
+
+class CounterRatesTests(unittest.TestCase):
+
+    def test_rate(self):
+        rates = CounterRates()
+        assert rates.rate('c1', 'eth0', [10, 100], now=100) is None
+        assert rates.rate('c1', 'eth0', [20, 300], now=110) == [1.0, 20.0]
+        assert rates.rate('c1', 'eth0', [40, 300], now=120) == [2.0, 0.0]
+
+    def test_rate_same_time(self):
+        rates = CounterRates()
+        rates.rate('c1', 'eth0', [10], now=100)
+        assert rates.rate('c1', 'eth0', [20], now=100) is None
+        assert rates.rate('c1', 'eth0', [30], now=110) == [2.0]
+
+    def test_rate_wrapped(self):
+        rates = CounterRates()
+        rates.rate('c1', 'eth0', [10, 10], now=100)
+        rates.rate('c1', 'eth0', [20, 30], now=110)
+        # the first counter wrapped: we get its previous rate again
+        assert rates.rate('c1', 'eth0', [5, 40], now=120) == [1.0, 1.0]
+        assert rates.rate('c1', 'eth0', [15, 40], now=130) == [1.0, 0.0]
+
+    def test_rates_bulk(self):
+        rates = CounterRates()
+        assert rates.rates('c1', {'eth0': [1], 'eth1': [2]}, now=100) == {
+            'eth0': None, 'eth1': None}
+        assert rates.rates('c1', {'eth0': [11], 'eth1': [42]}, now=110) == {
+            'eth0': [1.0], 'eth1': [4.0]}
+
+    def test_bulk_rates(self):
+        rates = CounterRates()
+        rates.bulk_rates({'c1': {'eth0': [1]}, 'c2': {'eth0': [2]}}, now=100)
+        assert rates.bulk_rates(
+            {'c1': {'eth0': [11]}, 'c2': {'eth0': [42], 'eth1': [1]}},
+            now=110) == {'c1': {'eth0': [1.0]},
+                         'c2': {'eth0': [4.0], 'eth1': None}}
+
+    def test_rates_forget_missing(self):
+        rates = CounterRates()
+        rates.rates(None, {1: [1], 2: [2]}, now=100)
+        rates.rates(None, {2: [12], 3: [3]}, now=110, forget_missing=True)
+        assert not rates.has_sample(None, 1)
+        assert rates.has_sample(None, 2) and rates.has_sample(None, 3)
+
+    def test_forget(self):
+        rates = CounterRates()
+        other_rates = CounterRates()
+        rates.rates('c1', {'eth0': [1], 'eth1': [2]}, now=100)
+        rates.rate('c2', 'eth0', [1], now=100)
+        other_rates.rate('c1', 'cpu', [1], now=100)
+        forget_entity('c1')
+        assert len(rates) == 1
+        assert len(other_rates) == 0
+        assert rates.rate('c1', 'eth0', [11], now=110) is None
+        assert rates.rate('c2', 'eth0', [11], now=110) == [1.0]
+
+    def test_expire(self):
+        rates = CounterRates(ttl=100)
+        rates._last_expire = 0
+        rates.rate('c1', 'eth0', [1], now=100)
+        rates.rate('c2', 'eth0', [1], now=190)
+        rates.rate('c2', 'eth0', [1], now=250)
+        assert len(rates) == 1
+
+    def test_expire_keys(self):
+        rates = CounterRates(ttl=100)
+        rates._last_expire = 0
+        # keys that never come back in an entity still alive
+        for key in range(1000):
+            rates.rate(None, key, [1], now=100)
+        rates.rate(None, 'eth0', [1], now=190)
+        rates.rate(None, 'eth0', [1], now=250)
+        assert len(rates) == 1
+        assert rates._entities.get(None).keys() == ['eth0']
+
+    def test_max_entities(self):
+        rates = CounterRates(max_entities=2)
+        for entity in ['c1', 'c2', 'c3']:
+            rates.rate(entity, 'eth0', [1], now=100)
+        assert len(rates) == 2
+        assert rates.rate('c1', 'eth0', [11], now=110) is None
+
+
+if __name__ == '__main__':
+    unittest.main()
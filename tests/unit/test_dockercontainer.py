@@ -4,8 +4,10 @@ import unittest
 import mock
 import requests
 
-from dockercontainer import DockerContainer, get_docker_containers
+from dockercontainer import (DockerContainer, get_docker_containers,
+                             poll_docker_containers)
 from utils import crawler_exceptions
+import utils.cgroup_utils
 
 
 def mocked_exists(pid):
@@ -237,6 +239,44 @@ class DockerDockerContainerTests(unittest.TestCase):
         ids = [c.long_id for c in get_docker_containers(user_list='5,3')]
         assert set(ids) == set(['3', '5'])
 
+    @mock.patch('dockercontainer.get_docker_inventory')
+    @mock.patch('dockercontainer.exec_dockerps')
+    @mock.patch('dockercontainer.plugins_manager.get_runtime_env_plugin',
+                side_effect=mocked_get_runtime_env)
+    @mock.patch('dockercontainer.get_docker_container_rootfs_path',
+                side_effect=mocked_get_rootfs)
+    def test_list_docker_containers_from_inventory(
+            self, mock_get_rootfs, mocked_get_runtime_env, mocked_dockerps,
+            mocked_inventory):
+        mocked_inventory.return_value.get_inspects.return_value = [
+            mocked_docker_inspect('1'), mocked_docker_inspect('2')]
+        ids = [c.long_id for c in get_docker_containers(user_list='2')]
+        assert ids == ['2']
+        assert mocked_dockerps.call_count == 0
+
+    @mock.patch('dockercontainer.get_docker_inventory')
+    @mock.patch('dockercontainer.plugins_manager.get_runtime_env_plugin',
+                side_effect=mocked_get_runtime_env)
+    @mock.patch('dockercontainer.get_docker_container_rootfs_path',
+                side_effect=mocked_get_rootfs)
+    def test_poll_docker_containers(self, mock_get_rootfs,
+                                    mocked_get_runtime_env, mocked_inventory):
+        mocked_inventory.return_value.poll_started.side_effect = [
+            mocked_docker_inspect('good_id'),
+            mocked_docker_inspect('other_id'),
+            None]
+        assert poll_docker_containers(1).long_id == 'good_id'
+        assert poll_docker_containers(1, user_list='good_id') is None
+        assert poll_docker_containers(1) is None
+
+    @mock.patch('dockercontainer.get_docker_inventory',
+                side_effect=lambda: None)
+    @mock.patch('dockercontainer.time.sleep')
+    def test_poll_docker_containers_without_inventory(self, mock_sleep,
+                                                      *args):
+        assert poll_docker_containers(1) is None
+        mock_sleep.assert_called_with(1)
+
     @mock.patch('dockercontainer.exec_dockerps',
                 side_effect=mocked_exec_dockerps)
     @mock.patch('dockercontainer.plugins_manager.get_runtime_env_plugin',
@@ -459,17 +499,18 @@ class DockerDockerContainerTests(unittest.TestCase):
                 side_effect=mocked_get_rootfs)
     @mock.patch('dockercontainer.os.path.ismount',
                 side_effect=lambda x: True if x == '/cgroup/memory' else False)
-    @mock.patch('dockercontainer.os.path.exists',
+    @mock.patch('utils.cgroup_utils.os.path.isdir',
                 side_effect=lambda x:
-                True if x == '/cgroup/memory/docker/good_id/abc' else False)
+                True if x == '/cgroup/memory/docker/good_id' else False)
     def test_memory_cgroup(
             self,
-            mocked_exists,
+            mocked_isdir,
             mocked_ismount,
             mock_get_rootfs,
             mock_inspect,
             mocked_get_runtime_env,
             mocked_dockerps):
+        utils.cgroup_utils._index.clear()
         c = DockerContainer("good_id")
         assert c.get_memory_cgroup_path(
             'abc') == '/cgroup/memory/docker/good_id/abc'
@@ -485,17 +526,18 @@ class DockerDockerContainerTests(unittest.TestCase):
     @mock.patch('dockercontainer.os.path.ismount',
                 side_effect=lambda x:
                 True if x == '/cgroup/cpuacct' or '/cgroup/cpu,cpuacct' else False)
-    @mock.patch('dockercontainer.os.path.exists',
+    @mock.patch('utils.cgroup_utils.os.path.isdir',
                 side_effect=lambda x:
-                True if x == '/cgroup/cpuacct/docker/good_id/abc' else False)
+                True if x == '/cgroup/cpuacct/docker/good_id' else False)
     def test_cpu_cgroup(
             self,
-            mocked_exists,
+            mocked_isdir,
             mocked_ismount,
             mock_get_rootfs,
             mock_inspect,
             mocked_get_runtime_env,
             mocked_dockerps):
+        utils.cgroup_utils._index.clear()
         c = DockerContainer("good_id")
         assert c.get_cpu_cgroup_path(
             'abc') == ("/cgroup/cpuacct/docker/good_id/"
@@ -0,0 +1,84 @@
+import unittest
+
+import mock
+
+from utils.crawler_exceptions import DockerutilsException
+from utils.dockerinventory import DockerContainersInventory
+
+
+def mocked_inspect(long_id, running=True):
+    return {'Id': long_id, 'State': {'Running': running, 'Pid': 123}}
+
+
+def mocked_exec_dockerinspect(long_id):
+    if long_id == 'gone':
+        raise DockerutilsException()
+    return mocked_inspect(long_id, running=(long_id != 'stopped'))
+
+
+class MockedClient():
+
+    def __init__(self, events):
+        self._events = events
+
+    def events(self, **kwargs):
+        return iter(self._events)
+
+
+class DockerInventoryTests(unittest.TestCase):
+
+    @mock.patch('utils.dockerinventory.exec_dockerps',
+                side_effect=lambda: [mocked_inspect('a'), mocked_inspect('b')])
+    def test_inventory_not_synced(self, mock_dockerps):
+        inventory = DockerContainersInventory()
+        assert not inventory.is_synced()
+        ids = sorted(i['Id'] for i in inventory.get_inspects())
+        assert ids == ['a', 'b']
+        assert mock_dockerps.call_count == 1
+
+    @mock.patch('utils.dockerinventory.exec_dockerinspect',
+                side_effect=mocked_exec_dockerinspect)
+    @mock.patch('utils.dockerinventory.exec_dockerps',
+                side_effect=lambda: [mocked_inspect('a'), mocked_inspect('b')])
+    @mock.patch('utils.dockerinventory.docker.Client',
+                side_effect=lambda **kwargs: MockedClient([
+                    {'Action': 'start', 'id': 'c'},
+                    {'Action': 'die', 'id': 'a'},
+                    {'status': 'start', 'id': 'gone'},
+                    {'Action': 'rename', 'id': 'stopped'},
+                    {'Action': 'exec_start', 'id': 'b'}]))
+    def test_inventory_events(self, mock_client, mock_dockerps,
+                              mock_inspect):
+        inventory = DockerContainersInventory()
+        inventory._subscribe()
+        assert inventory.is_synced()
+        ids = sorted(i['Id'] for i in inventory.get_inspects())
+        assert ids == ['b', 'c']
+        assert mock_dockerps.call_count == 1
+        # only the containers in start, rename and update events
+        assert mock_inspect.call_count == 3
+
+        assert inventory.poll_started(0.01)['Id'] == 'c'
+        assert inventory.poll_started(0.01) is None
+
+    @mock.patch('utils.dockerinventory.RESUBSCRIBE_INTERVAL', 0.01)
+    @mock.patch('utils.dockerinventory.exec_dockerps',
+                side_effect=lambda: [mocked_inspect('a')])
+    @mock.patch('utils.dockerinventory.docker.Client')
+    def test_inventory_lost_events(self, mock_client, mock_dockerps):
+        inventory = DockerContainersInventory()
+
+        def failed_events(**kwargs):
+            assert inventory.is_synced() is False
+            if mock_client.call_count == 2:
+                inventory.stop()
+            raise IOError('daemon restarted')
+
+        mock_client.return_value.events.side_effect = failed_events
+        inventory._run()
+        assert mock_client.call_count == 2
+        assert not inventory.is_synced()
+
+
+if __name__ == '__main__':
+    unittest.main()
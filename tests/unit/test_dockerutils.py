@@ -10,6 +10,14 @@ from utils.crawler_exceptions import (DockerutilsNoJsonLog, DockerutilsException
 
 class MockedClient():
 
+    def __init__(self):
+        self.hooks = {'response': []}
+        self.timeout = 60
+        self.adapters = {}
+
+    def mount(self, prefix, adapter):
+        self.adapters[prefix] = adapter
+
     def containers(self):
         return [{'Id': 'good_id'}]
     
@@ -70,6 +78,9 @@ class MockedClient():
     def history(self, image_id):
         return [{'History': 'xxx'}]
 
+    def events(self, **kwargs):
+        return []
+
     def docker_network(self, id):
         return [{
             "Name": "bridge",
@@ -109,13 +120,15 @@ def throw_docker_exception(*args, **kwargs):
 class DockerUtilsTests(unittest.TestCase):
 
     def setUp(self):
-        pass
+        utils.dockerutils.reset_docker_client()
+        utils.dockerutils._image_events_since = None
+        utils.dockerutils._image_events_checking = False
 
     def tearDown(self):
         pass
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     def test_exec_dockerps(self, *args):
         for c in utils.dockerutils.exec_dockerps():
             print c
@@ -145,7 +158,7 @@ class DockerUtilsTests(unittest.TestCase):
                      'Id': 'good_id'}
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     @mock.patch('utils.dockerutils.exec_dockerinspect',
                 side_effect=throw_docker_exception)
     def test_exec_dockerps_failure(self, *args):
@@ -153,7 +166,7 @@ class DockerUtilsTests(unittest.TestCase):
             utils.dockerutils.exec_dockerps()
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     def test_exec_docker_history(self, *args):
         h = utils.dockerutils.exec_docker_history('ididid')
         assert h == [{'History': 'xxx'}]
@@ -165,13 +178,13 @@ class DockerUtilsTests(unittest.TestCase):
             utils.dockerutils.exec_docker_history('ididid')
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     def test_exec_dockernetwork(self, *args):
         net = utils.dockerutils.exec_dockernetwork('ididid')
         assert net == {'usesDocker0Bridge': False}
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     def test_exec_docker_inspect(self, *args):
         i = utils.dockerutils.exec_dockerinspect('ididid')
 
@@ -220,7 +233,7 @@ class DockerUtilsTests(unittest.TestCase):
         assert utils.dockerutils._get_docker_storage_driver() == 'btrfs'
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     @mock.patch('utils.dockerutils.open',
                 side_effect=throw_io_error)
     def test_get_docker_storage_driver_step2(self, mock_open, mock_client):
@@ -234,7 +247,7 @@ class DockerUtilsTests(unittest.TestCase):
         assert utils.dockerutils._get_docker_storage_driver() == 'devicemapper'
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     def test_get_docker_server_version(self, mock_client):
         assert utils.dockerutils._get_docker_server_version() == '1.10.1'
 
@@ -245,7 +258,7 @@ class DockerUtilsTests(unittest.TestCase):
             utils.dockerutils._get_docker_server_version()
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     @mock.patch(
         'crawler.utils.dockerutils.os.path.isfile',
         side_effect=lambda p:
@@ -256,7 +269,7 @@ class DockerUtilsTests(unittest.TestCase):
             'id') == '/var/lib/docker/containers/id/id-json.log'
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     @mock.patch('utils.dockerutils.os.path.isfile',
                 side_effect=lambda p:
                     True if p == '/a/b/c/log.json' else False)
@@ -265,7 +278,7 @@ class DockerUtilsTests(unittest.TestCase):
             'id') == '/a/b/c/log.json'
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     @mock.patch('utils.dockerutils.os.path.isfile',
                 side_effect=lambda p: False)
     def test_get_json_logs_path_failure(self, mock_isfile, mock_client):
@@ -273,7 +286,7 @@ class DockerUtilsTests(unittest.TestCase):
             utils.dockerutils.get_docker_container_json_logs_path('id')
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     @mock.patch('utils.dockerutils.open',
                 side_effect=throw_io_error)
     def test_get_rootfs_not_supported_driver_failure(
@@ -283,7 +296,7 @@ class DockerUtilsTests(unittest.TestCase):
             utils.dockerutils.get_docker_container_rootfs_path('id')
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     @mock.patch('utils.dockerutils.open',
                 side_effect=[open('tests/unit/proc_pid_mounts_devicemapper'),
                              open('tests/unit/proc_mounts_devicemapper')])
@@ -295,7 +308,7 @@ class DockerUtilsTests(unittest.TestCase):
                       "9b651c381702ca4f787ffe562a5e39b/rootfs")
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     @mock.patch('utils.dockerutils.open',
                 side_effect=throw_io_error)
     def test_get_rootfs_devicemapper_failure(self, mock_open, mock_client):
@@ -313,7 +326,7 @@ class DockerUtilsTests(unittest.TestCase):
                 ]
                 )
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     def test_get_rootfs_btrfs_v1_8(self, mock_client, mock_list):
         utils.dockerutils.driver = 'btrfs'
         utils.dockerutils.server_version = '1.8.0'
@@ -323,7 +336,7 @@ class DockerUtilsTests(unittest.TestCase):
     @mock.patch('utils.dockerutils.misc.btrfs_list_subvolumes',
                 side_effect=throw_runtime_error)
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     def test_get_rootfs_btrfs_v1_8_failure(self, mock_client, mock_list):
         utils.dockerutils.driver = 'btrfs'
         utils.dockerutils.server_version = '1.8.0'
@@ -331,7 +344,7 @@ class DockerUtilsTests(unittest.TestCase):
             utils.dockerutils.get_docker_container_rootfs_path('abcde')
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     @mock.patch('utils.dockerutils.open',
                 side_effect=[open('tests/unit/btrfs_mount_init-id')])
     def test_get_rootfs_btrfs_v1_10(self, mock_open, mock_client):
@@ -341,7 +354,7 @@ class DockerUtilsTests(unittest.TestCase):
             'id') == '/var/lib/docker/btrfs/subvolumes/vol1/id/rootfs-a-b-c'
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     @mock.patch('utils.dockerutils.open',
                 side_effect=throw_io_error)
     def test_get_rootfs_btrfs_v1_10_failure(self, mock_open, mock_client):
@@ -355,7 +368,7 @@ class DockerUtilsTests(unittest.TestCase):
     @mock.patch('utils.dockerutils.os.listdir',
                 side_effect=lambda d: ['usr', 'boot', 'var'])
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     def test_get_rootfs_aufs_v1_8(self, *args):
         utils.dockerutils.driver = 'aufs'
         utils.dockerutils.server_version = '1.8.0'
@@ -367,7 +380,7 @@ class DockerUtilsTests(unittest.TestCase):
     @mock.patch('utils.dockerutils.os.listdir',
                 side_effect=lambda d: ['usr', 'boot', 'var'])
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     def test_get_rootfs_aufs_v1_8_failure(self, *args):
         utils.dockerutils.driver = 'aufs'
         utils.dockerutils.server_version = '1.8.0'
@@ -375,7 +388,7 @@ class DockerUtilsTests(unittest.TestCase):
             utils.dockerutils.get_docker_container_rootfs_path('abcde')
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     @mock.patch('utils.dockerutils.open',
                 side_effect=[open('tests/unit/aufs_mount_init-id')])
     def test_get_rootfs_aufs_v1_10(self, *args):
@@ -385,7 +398,7 @@ class DockerUtilsTests(unittest.TestCase):
             'abcde') == '/var/lib/docker/aufs/mnt/vol1/id/rootfs-a-b-c'
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     @mock.patch('utils.dockerutils.open',
                 side_effect=throw_io_error)
     def test_get_rootfs_aufs_v1_10_failure(self, *args):
@@ -395,7 +408,7 @@ class DockerUtilsTests(unittest.TestCase):
             utils.dockerutils.get_docker_container_rootfs_path('abcde')
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     @mock.patch('utils.dockerutils.open',
                 side_effect=[open('tests/unit/vfs_mount_init-id')])
     def test_get_rootfs_vfs_v1_10(self, *args):
@@ -405,7 +418,7 @@ class DockerUtilsTests(unittest.TestCase):
             'abcde') == '/var/lib/docker/vfs/dir/vol1/id/rootfs-a-b-c'
 
     @mock.patch('utils.dockerutils.docker.Client',
-                side_effect=lambda base_url, version: MockedClient())
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
     @mock.patch('utils.dockerutils.open',
                 side_effect=throw_io_error)
     def test_get_rootfs_vfs_v1_10_failure(self, *args):
@@ -413,3 +426,117 @@ class DockerUtilsTests(unittest.TestCase):
         utils.dockerutils.server_version = '1.10.0'
         with self.assertRaises(DockerutilsException):
             utils.dockerutils.get_docker_container_rootfs_path('abcde')
+
+    @mock.patch('utils.dockerutils.docker.Client',
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
+    def test_docker_client_shared(self, mock_client):
+        utils.dockerutils.exec_dockerinspect('good_id')
+        utils.dockerutils.exec_dockerps()
+        assert mock_client.call_count == 1
+        client = utils.dockerutils.get_docker_client()
+        assert client.hooks['response'] == [
+            utils.dockerutils._record_api_latency]
+
+        utils.dockerutils.configure_docker_client(max_connections=4)
+        utils.dockerutils.exec_dockerinspect('good_id')
+        assert mock_client.call_count == 2
+        adapter = utils.dockerutils.get_docker_client().adapters[
+            'http+docker://']
+        assert adapter.max_connections == 4
+        # a single pool for all the requests
+        pool = adapter.get_connection(
+            'http+docker://localunixsocket/containers/a/json')
+        assert adapter.get_connection(
+            'http+docker://localunixsocket/containers/b/json') is pool
+        assert pool.socket_path == utils.dockerutils.DOCKER_SOCKET_PATH
+        assert pool.pool.maxsize == 4
+        utils.dockerutils.configure_docker_client(
+            max_connections=utils.dockerutils.DEFAULT_MAX_CONNECTIONS)
+
+    @mock.patch('utils.dockerutils.os.getpid', side_effect=[1, 2, 2])
+    @mock.patch('utils.dockerutils.docker.Client',
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
+    def test_docker_client_forked(self, mock_client, *args):
+        client = utils.dockerutils.get_docker_client()
+        assert utils.dockerutils.get_docker_client() is not client
+        assert mock_client.call_count == 2
+
+    def test_docker_api_latency(self):
+        response = mock.Mock()
+        response.request.method = 'GET'
+        response.request.url = ('http+docker://localunixsocket/v1.24/'
+                                'containers/abcdef/json')
+        response.elapsed.total_seconds.side_effect = [0.1, 0.3]
+        utils.dockerutils._record_api_latency(response)
+        utils.dockerutils._record_api_latency(response)
+        latency = utils.dockerutils.get_docker_api_latency()
+        stats = latency['GET /containers/{id}/json']
+        assert stats['count'] == 2
+        assert abs(stats['avg'] - 0.2) < 0.0001
+        assert stats['max'] == 0.3
+
+    @mock.patch('utils.dockerutils.time.time', side_effect=[100, 100, 102])
+    @mock.patch('utils.dockerutils.docker.Client')
+    def test_image_cache(self, mock_client, *args):
+        client = MockedClient()
+        client.inspect_image = mock.Mock(side_effect=client.inspect_image)
+        client.events = mock.Mock(return_value=[
+            {'Type': 'image', 'Action': 'untag',
+             'Actor': {'ID': 'sha256:07c86167cdc4264926fa5d2894e34a339ad27'}}])
+        mock_client.return_value = client
+
+        for _ in range(2):
+            inspect = utils.dockerutils.exec_dockerinspect('good_id')
+            assert inspect['RepoTags'] == ['registry/abc/def:latest',
+                                           'debian:latest']
+        assert client.inspect_image.call_count == 1
+        assert client.events.call_count == 0
+
+        # the image was untagged, so we have to inspect it again
+        utils.dockerutils.exec_dockerinspect('good_id')
+        assert client.inspect_image.call_count == 2
+        # the last second of the previous check is asked for again
+        assert client.events.call_args[1]['since'] == 99
+        assert client.events.call_args[1]['until'] == 102
+
+    @mock.patch('utils.dockerutils.time.time',
+                side_effect=[100] + [102] * 10)
+    def test_sync_image_cache_unlocked(self, *args):
+        client = mock.Mock()
+
+        def events(**kwargs):
+            # other threads do not wait for the docker daemon
+            assert utils.dockerutils._image_events_lock.acquire(False)
+            utils.dockerutils._image_events_lock.release()
+            utils.dockerutils._sync_image_cache(client)
+            raise docker.errors.DockerException()
+        client.events.side_effect = events
+
+        utils.dockerutils._sync_image_cache(client)
+        utils.dockerutils._image_cache.put('image1', {})
+        utils.dockerutils._sync_image_cache(client)
+        assert client.events.call_count == 1
+        # a failed check forgets all the images
+        assert 'image1' not in utils.dockerutils._image_cache
+        assert utils.dockerutils._image_events_since is None
+
+    @mock.patch('utils.dockerutils.docker.Client',
+                side_effect=lambda base_url, version, **kwargs: MockedClient())
+    def test_exec_docker_history_with_inspect(self, *args):
+        h = utils.dockerutils.exec_docker_history(
+            'ididid', inspect={'Image': 'image_id'})
+        assert h == [{'History': 'xxx'}]
+        assert utils.dockerutils._image_cache.get('image_id') == {
+            'history': [{'History': 'xxx'}]}
+
+    def test_invalidate_image_by_tag(self):
+        utils.dockerutils._image_cache.put(
+            'image1', {'inspect': {'RepoTags': ['ubuntu:latest']}})
+        utils.dockerutils._image_cache.put(
+            'image2', {'inspect': {'RepoTags': ['debian:latest']}})
+        utils.dockerutils._invalidate_image(
+            {'status': 'pull', 'id': 'ubuntu:latest'})
+        utils.dockerutils._invalidate_image(
+            {'status': 'start', 'id': 'debian:latest'})
+        assert 'image1' not in utils.dockerutils._image_cache
+        assert 'image2' in utils.dockerutils._image_cache
@@ -438,7 +438,7 @@ class EmitterTests(unittest.TestCase):
     def test_emitter_http(self, mock_sleep, mock_post, mock_format):
         emitter = HttpEmitter()
         emitter.init(url='http://1.1.1.1/good')
-        emitter.emit('frame')
+        assert emitter.emit('frame') is True
         self.assertEqual(mock_post.call_count, 1)
 
     @mock.patch('iemit_plugin.IEmitter.format',
@@ -449,7 +449,7 @@ class EmitterTests(unittest.TestCase):
     def test_emitter_http_server_error(self, mock_sleep, mock_post, mock_format):
         emitter = HttpEmitter()
         emitter.init(url='http://1.1.1.1/bad')
-        emitter.emit('frame')
+        assert emitter.emit('frame') is False
         self.assertEqual(mock_post.call_count, 5)
 
     @mock.patch('iemit_plugin.IEmitter.format',
@@ -460,7 +460,7 @@ class EmitterTests(unittest.TestCase):
     def test_emitter_http_request_exception(self, mock_sleep, mock_post, mock_format):
         emitter = HttpEmitter()
         emitter.init(url='http://1.1.1.1/exception')
-        emitter.emit('frame')
+        assert emitter.emit('frame') is False
         self.assertEqual(mock_post.call_count, 5)
 
     @mock.patch('iemit_plugin.IEmitter.format',
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from utils import file_hashes
+from utils.features import FileFeature, FileRemovedFeature
+
+
+def file_feature(path, type='file'):
+    return (path, FileFeature(1, 1, 0, None, 33188, 1,
+                              os.path.basename(path), path, 10, type, 0),
+            'file')
+
+
+class FileHashesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.root, 'cache', 'host')
+        self._write('a', 'file1')
+        self._write('b' * 100, 'file2')
+        os.makedirs(self._path('dir'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _path(self, *path):
+        return os.path.join(self.root, *path)
+
+    def _write(self, data, *path):
+        with open(self._path(*path), 'w') as f:
+            f.write(data)
+
+    def _hash(self, **kwargs):
+        hasher = file_hashes.FileHasher(self.cache_path, **kwargs)
+        features = [file_feature('/file1'), file_feature('/file2'),
+                    file_feature('/dir', type='dir'),
+                    ('/gone', FileRemovedFeature('gone', '/gone'),
+                     'file-removed')]
+        return dict((k, getattr(f, 'hash', 'unhashed'))
+                    for (k, f, t) in file_hashes.hash_files(
+                        features, self.root, hasher))
+
+    def test_hash_files(self):
+        hashes = self._hash()
+        assert hashes == {
+            '/file1': 'sha256:' + hashlib.sha256('a').hexdigest(),
+            '/file2': 'sha256:' + hashlib.sha256('b' * 100).hexdigest(),
+            '/dir': None,
+            '/gone': 'unhashed'}
+
+        # only stat'ed, as nothing changed
+        with mock.patch('utils.file_hashes.FileHasher._hash_file') as read:
+            assert self._hash() == hashes
+        assert not read.called
+
+        # a new inode, mtime and ctime
+        os.remove(self._path('file1'))
+        self._write('c', 'file1')
+        assert self._hash()['/file1'] == \
+            'sha256:' + hashlib.sha256('c').hexdigest()
+
+    @mock.patch('utils.file_hashes.READ_SIZE', 16)
+    def test_hash_files_streamed(self):
+        assert self._hash()['/file2'] == \
+            'sha256:' + hashlib.sha256('b' * 100).hexdigest()
+
+    def test_hash_files_algorithm(self):
+        self._hash()
+        # not the sha256 digests of the cache
+        assert self._hash(algorithm='md5')['/file1'] == \
+            'md5:' + hashlib.md5('a').hexdigest()
+        with self.assertRaises(ValueError):
+            self._hash(algorithm='nothing')
+
+    def test_hash_files_max_size_and_include(self):
+        hashes = self._hash(max_size=10)
+        assert hashes['/file1'] is not None and hashes['/file2'] is None
+        hashes = self._hash(include=['/file2', '/other*'])
+        assert hashes['/file1'] is None and hashes['/file2'] is not None
+        hashes = self._hash(include='/file*')
+        assert hashes['/file1'] is not None and hashes['/file2'] is not None
+
+    def test_hash_files_changed_only(self):
+        self._hash()
+        # like a watch crawl: file1 changed, file2 removed
+        self._write('c', 'file1')
+        hasher = file_hashes.FileHasher(self.cache_path)
+        features = [file_feature('/file1'),
+                    ('/file2', FileRemovedFeature('file2', '/file2'),
+                     'file-removed')]
+        list(file_hashes.hash_files(features, self.root, hasher,
+                                    complete=False))
+        hasher = file_hashes.FileHasher(self.cache_path)
+        assert sorted(hasher._previous) == ['/file1']
+
+        self._write('d', 'file2')
+        self._hash()
+        with mock.patch('utils.file_hashes.FileHasher._hash_file') as read:
+            hasher = file_hashes.FileHasher(self.cache_path)
+            features = [file_feature('/file2')]
+            list(file_hashes.hash_files(features, self.root, hasher,
+                                        complete=False))
+        assert not read.called
+        # the digest of file1 is kept
+        with mock.patch('utils.file_hashes.FileHasher._hash_file') as read:
+            self._hash()
+        assert not read.called
+
+    def test_hash_files_symlink(self):
+        outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outside)
+        with open(os.path.join(outside, 'secret'), 'w') as f:
+            f.write('secret')
+        # say a dir of a container rootfs replaced after the walk
+        os.symlink(outside, self._path('link'))
+        hasher = file_hashes.FileHasher(self.cache_path)
+        [(k, f, t)] = file_hashes.hash_files([file_feature('/link/secret')],
+                                             self.root, hasher)
+        assert f.hash is None
+
+    def test_hash_files_corrupted_cache(self):
+        os.makedirs(os.path.dirname(self.cache_path))
+        self._write('corrupted', 'cache', 'host')
+        assert self._hash()['/file1'] is not None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from utils import file_index
+from utils.file_utils import crawl_files
+from utils.features import FileFeature, FileRemovedFeature
+from worker import Worker
+
+
+def file_feature(path, mtime=1, atime=1):
+    return (path, FileFeature(atime, 1, 0, None, 33188, mtime,
+                              os.path.basename(path), path, 10, 'file', 0),
+            'file')
+
+
+class FileIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.index_path = file_index.get_index_path(self.index_dir, 'host',
+                                                    '/')
+
+    def tearDown(self):
+        file_index.discard_deferred()
+        shutil.rmtree(self.index_dir)
+
+    def _crawl(self, features, **kwargs):
+        return [(k, t) for (k, f, t) in file_index.crawl_changed_files(
+            features, self.index_path, **kwargs)]
+
+    def test_crawl_changed_files(self):
+        features = [file_feature('/a'), file_feature('/b')]
+        assert self._crawl(features) == [('/a', 'file'), ('/b', 'file')]
+        assert self._crawl(features) == []
+
+        # a new atime is not a change
+        features = [file_feature('/a', mtime=2), file_feature('/b', atime=2),
+                    file_feature('/c')]
+        assert self._crawl(features) == [('/a', 'file'), ('/c', 'file')]
+
+        [(k, f, t)] = file_index.crawl_changed_files(
+            features[1:], self.index_path)
+        assert (k, f, t) == ('/a', FileRemovedFeature('a', '/a'),
+                             'file-removed')
+
+    def test_crawl_changed_files_failed(self):
+        def features():
+            yield file_feature('/a')
+            raise OSError()
+
+        with self.assertRaises(OSError):
+            self._crawl(features())
+        assert not os.path.exists(self.index_path)
+
+    def test_crawl_changed_files_replaced(self):
+        rootfs_dir = os.path.join(self.index_dir, 'rootfs')
+        os.mkdir(rootfs_dir)
+        path = os.path.join(rootfs_dir, 'a')
+        open(path, 'w').close()
+
+        def features():
+            return crawl_files(rootfs_dir, root_dir_alias='/')
+
+        # the inode comes from the lstat of the walk
+        features_a = [f for (k, f, t) in features() if k == '/a']
+        assert features_a[0].inode == os.lstat(path).st_ino
+        # and is kept when sent from a namespace crawl
+        feature = pickle.loads(pickle.dumps(features_a[0],
+                                            pickle.HIGHEST_PROTOCOL))
+        assert feature.inode == features_a[0].inode
+        assert len(self._crawl(features())) == 2
+        assert self._crawl(features()) == []
+        # another file with the same times, size and mode
+        stat = os.lstat(path)
+        open(path + '.new', 'w').close()
+        os.utime(path + '.new', (stat.st_atime, stat.st_mtime))
+        os.rename(path + '.new', path)
+        assert ('/a', 'file') in self._crawl(features())
+
+    def test_crawl_changed_files_deferred(self):
+        file_index.defer_saves()
+        assert len(self._crawl([file_feature('/a')])) == 1
+        assert not os.path.exists(self.index_path)
+        # not emitted: crawled again
+        file_index.discard_deferred()
+        file_index.defer_saves()
+        assert len(self._crawl([file_feature('/a')])) == 1
+        file_index.save_deferred()
+        assert len(self._crawl([file_feature('/a')])) == 0
+
+    def test_worker_emit_failed(self):
+        crawler = mock.Mock()
+        crawler.crawl.side_effect = lambda: [
+            list(file_index.crawl_changed_files([file_feature('/a')],
+                                                self.index_path))]
+        emitters = mock.Mock()
+        emitters.emit.side_effect = IOError()
+        with self.assertRaises(IOError):
+            Worker(emitters=emitters, crawler=crawler).iterate()
+        assert not os.path.exists(self.index_path)
+
+        # an http emitter giving up after its retries
+        emitters.emit.side_effect = None
+        emitters.emit.return_value = False
+        Worker(emitters=emitters, crawler=crawler).iterate()
+        assert not os.path.exists(self.index_path)
+
+        emitters.emit.return_value = True
+        Worker(emitters=emitters, crawler=crawler).iterate()
+        assert os.path.exists(self.index_path)
+
+    @mock.patch('utils.file_index.time.time', side_effect=[1000, 1050, 1200])
+    def test_crawl_changed_files_full_resync(self, *args):
+        features = [file_feature('/a')]
+        assert len(self._crawl(features, full_resync_interval=100)) == 1
+        assert len(self._crawl(features, full_resync_interval=100)) == 0
+        assert len(self._crawl(features, full_resync_interval=100)) == 1
+
+    def test_corrupted_index(self):
+        with open(self.index_path, 'w') as f:
+            f.write('junk')
+        assert len(self._crawl([file_feature('/a')])) == 1
+
+    def test_remove_indexes(self):
+        gone = file_index.get_index_path(self.index_dir, 'a' * 64, '/')
+        running = file_index.get_index_path(self.index_dir, 'b' * 64, '/')
+        for path in [gone, running, self.index_path]:
+            open(path, 'w').close()
+        file_index.remove_indexes(self.index_dir, set(['b' * 64]))
+        assert sorted(os.listdir(self.index_dir)) == sorted(
+            os.path.basename(p) for p in [running, self.index_path])
+
+
+if __name__ == '__main__':
+    unittest.main()
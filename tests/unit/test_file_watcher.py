@@ -0,0 +1,125 @@
+import errno
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+
+from utils.file_watcher import Inotify, TreeWatcher
+
+
+class FileWatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self._write('a', 'file1')
+        self._write('b', 'file2')
+        os.makedirs(self._path('excluded'))
+        self.watchers = []
+
+    def tearDown(self):
+        for watcher in self.watchers:
+            watcher.close()
+        shutil.rmtree(self.root)
+
+    def _path(self, *path):
+        return os.path.join(self.root, *path)
+
+    def _write(self, data, *path):
+        path = self._path(*path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def _watch(self, dirs=None):
+        with mock.patch('utils.file_watcher.READ_INTERVAL', 0.05):
+            watcher = TreeWatcher(self.root, [self._path('excluded')], dirs)
+        self.watchers.append(watcher)
+        return watcher
+
+    def _get_changes(self, watcher):
+        # give the thread reading the events some time
+        time.sleep(0.3)
+        (changed, removed) = watcher.get_changes()
+        return (sorted(path for (path, _) in changed), list(removed))
+
+    def test_get_changes(self):
+        watcher = self._watch()
+        assert self._get_changes(watcher) == (
+            [self.root, self._path('file1'), self._path('file2')], [])
+        assert self._get_changes(watcher) == ([], [])
+
+        self._write('c', 'file1')
+        os.remove(self._path('file2'))
+        self._write('d', 'dir', 'file3')
+        self._write('e', 'excluded', 'file4')
+        assert self._get_changes(watcher) == (
+            [self._path('dir'), self._path('dir', 'file3'),
+             self._path('file1')], [self._path('file2')])
+
+        # the new dir is watched too
+        self._write('f', 'dir', 'file3')
+        assert self._get_changes(watcher) == ([self._path('dir', 'file3')],
+                                              [])
+
+    def test_get_changes_out_of_watches(self):
+        add_watch = Inotify.add_watch
+
+        def mocked_add_watch(inotify, path):
+            if path.startswith(self._path('dir')):
+                raise OSError(errno.ENOSPC, 'No space left on device')
+            return add_watch(inotify, path)
+
+        os.makedirs(self._path('dir', 'subdir'))
+        with mock.patch('utils.file_watcher.Inotify.add_watch',
+                        mocked_add_watch):
+            watcher = self._watch()
+            assert self._get_changes(watcher)[0] == [
+                self.root, self._path('dir'), self._path('dir', 'subdir'),
+                self._path('file1'), self._path('file2')]
+            # walked again, as we can not know what changed in it
+            assert self._get_changes(watcher) == ([], [])
+            self._write('c', 'dir', 'file3')
+            shutil.rmtree(self._path('dir', 'subdir'))
+            assert self._get_changes(watcher) == (
+                [self._path('dir'), self._path('dir', 'file3')],
+                [self._path('dir', 'subdir')])
+
+    def test_get_changes_lost_events(self):
+        watcher = self._watch()
+        self._get_changes(watcher)
+        self._write('cc', 'file1')
+        os.remove(self._path('file2'))
+        time.sleep(0.3)
+        with watcher._lock:
+            # lost with the overflow
+            watcher._changed.clear()
+            watcher._removed.clear()
+            watcher._handle_event(-1, 0x4000, '')
+        # walked again, and compared with what we knew
+        assert self._get_changes(watcher) == (
+            [self.root, self._path('file1')], [self._path('file2')])
+
+    def test_get_changes_dir_moved_away(self):
+        self._write('c', 'dir', 'subdir', 'file3')
+        watcher = self._watch()
+        self._get_changes(watcher)
+        os.rename(self._path('dir'), self._path('excluded', 'dir'))
+        assert self._get_changes(watcher) == (
+            [], [self._path('dir'), self._path('dir', 'subdir'),
+                 self._path('dir', 'subdir', 'file3')])
+
+    def test_get_changes_in_dirs(self):
+        watcher = self._watch(dirs=[self.root, self._path('excluded')])
+        assert self._get_changes(watcher) == (
+            [self.root, self._path('file1'), self._path('file2')], [])
+        self._write('d', 'dir', 'file3')
+        # not recursive
+        assert self._get_changes(watcher) == ([self._path('dir')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from utils import fs_walker
+from utils.fs_walker import PathTrie, SuffixVisitor, WalkVisitor, walk_tree
+
+
+class PathVisitor(WalkVisitor):
+
+    def visit_root(self):
+        return [self.root_dir]
+
+    def visit_file(self, path, entry=None):
+        return [path]
+
+    def visit_dir(self, path, entry=None):
+        return [path + '/']
+
+    def finish(self):
+        return ['done']
+
+
+class FsWalkerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for path in ['a/x.jar', 'a/b/y.gemspec', 'c/z.egg-info/PKG-INFO',
+                     'w.jar']:
+            path = os.path.join(self.root, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _path(self, *path):
+        return os.path.join(self.root, *path)
+
+    def _check_two_visitors(self, items):
+        first = [f for (i, f) in items if i == 0]
+        second = [f for (i, f) in items if i == 1]
+        assert first[0] == self.root and first[-1] == 'done'
+        assert sorted(first[1:-1]) == sorted([
+            self._path('w.jar'), self._path('c') + '/',
+            self._path('c', 'z.egg-info') + '/',
+            self._path('c', 'z.egg-info', 'PKG-INFO')])
+        assert sorted(second[1:-1]) == sorted([
+            self._path('w.jar'), self._path('a') + '/',
+            self._path('a', 'x.jar'), self._path('a', 'b') + '/',
+            self._path('a', 'b', 'y.gemspec')])
+
+    def _two_visitors(self, workers=1):
+        return [PathVisitor(self.root, [self._path('a')], workers),
+                PathVisitor(self.root, [self._path('c*')])]
+
+    def test_walk_tree_once_for_all_visitors(self):
+        with mock.patch('utils.fs_walker.scandir',
+                        wraps=fs_walker.scandir) as scandir:
+            self._check_two_visitors(list(walk_tree(self._two_visitors())))
+        # the root, a, a/b, c and c/z.egg-info
+        assert scandir.call_count == 5
+
+    def test_walk_tree_in_threads(self):
+        self._check_two_visitors(list(walk_tree(self._two_visitors(4))))
+
+    def test_walk_tree_without_scandir(self):
+        with mock.patch('utils.fs_walker.scandir', None):
+            with mock.patch('utils.fs_walker.os.walk',
+                            wraps=os.walk) as walk:
+                self._check_two_visitors(list(walk_tree(
+                    self._two_visitors())))
+        # os.walk recurses through itself for the subdirs
+        assert [c[0][0] for c in walk.call_args_list].count(self.root) == 1
+
+    def test_walk_tree_shares_lstat(self):
+        class LstatVisitor(WalkVisitor):
+
+            def visit_file(self, path, entry=None):
+                return [fs_walker.get_lstat(path, entry).st_size]
+
+        with mock.patch('utils.fs_walker.os.lstat') as lstat:
+            items = list(walk_tree([LstatVisitor(self.root),
+                                    LstatVisitor(self.root)]))
+        assert items == [(0, 0), (1, 0)] * 4
+        assert lstat.call_count == 0
+
+    def test_path_trie(self):
+        trie = PathTrie(['/a/b', '/c'])
+        assert '/a/b' in trie and '/c' in trie
+        assert '/a' not in trie and '/a/b/c' not in trie
+        assert trie.get('/a/') == {'b': {None: True}}
+        assert trie.get('/b') is None
+
+    def test_suffix_visitor(self):
+        visitors = [SuffixVisitor(self.root, ['a/'], ['.gemspec']),
+                    SuffixVisitor(self.root, ['a', 'c'], ['.egg-info'],
+                                  dirs=True)]
+        assert sorted(walk_tree(visitors)) == [(0, 'y.gemspec'),
+                                               (1, 'z.egg-info')]
+
+    def test_walk_tree_without_walking(self):
+        visitor = PathVisitor(self.root)
+        visitor.walk = False
+        assert list(walk_tree([visitor])) == [(0, self.root), (0, 'done')]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from utils.host_processes import scan_host_processes
+
+CONTAINER_ID = 'a' * 64
+HOST_PID_CONTAINER_ID = 'b' * 64
+
+
+class Container(object):
+
+    def __init__(self, long_id, pid):
+        self.long_id = long_id
+        self.pid = pid
+
+
+class HostProcessesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.proc = tempfile.mkdtemp()
+        self._write('btime 1000\n', 'stat')
+        self._write('', 'self', 'ns', 'pid')
+        self._write('', 'self', 'ns_container')
+        # the docker shim, in the host
+        self._add_process(50, 1, [50], 'ns/pid')
+        # the container init and its child
+        self._add_process(100, 50, [100, 1], 'ns_container')
+        self._add_process(101, 100, [101, 5], 'ns_container', uid=1000)
+        self._write('root:x:0:0::/root:/bin/sh\napp:x:1000:1000::/:/bin/sh\n',
+                    '100', 'root', 'etc', 'passwd')
+        # a container sharing the host pid namespace
+        self._add_process(200, 50, [200], 'ns/pid',
+                          cgroup='4:cpu:/docker/%s\n' % HOST_PID_CONTAINER_ID)
+
+    def tearDown(self):
+        shutil.rmtree(self.proc)
+
+    def _write(self, data, *path):
+        path = os.path.join(self.proc, *path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def _add_process(self, pid, ppid, ns_pids, namespace, cgroup='', uid=0):
+        pid = str(pid)
+        self._write('%s (proc) S %d %s\n' % (pid, ppid, ' '.join(['0'] * 40)),
+                    pid, 'stat')
+        self._write('proc\x00', pid, 'cmdline')
+        status = 'Uid:\t%d\t%d\t%d\t%d\n' % ((uid,) * 4)
+        if ns_pids:
+            status += 'NSpid:\t%s\n' % '\t'.join(str(p) for p in ns_pids)
+        self._write(status, pid, 'status')
+        self._write(cgroup, pid, 'cgroup')
+        os.makedirs(os.path.join(self.proc, pid, 'ns'))
+        # the same inode as the namespace of the others in it
+        os.link(os.path.join(self.proc, 'self', namespace),
+                os.path.join(self.proc, pid, 'ns', 'pid'))
+
+    def test_scan_host_processes(self):
+        containers = [Container(CONTAINER_ID, 100),
+                      Container(HOST_PID_CONTAINER_ID, 200),
+                      Container('c' * 64, 300)]
+        partition = scan_host_processes(containers, proc_dir=self.proc)
+        assert sorted(partition.keys()) == [CONTAINER_ID,
+                                            HOST_PID_CONTAINER_ID]
+        processes = sorted((r.pid, r.ppid, r.host_pid)
+                           for r in partition[CONTAINER_ID])
+        assert processes == [(1, 0, 100), (5, 1, 101)]
+        processes = [(r.pid, r.ppid, r.host_pid)
+                     for r in partition[HOST_PID_CONTAINER_ID]]
+        assert processes == [(200, 0, 200)]
+
+    def test_scan_host_processes_usernames(self):
+        containers = [Container(CONTAINER_ID, 100),
+                      Container(HOST_PID_CONTAINER_ID, 200)]
+        partition = scan_host_processes(containers, proc_dir=self.proc)
+        usernames = sorted((r.pid, r.username)
+                           for r in partition[CONTAINER_ID])
+        assert usernames == [(1, 'root'), (5, 'app')]
+        # no /etc/passwd to read
+        usernames = [r.username for r in partition[HOST_PID_CONTAINER_ID]]
+        assert usernames == ['0']
+
+    def test_scan_host_processes_passwd_symlink(self):
+        os.rename(os.path.join(self.proc, '100', 'root', 'etc'),
+                  os.path.join(self.proc, 'etc'))
+        os.symlink(os.path.join(self.proc, 'etc'),
+                   os.path.join(self.proc, '100', 'root', 'etc'))
+        partition = scan_host_processes([Container(CONTAINER_ID, 100)],
+                                        proc_dir=self.proc)
+        usernames = sorted((r.pid, r.username)
+                           for r in partition[CONTAINER_ID])
+        assert usernames == [(1, '0'), (5, '1000')]
+
+    def test_scan_host_processes_no_nspid(self):
+        # kernels older than 4.1
+        shutil.rmtree(os.path.join(self.proc, '101'))
+        self._add_process(101, 100, None, 'ns_container')
+        shutil.rmtree(os.path.join(self.proc, '200'))
+        self._add_process(200, 50, None, 'ns/pid',
+                          cgroup='4:cpu:/docker/%s\n' % HOST_PID_CONTAINER_ID)
+        containers = [Container(CONTAINER_ID, 100),
+                      Container(HOST_PID_CONTAINER_ID, 200)]
+        partition = scan_host_processes(containers, proc_dir=self.proc)
+        # the container is crawled from inside its namespaces instead
+        assert partition.keys() == [HOST_PID_CONTAINER_ID]
+        processes = [(r.pid, r.ppid, r.host_pid)
+                     for r in partition[HOST_PID_CONTAINER_ID]]
+        assert processes == [(200, 0, 200)]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+import mock
+
+from utils import host_snapshot
+from worker import Worker
+
+
+class HostSnapshotTests(unittest.TestCase):
+
+    def tearDown(self):
+        host_snapshot.clear_snapshot()
+
+    @mock.patch('utils.host_snapshot.psutil.cpu_times_percent',
+                side_effect=lambda percpu: [1, 2])
+    def test_values_read_once(self, mock_cpu):
+        snapshot = host_snapshot.take_snapshot()
+        for _ in range(3):
+            assert host_snapshot.get_snapshot().cpu_times_percent == [1, 2]
+        assert host_snapshot.get_snapshot() is snapshot
+        assert mock_cpu.call_count == 1
+
+    @mock.patch('utils.host_snapshot.psutil.boot_time',
+                side_effect=lambda: 1000.0)
+    @mock.patch('utils.host_snapshot.time.time', side_effect=lambda: 1500.0)
+    def test_uptime(self, *args):
+        assert host_snapshot.HostSnapshot().uptime == 500.0
+
+    @mock.patch('utils.host_snapshot.os.getloadavg',
+                side_effect=lambda: (1.0, 2.0, 3.0))
+    @mock.patch('utils.host_snapshot.psutil.virtual_memory')
+    @mock.patch('utils.host_snapshot.psutil.cpu_times_percent',
+                side_effect=lambda percpu: [1, 2])
+    def test_values_read_eagerly(self, *args):
+        snapshot = host_snapshot.take_snapshot()
+        for mocked in args:
+            assert mocked.call_count == 1
+        snapshot.loadavg
+        assert args[-1].call_count == 1
+
+    def test_no_iteration(self):
+        assert host_snapshot.get_snapshot() is not \
+            host_snapshot.get_snapshot()
+
+    def test_worker_iterate(self):
+        crawler = mock.Mock()
+        snapshots = []
+        crawler.crawl.side_effect = \
+            lambda: snapshots.append(host_snapshot.get_snapshot()) or []
+        worker = Worker(crawler=crawler)
+        worker.iterate()
+        worker.iterate()
+        assert snapshots[0] is not snapshots[1]
+        # gone after the iteration
+        assert host_snapshot.get_snapshot() not in snapshots
+
+    def test_worker_iterate_polling(self):
+        crawler = mock.Mock()
+        snapshots = []
+        crawler.polling_crawl.side_effect = \
+            lambda timeout: snapshots.append(host_snapshot._current)
+        crawler.crawl.side_effect = \
+            lambda: snapshots.append(host_snapshot._current) or []
+        Worker(crawler=crawler).iterate(timeout=0.01)
+        # taken after polling, right before the crawl
+        assert set(snapshots[:-1]) == set([None])
+        assert snapshots[-1] is not None
+
+
+if __name__ == '__main__':
+    unittest.main()
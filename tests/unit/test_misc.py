@@ -145,3 +145,17 @@ class MiscTests(unittest.TestCase):
                 'path',
                 ("btrfs/subvolumes/7cd6c219c63e0282ddbd8437c9b2a0220aff40bbfd6"
                     "734503bcd58e5afa28426")]]
+
+    def test_lru_cache(self):
+        cache = utils.misc.LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1  # 'b' is now the least recently used
+        cache.put('c', 3)
+        assert 'b' not in cache
+        assert cache.get('b', 'missing') == 'missing'
+        assert cache.items() == [('a', 1), ('c', 3)]
+        assert cache.pop('a') == 1
+        assert len(cache) == 1
+        cache.clear()
+        assert len(cache) == 0
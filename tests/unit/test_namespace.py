@@ -1,3 +1,5 @@
+import logging
+import os
 import Queue
 import time
 import unittest
@@ -31,6 +33,23 @@ def fun_failed(x=0):
     assert False
 
 
+def fun_range(n):
+    for i in range(n):
+        yield i
+
+
+def fun_range_slow(n, interval):
+    for i in range(n):
+        time.sleep(interval)
+        yield i
+
+
+def fun_range_failed(n):
+    for i in range(n):
+        yield i
+    assert False
+
+
 class MockedLibc:
 
     def __init__(self):
@@ -253,3 +272,257 @@ class NamespaceTests(unittest.TestCase):
             utils.namespace.run_as_another_namespace(
                 '1', utils.namespace.ALL_NAMESPACES, fun_not_exiting, 1)
         utils.namespace.IN_PROCESS_TIMEOUT = _old_timeout
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibc())
+    def test_run_as_another_namespace_batch(self, *args):
+        NamespaceCrawl = utils.namespace.NamespaceCrawl
+        results = utils.namespace.run_as_another_namespace_batch(
+            '1', [NamespaceCrawl(['mnt'], fun_add, (1,)),
+                  NamespaceCrawl(['net'], fun_failed, (1,)),
+                  NamespaceCrawl(['mnt'], fun_add, (2,))])
+        assert len(results) == 3
+        assert results[0] == (2, None)
+        assert results[1][0] is None
+        assert isinstance(results[1][1], AssertionError)
+        assert results[2] == (3, None)
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibc())
+    def test_run_as_another_namespace_batch_sessions(self, *args):
+        NamespaceCrawl = utils.namespace.NamespaceCrawl
+        results = utils.namespace.run_as_another_namespace_batch(
+            '1', [NamespaceCrawl(['mnt'], os.getpid, ()),
+                  NamespaceCrawl(['net', 'mnt'], os.getpid, ()),
+                  NamespaceCrawl(['mnt'], os.getpid, ())])
+        pids = [result for (result, exc) in results]
+        # one session per set of namespaces
+        assert pids[0] == pids[2]
+        assert len(set(pids)) == 2
+        assert os.getpid() not in pids
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibcFailedSetns())
+    def test_run_as_another_namespace_batch_failed_setns(self, *args):
+        NamespaceCrawl = utils.namespace.NamespaceCrawl
+        results = utils.namespace.run_as_another_namespace_batch(
+            '1', [NamespaceCrawl(['mnt'], fun_add, (1,)),
+                  NamespaceCrawl(['net'], fun_add, (2,))])
+        assert len(results) == 2
+        for (result, exc) in results:
+            assert result is None
+            assert isinstance(exc, crawler_exceptions.NamespaceFailedSetns)
+
+    @mock.patch('utils.namespace._run_in_new_process')
+    def test_run_as_another_namespace_batch_no_calls(self, *args):
+        assert utils.namespace.run_as_another_namespace_batch('1', []) == []
+        assert args[0].call_count == 0
+
+    def test_process_logging_locks(self):
+        handler = logging.StreamHandler()
+        logger = logging.getLogger('crawlutils')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        locked = []
+
+        def start(process):
+            locked.append(handler.lock._is_owned())
+
+        process = utils.namespace._Process(target=fun_add)
+        with mock.patch('utils.namespace.multiprocessing.Process.start',
+                        start):
+            process.start()
+        # held while forking, and not after
+        assert locked == [True]
+        assert not handler.lock._is_owned()
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibc())
+    def test_namespace_worker(self, *args):
+        NamespaceCrawl = utils.namespace.NamespaceCrawl
+        worker = utils.namespace.NamespaceWorker(
+            str(os.getpid()), utils.namespace.ALL_NAMESPACES)
+        try:
+            for _ in range(2):
+                results = worker.run(
+                    [NamespaceCrawl(['mnt'], fun_add, (1,)),
+                     NamespaceCrawl(['net'], fun_failed, (1,))])
+                assert results[0] == (2, None)
+                assert isinstance(results[1][1], AssertionError)
+            assert worker.is_alive()
+        finally:
+            worker.stop()
+        assert not worker.is_alive()
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibcFailedSetns())
+    def test_namespace_worker_failed_setns(self, *args):
+        with self.assertRaises(crawler_exceptions.NamespaceFailedSetns):
+            utils.namespace.NamespaceWorker(
+                '1', utils.namespace.ALL_NAMESPACES)
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibc())
+    def test_namespace_worker_timeout(self, *args):
+        NamespaceCrawl = utils.namespace.NamespaceCrawl
+        worker = utils.namespace.NamespaceWorker(
+            str(os.getpid()), utils.namespace.ALL_NAMESPACES)
+        with self.assertRaises(crawler_exceptions.CrawlTimeoutError):
+            worker.run([NamespaceCrawl(['mnt'], fun_not_exiting, (1,))],
+                       timeout=1)
+        assert not worker.is_alive()
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibc())
+    def test_namespace_workers_pool(self, *args):
+        NamespaceCrawl = utils.namespace.NamespaceCrawl
+        pool = utils.namespace.NamespaceWorkersPool()
+        pid = str(os.getpid())
+        try:
+            calls = [NamespaceCrawl(['mnt'], fun_add, (1,))]
+            assert pool.run(pid, calls) == [(2, None)]
+            worker = pool._workers[(pid, ('mnt',))]
+            assert pool.run(pid, calls) == [(2, None)]
+            # the same worker serves all the requests
+            assert pool._workers.values() == [worker]
+
+            pool.reap()
+            assert pool._workers.values() == [worker]
+            with mock.patch('utils.namespace.get_pid_namespace',
+                            return_value=None):
+                pool.reap()
+            assert pool._workers == {}
+            assert not worker._process.is_alive()
+        finally:
+            pool.stop()
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibc())
+    def test_namespace_workers_pool_unpicklable_call(self, *args):
+        NamespaceCrawl = utils.namespace.NamespaceCrawl
+        pool = utils.namespace.NamespaceWorkersPool()
+        try:
+            # lambdas can not be sent to the worker, so they are run in a
+            # one-off namespace session
+            calls = [NamespaceCrawl(['mnt'], lambda x: x + 1, (1,))]
+            results = pool.run(str(os.getpid()), calls)
+            assert results == [(2, None)]
+        finally:
+            pool.stop()
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibc())
+    def test_fork_server(self, *args):
+        server = utils.namespace.ForkServer()
+        try:
+            assert server.run(fun_add, (1,)) == 2
+            assert server.run(fun_add, (), {'x': 2}) == 3
+            with self.assertRaises(AssertionError):
+                server.run(fun_failed, (1,))
+            with mock.patch('utils.namespace._kill_process') as kill:
+                with self.assertRaises(crawler_exceptions.CrawlTimeoutError):
+                    server.run(fun_not_exiting, (1,), timeout=1)
+            # the child is known even if it times out right away
+            [((child_pid,), _)] = kill.call_args_list
+            assert child_pid is not None
+            utils.namespace._kill_process(child_pid)
+            with mock.patch('utils.namespace._kill_process') as kill:
+                with self.assertRaises(crawler_exceptions.CrawlTimeoutError):
+                    server.run(fun_not_exiting, (1,), timeout=0)
+            assert kill.call_args[0][0] is not None
+            utils.namespace._kill_process(kill.call_args[0][0])
+            assert server.is_alive()
+        finally:
+            server.stop()
+        assert not server.is_alive()
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibc())
+    def test_run_as_another_namespace_fork_server(self, *args):
+        NamespaceCrawl = utils.namespace.NamespaceCrawl
+        utils.namespace.start_fork_server()
+        try:
+            with mock.patch('utils.namespace.run_as_another_process',
+                            wraps=utils.namespace.run_as_another_process) as m:
+                assert utils.namespace.run_as_another_namespace(
+                    '1', ['mnt'], fun_add, 1) == 2
+                results = utils.namespace.run_as_another_namespace_batch(
+                    '1', [NamespaceCrawl(['mnt'], fun_add, (1,)),
+                          NamespaceCrawl(['net'], fun_failed, (1,))])
+                assert results[0] == (2, None)
+                assert isinstance(results[1][1], AssertionError)
+                # forked by the server
+                assert m.call_count == 0
+
+                # lambdas can not be sent to the fork server
+                assert utils.namespace.run_as_another_namespace(
+                    '1', ['mnt'], lambda x: x + 1, 1) == 2
+                assert m.call_count == 1
+        finally:
+            utils.namespace.stop_fork_server()
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibc())
+    def test_run_as_another_namespace_stream(self, *args):
+        features = utils.namespace.run_as_another_namespace_stream(
+            '1', ['mnt'], fun_range, 2500)
+        assert list(features) == range(2500)
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibc())
+    @mock.patch('utils.namespace.STREAM_CHUNK_SIZE', 2)
+    def test_run_as_another_namespace_stream_failed_fun(self, *args):
+        features = utils.namespace.run_as_another_namespace_stream(
+            '1', ['mnt'], fun_range_failed, 3)
+        received = []
+        with self.assertRaises(AssertionError):
+            for feature in features:
+                received.append(feature)
+        assert received == [0, 1, 2]
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibcFailedSetns())
+    def test_run_as_another_namespace_stream_failed_setns(self, *args):
+        with self.assertRaises(crawler_exceptions.NamespaceFailedSetns):
+            list(utils.namespace.run_as_another_namespace_stream(
+                '1', ['mnt'], fun_range, 3))
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibc())
+    @mock.patch('utils.namespace.STREAM_CHUNK_SIZE', 1)
+    @mock.patch('utils.namespace.IN_PROCESS_TIMEOUT', 1)
+    def test_run_as_another_namespace_stream_timeout(self, *args):
+        features = utils.namespace.run_as_another_namespace_stream(
+            '1', ['mnt'], fun_not_exiting)
+        # we still get what was sent before timing out
+        assert next(features) == 1
+        with self.assertRaises(crawler_exceptions.CrawlTimeoutError):
+            next(features)
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibc())
+    @mock.patch('utils.namespace.STREAM_CHUNK_SIZE', 1)
+    @mock.patch('utils.namespace.IN_PROCESS_TIMEOUT', 1)
+    def test_run_as_another_namespace_stream_slow(self, *args):
+        # longer than the timeout, but never waiting that long for a chunk
+        features = utils.namespace.run_as_another_namespace_stream(
+            '1', ['mnt'], fun_range_slow, 4, 0.4)
+        assert list(features) == range(4)
+
+    @mock.patch('utils.namespace._spawn')
+    def test_run_as_another_namespace_stream_not_iterated(self, *args):
+        features = utils.namespace.run_as_another_namespace_stream(
+            '1', ['mnt'], fun_range, 3)
+        features.close()
+        assert args[0].call_count == 0
+
+    @mock.patch('utils.namespace.get_libc',
+                side_effect=lambda: MockedLibc())
+    def test_run_as_another_namespace_stream_fork_server(self, *args):
+        utils.namespace.start_fork_server()
+        try:
+            features = utils.namespace.run_as_another_namespace_stream(
+                '1', ['mnt'], fun_range, 2500)
+            assert list(features) == range(2500)
+        finally:
+            utils.namespace.stop_fork_server()
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from utils.pid_resolver import PidResolver
+
+CONTAINER_ID = 'a' * 64
+
+INSPECT = {'Name': '/web', 'Config': {'Labels': {
+    'io.kubernetes.pod.namespace': 'default',
+    'io.kubernetes.pod.name': 'web-1'}}}
+
+
+class PidResolverTests(unittest.TestCase):
+
+    def setUp(self):
+        self.proc = tempfile.mkdtemp()
+        self._add_process(100, 500, '4:cpu:/docker/%s\n' % CONTAINER_ID)
+        self._add_process(200, 500, '4:cpu:/user.slice\n')
+        self.resolver = PidResolver(proc_dir=self.proc)
+
+    def tearDown(self):
+        shutil.rmtree(self.proc)
+
+    def _add_process(self, pid, start_time, cgroups):
+        pid_dir = os.path.join(self.proc, str(pid))
+        if not os.path.isdir(pid_dir):
+            os.makedirs(pid_dir)
+        with open(os.path.join(pid_dir, 'stat'), 'w') as f:
+            f.write('%d (proc) S %s %d 0\n' % (pid, ' '.join(['0'] * 18),
+                                               start_time))
+        with open(os.path.join(pid_dir, 'cgroup'), 'w') as f:
+            f.write(cgroups)
+
+    def test_get_container_id(self):
+        assert self.resolver.get_container_id(100) == CONTAINER_ID
+        assert self.resolver.get_container_id(200) is None
+        assert self.resolver.get_container_id(300) is None
+
+    def test_get_container_id_cached(self):
+        self.resolver.get_container_id(100)
+        self._add_process(100, 500, '')
+        assert self.resolver.get_container_id(100) == CONTAINER_ID
+        # pid 100 reused by a process outside of containers
+        self._add_process(100, 600, '')
+        assert self.resolver.get_container_id(100) is None
+
+    @mock.patch('utils.pid_resolver.exec_dockerinspect',
+                side_effect=lambda long_id: INSPECT)
+    def test_get_pod_labels(self, mock_inspect):
+        for _ in range(2):
+            labels = self.resolver.get_pod_labels(CONTAINER_ID)
+            assert labels['io.kubernetes.pod.name'] == 'web-1'
+        assert mock_inspect.call_count == 1
+
+    @mock.patch('utils.pid_resolver.exec_dockerinspect',
+                side_effect=Exception('gone'))
+    def test_get_pod_labels_gone(self, mock_inspect):
+        assert self.resolver.get_container_inspect(CONTAINER_ID) is None
+        assert self.resolver.get_pod_labels(CONTAINER_ID) == {}
+        # not inspected again
+        assert mock_inspect.call_count == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,18 @@
 import types
 import unittest
 from collections import namedtuple
+from io import BytesIO
 
 import os
+import pickle
+import shutil
 import sys
 import tempfile
+import threading
+import time
 from zipfile import ZipFile, ZipInfo
 
-from utils import jar_utils
+from utils import host_snapshot, jar_utils, namespace
 sys.path.append('tests/unit/')
 
 import mock
@@ -43,12 +48,16 @@ from plugins.systems.os_host_crawler import OSHostCrawler
 from plugins.systems.os_vm_crawler import os_vm_crawler
 from plugins.systems.package_container_crawler import PackageContainerCrawler
 from plugins.systems.package_host_crawler import PackageHostCrawler
-from plugins.systems.process_container_crawler import ProcessContainerCrawler
+from plugins.systems.process_container_crawler import (
+    ProcessContainerCrawler, crawl_processes, get_options)
 from plugins.systems.process_host_crawler import ProcessHostCrawler
 from plugins.systems.process_vm_crawler import process_vm_crawler
 
 from container import Container
+from container_context import ContainerContext
+from utils.counter_rates import CounterRates
 from utils.crawler_exceptions import CrawlError
+from utils.procfs import Connection as ProcConnection, ProcessRecord
 from utils.features import (
     OSFeature,
     ConfigFeature,
@@ -59,7 +68,14 @@ from utils.features import (
     InterfaceFeature,
     LoadFeature,
     DockerPSFeature,
-    JarFeature)
+    JarFeature,
+    ProcessFeature,
+    ProcessUpdateFeature,
+    ProcessExitFeature,
+    FileRemovedFeature,
+    HostProcessFeature,
+    MetricFeature,
+    ConnectionFeature)
 
 
 # for OUTVM psvmi
@@ -93,7 +109,7 @@ psvmi_interface = namedtuple(
 
 os_stat = namedtuple(
     'os_stat',
-    '''st_mode st_gid st_uid st_atime st_ctime st_mtime st_size''')
+    '''st_mode st_gid st_uid st_atime st_ctime st_mtime st_size st_ino''')
 
 
 def mocked_os_walk(root_dir):
@@ -211,6 +227,7 @@ partition = namedtuple('partition', 'device fstype mountpoint opts')
 pdiskusage = namedtuple('pdiskusage', 'percent total')
 meminfo = namedtuple('meminfo', 'rss vms')
 ioinfo = namedtuple('ioinfo', 'read_bytes write_bytes')
+cputimes = namedtuple('cputimes', 'user system')
 psutils_memory = namedtuple('psutils_memory', 'used free buffers cached')
 psutils_cpu = namedtuple(
     'psutils_cpu',
@@ -243,6 +260,7 @@ class Process():
         self.cwd = '/bin'
         self.ppid = 1
         self.create_time = 1000
+        self.cpu_time = 10.0
 
     def num_threads(self):
         return 1
@@ -265,26 +283,39 @@ class Process():
     def get_cpu_percent(self, interval):
         return 30
 
+    def get_cpu_times(self):
+        # 30% of a cpu between every two calls 0.1 seconds apart
+        self.cpu_time += 0.03
+        return cputimes(self.cpu_time - 1, 1)
+
     def get_memory_percent(self):
         return 30
 
+
+PROC_RECORD = ProcessRecord(
+    pid=123, ppid=1, name='init', cmdline=['cmd'], status='sleeping',
+    create_time=1000.0, num_threads=1, username='root', cpu_time=10.0,
+    rss=10, vms=20, read_bytes=10, write_bytes=20, cwd='/bin',
+    open_files=['/var/log/init.log'], sockets=set([999, 1000]),
+    host_pid=123, pid_namespace=None)
+
 STAT_DIR_MODE = 16749
 
 
 def mocked_os_lstat(path):
     print path
     if path == '/':
-        return os_stat(STAT_DIR_MODE, 2, 3, 4, 5, 6, 7)
+        return os_stat(STAT_DIR_MODE, 2, 3, 4, 5, 6, 7, 8)
     elif path == '/file1':
-        return os_stat(1, 2, 3, 4, 5, 6, 7)
+        return os_stat(1, 2, 3, 4, 5, 6, 7, 8)
     elif path == '/file2':
-        return os_stat(1, 2, 3, 4, 5, 6, 7)
+        return os_stat(1, 2, 3, 4, 5, 6, 7, 8)
     elif path == '/file3':
-        return os_stat(1, 2, 3, 4, 5, 6, 7)
+        return os_stat(1, 2, 3, 4, 5, 6, 7, 8)
     elif path == '/dir':
-        return os_stat(STAT_DIR_MODE, 2, 3, 4, 5, 6, 7)
+        return os_stat(STAT_DIR_MODE, 2, 3, 4, 5, 6, 7, 8)
     else:
-        return os_stat(1, 2, 3, 4, 5, 6, 7)
+        return os_stat(1, 2, 3, 4, 5, 6, 7, 8)
 
 
 def mocked_run_as_another_namespace(pid, ns, function, *args, **kwargs):
@@ -302,10 +333,12 @@ def throw_os_error(*args, **kvargs):
 class PluginTests(unittest.TestCase):
 
     def setUp(self):
-        pass
+        # the file tests mock os.walk, which the walker uses without scandir
+        self.scandir_patch = mock.patch('utils.fs_walker.scandir', None)
+        self.scandir_patch.start()
 
     def tearDown(self):
-        pass
+        self.scandir_patch.stop()
 
     def test_init(self, *args):
         pass
@@ -404,8 +437,7 @@ class PluginTests(unittest.TestCase):
             "run_as_another_namespace"),
         side_effect=mocked_run_as_another_namespace)
     @mock.patch(
-        ("plugins.systems.os_container_crawler."
-            "utils.dockerutils.exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
         'utils.os_utils.osinfo.get_osinfo',
@@ -433,12 +465,10 @@ class PluginTests(unittest.TestCase):
             assert arg.call_count == 1
 
     @mock.patch(
-        ("plugins.systems.os_container_crawler."
-            "utils.dockerutils.exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
-        ("plugins.systems.os_container_crawler.utils.dockerutils."
-            "get_docker_container_rootfs_path"),
+        'utils.dockerutils.get_docker_container_rootfs_path',
         side_effect=lambda long_id: '/a/b/c')
     @mock.patch(
         'utils.os_utils.osinfo.get_osinfo',
@@ -476,12 +506,10 @@ class PluginTests(unittest.TestCase):
                 arg.assert_called_with(123)
 
     @mock.patch(
-        ("plugins.systems.os_container_crawler."
-            "utils.dockerutils.exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
-        ("plugins.systems.os_container_crawler.utils.dockerutils."
-            "get_docker_container_rootfs_path"),
+        'utils.dockerutils.get_docker_container_rootfs_path',
         side_effect=throw_os_error)
     def test_os_container_crawler_plugin_avoidsetns_failure(self, *args):
         fc = OSContainerCrawler()
@@ -572,6 +600,51 @@ class PluginTests(unittest.TestCase):
         assert args[2].call_count == 2  # isdir
         args[2].assert_called_with('/')
 
+    @mock.patch('utils.file_utils.os.path.isdir',
+                side_effect=lambda p: True)
+    @mock.patch('utils.file_utils.os.walk',
+                side_effect=mocked_os_walk)
+    @mock.patch('utils.file_utils.os.lstat',
+                side_effect=mocked_os_lstat)
+    def test_file_host_crawler_incremental(self, *args):
+        fc = FileHostCrawler()
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        features = list(fc.crawl(incremental='True', index_dir=index_dir))
+        assert len(features) == 6
+        assert list(fc.crawl(incremental='True', index_dir=index_dir)) == []
+
+    def test_file_host_crawler_watch(self):
+        root_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root_dir)
+        open(os.path.join(root_dir, 'file1'), 'w').close()
+        fc = FileHostCrawler()
+        features = list(fc.crawl(root_dir=root_dir, exclude_dirs=[],
+                                 watch='True'))
+        self.addCleanup(fc._watcher.close)
+        assert sorted(f.name for (_, f, _) in features) == sorted([
+            os.path.basename(root_dir), 'file1'])
+        os.remove(os.path.join(root_dir, 'file1'))
+        # give the thread reading the events some time
+        time.sleep(0.3)
+        assert list(fc.crawl(root_dir=root_dir, exclude_dirs=[],
+                             watch='True')) == [
+            (os.path.join(root_dir, 'file1'),
+             FileRemovedFeature('file1', os.path.join(root_dir, 'file1')),
+             'file-removed')]
+
+    def test_file_host_crawler_hash(self):
+        root_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root_dir)
+        with open(os.path.join(root_dir, 'file1'), 'w') as f:
+            f.write('data')
+        fc = FileHostCrawler()
+        features = dict((f.name, f.hash) for (_, f, _) in fc.crawl(
+            root_dir=root_dir, exclude_dirs=[], hash='True',
+            hash_algorithm='md5', hash_cache_dir=root_dir + '/cache'))
+        assert features == {os.path.basename(root_dir): None,
+                            'file1': 'md5:8d777f385d3dfec8815d20f7496026dc'}
+
     @mock.patch('utils.file_utils.os.path.isdir',
                 side_effect=lambda p: True)
     @mock.patch('utils.file_utils.os.walk',
@@ -585,12 +658,11 @@ class PluginTests(unittest.TestCase):
                 pass
 
     @mock.patch(
-        ("plugins.systems.file_container_crawler."
-            "utils.dockerutils.exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
         ("plugins.systems.file_container_crawler."
-            "run_as_another_namespace"),
+            "run_as_another_namespace_stream"),
         side_effect=mocked_run_as_another_namespace)
     @mock.patch('utils.file_utils.os.path.isdir',
                 side_effect=lambda p: True)
@@ -617,12 +689,11 @@ class PluginTests(unittest.TestCase):
         args[2].assert_called_with('/')
 
     @mock.patch(
-        ("plugins.systems.jar_container_crawler."
-            "utils.dockerutils.exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
         ("plugins.systems.jar_container_crawler."
-            "run_as_another_namespace"),
+            "run_as_another_namespace_stream"),
         side_effect=mocked_run_as_another_namespace)
     def test_jar_container_crawler_plugin(self, *args):
         tmpdir = tempfile.mkdtemp()
@@ -656,12 +727,10 @@ class PluginTests(unittest.TestCase):
 
 
     @mock.patch(
-        ("plugins.systems.jar_container_crawler."
-            "utils.dockerutils.exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
-        ("plugins.systems.jar_container_crawler.utils.dockerutils."
-            "get_docker_container_rootfs_path"),
+        'utils.dockerutils.get_docker_container_rootfs_path',
         side_effect=lambda long_id: '/tmp')
     def test_jar_container_crawler_avoidsetns(self, *args):
         tmpdir = tempfile.mkdtemp()
@@ -693,14 +762,13 @@ class PluginTests(unittest.TestCase):
             os.remove(path)
 
     @mock.patch(
-        ("plugins.systems.file_container_crawler."
-            "utils.dockerutils.exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch('utils.file_utils.os.walk',
                 side_effect=throw_os_error)
     @mock.patch(
         ("plugins.systems.file_container_crawler."
-            "run_as_another_namespace"),
+            "run_as_another_namespace_stream"),
         side_effect=mocked_run_as_another_namespace)
     @mock.patch('utils.file_utils.os.path.isdir',
                 side_effect=lambda p: True)
@@ -713,12 +781,10 @@ class PluginTests(unittest.TestCase):
                 pass
 
     @mock.patch(
-        ("plugins.systems.file_container_crawler."
-            "utils.dockerutils.exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
-        ("plugins.systems.file_container_crawler.utils.dockerutils."
-            "get_docker_container_rootfs_path"),
+        'utils.dockerutils.get_docker_container_rootfs_path',
         side_effect=lambda long_id: '/1/2/3')
     @mock.patch('utils.file_utils.os.path.isdir',
                 side_effect=lambda p: True)
@@ -746,12 +812,11 @@ class PluginTests(unittest.TestCase):
         args[2].assert_called_with('/1/2/3')
 
     @mock.patch(
-        ("plugins.systems.file_container_crawler."
-            "utils.dockerutils.exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
         ("plugins.systems.file_container_crawler."
-            "run_as_another_namespace"),
+            "run_as_another_namespace_stream"),
         side_effect=mocked_run_as_another_namespace)
     @mock.patch('utils.file_utils.os.path.isdir',
                 side_effect=lambda p: True)
@@ -779,12 +844,10 @@ class PluginTests(unittest.TestCase):
         args[2].assert_called_with('/')
 
     @mock.patch(
-        ("plugins.systems.file_container_crawler."
-            "utils.dockerutils.exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
-        ("plugins.systems.file_container_crawler.utils.dockerutils."
-            "get_docker_container_rootfs_path"),
+        'utils.dockerutils.get_docker_container_rootfs_path',
         side_effect=lambda long_id: '/1/2/3')
     @mock.patch('utils.file_utils.os.path.isdir',
                 side_effect=lambda p: True)
@@ -865,11 +928,11 @@ class PluginTests(unittest.TestCase):
                                      'config')])
 
     @mock.patch(
-        ("plugins.systems.config_container_crawler."
-            "utils.dockerutils.exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
-        'plugins.systems.config_container_crawler.run_as_another_namespace',
+        ('plugins.systems.config_container_crawler.'
+            'run_as_another_namespace_stream'),
         side_effect=mocked_run_as_another_namespace)
     @mock.patch('utils.config_utils.os.path.isdir',
                 side_effect=lambda p: True)
@@ -893,11 +956,11 @@ class PluginTests(unittest.TestCase):
     @mock.patch('utils.config_utils.os.lstat',
                 side_effect=mocked_os_lstat)
     @mock.patch(
-        ("plugins.systems.config_container_crawler."
-            "utils.dockerutils.exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
-        'plugins.systems.config_container_crawler.run_as_another_namespace',
+        ('plugins.systems.config_container_crawler.'
+            'run_as_another_namespace_stream'),
         side_effect=mocked_run_as_another_namespace)
     @mock.patch('utils.config_utils.os.path.isdir',
                 side_effect=lambda p: True)
@@ -928,15 +991,13 @@ class PluginTests(unittest.TestCase):
 
     @mock.patch(
         ("plugins.systems.config_container_crawler."
-            "run_as_another_namespace"),
+            "run_as_another_namespace_stream"),
         side_effect=mocked_run_as_another_namespace)
     @mock.patch(
-        ("plugins.systems.config_container_crawler."
-            "utils.dockerutils.exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
-        ("plugins.systems.config_container_crawler.utils.dockerutils."
-            "get_docker_container_rootfs_path"),
+        'utils.dockerutils.get_docker_container_rootfs_path',
         side_effect=lambda long_id: '/1/2/3')
     @mock.patch('utils.config_utils.os.path.isdir',
                 side_effect=lambda p: True)
@@ -958,15 +1019,13 @@ class PluginTests(unittest.TestCase):
 
     @mock.patch(
         ("plugins.systems.config_container_crawler."
-            "run_as_another_namespace"),
+            "run_as_another_namespace_stream"),
         side_effect=mocked_run_as_another_namespace)
     @mock.patch(
-        ("plugins.systems.config_container_crawler."
-            "utils.dockerutils.exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
-        ("plugins.systems.config_container_crawler.utils.dockerutils."
-            "get_docker_container_rootfs_path"),
+        'utils.dockerutils.get_docker_container_rootfs_path',
         side_effect=lambda long_id: '/1/2/3')
     @mock.patch('utils.config_utils.os.path.isdir',
                 side_effect=lambda p: True)
@@ -1067,8 +1126,7 @@ class PluginTests(unittest.TestCase):
         args[0].assert_called_with('/', 'var/lib/rpm', 0, False)
 
     @mock.patch(
-        ("plugins.systems.package_container_crawler."
-            "exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
         'utils.package_utils.osinfo.get_osinfo',
@@ -1099,15 +1157,13 @@ class PluginTests(unittest.TestCase):
         args[0].assert_called_with('/', 'var/lib/dpkg', 0)
 
     @mock.patch(
-        ("plugins.systems.package_container_crawler."
-            "exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
         'plugins.systems.package_container_crawler.run_as_another_namespace',
         side_effect=mocked_run_as_another_namespace)
     @mock.patch(
-        ("plugins.systems.package_container_crawler."
-            "get_docker_container_rootfs_path"),
+        'utils.dockerutils.get_docker_container_rootfs_path',
         side_effect=lambda long_id: '/a/b/c')
     @mock.patch(
         'utils.package_utils.osinfo.get_osinfo',
@@ -1131,15 +1187,13 @@ class PluginTests(unittest.TestCase):
         args[2].assert_called_with(mount_point='/a/b/c')  # get_osinfo()
 
     @mock.patch(
-        ("plugins.systems.package_container_crawler."
-            "exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
         'plugins.systems.package_container_crawler.run_as_another_namespace',
         side_effect=mocked_run_as_another_namespace)
     @mock.patch(
-        ("plugins.systems.package_container_crawler."
-            "get_docker_container_rootfs_path"),
+        'utils.dockerutils.get_docker_container_rootfs_path',
         side_effect=lambda long_id: '/a/b/c')
     @mock.patch(
         'utils.package_utils.osinfo.get_osinfo',
@@ -1163,12 +1217,10 @@ class PluginTests(unittest.TestCase):
         args[2].assert_called_with(mount_point='/a/b/c')  # get_osinfo()
 
     @mock.patch(
-        ("plugins.systems.package_container_crawler."
-            "exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     @mock.patch(
-        ("plugins.systems.package_container_crawler."
-            "get_docker_container_rootfs_path"),
+        'utils.dockerutils.get_docker_container_rootfs_path',
         side_effect=lambda long_id: '/a/b/c')
     @mock.patch(
         'utils.package_utils.osinfo.get_osinfo',
@@ -1206,10 +1258,29 @@ class PluginTests(unittest.TestCase):
             assert f.pid == 123
         assert args[0].call_count == 1
 
+    @mock.patch('utils.pid_resolver.get_pod_labels',
+                side_effect=lambda long_id: {
+                    'io.kubernetes.pod.namespace': 'default',
+                    'io.kubernetes.pod.name': 'web-1'})
+    @mock.patch('utils.pid_resolver.get_container_id',
+                side_effect=lambda pid: 'a' * 64)
+    @mock.patch('plugins.systems.process_host_crawler.psutil.process_iter',
+                side_effect=lambda: [Process('init')])
+    def test_process_host_crawler_container_ids(self, *args):
+        fc = ProcessHostCrawler()
+        [(k, f, fname)] = fc.crawl(container_ids='True')
+        assert isinstance(f, HostProcessFeature)
+        assert (f.pid, f.container_id) == (123, 'a' * 64)
+        assert (f.pod_namespace, f.pod_name) == ('default', 'web-1')
+        args[1].assert_called_with(123)
+        args[2].assert_called_with('a' * 64)
+
     @mock.patch(
-        ("plugins.systems.process_container_crawler.utils.dockerutils."
-         "exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
+    @mock.patch(
+        'plugins.systems.process_container_crawler.procfs.read_open_files',
+        side_effect=lambda pid: None)
     @mock.patch(
         'plugins.systems.process_container_crawler.psutil.process_iter',
         side_effect=lambda: [Process('init')])
@@ -1226,6 +1297,100 @@ class PluginTests(unittest.TestCase):
             assert f.pid == 123
         assert args[0].call_count == 1
 
+    @mock.patch('utils.procfs.use_procfs', side_effect=lambda: True)
+    @mock.patch(
+        'utils.dockerutils.exec_dockerinspect',
+        side_effect=lambda long_id: {'State': {'Pid': 123}})
+    @mock.patch(
+        'plugins.systems.process_container_crawler.procfs.read_processes',
+        side_effect=lambda fds: [PROC_RECORD])
+    @mock.patch(
+        'plugins.systems.process_container_crawler.run_as_another_namespace',
+        side_effect=mocked_run_as_another_namespace)
+    def test_process_container_crawler_procfs(self, *args):
+        fc = ProcessContainerCrawler()
+        [(k, f, fname)] = fc.crawl('123')
+        assert k == 'init/123'
+        assert f == ProcessFeature(
+            cmd='cmd', created=1000.0, cwd='/bin', pname='init',
+            openfiles=['/var/log/init.log'], mmapfiles=[], pid=123, ppid=1,
+            threads=1, user='root')
+        assert fname == 'process'
+
+    @mock.patch(
+        'plugins.systems.process_container_crawler.procfs.read_open_files',
+        side_effect=lambda pid: None)
+    @mock.patch(
+        'plugins.systems.process_container_crawler.psutil.process_iter',
+        side_effect=lambda: [Process('init')])
+    @mock.patch(
+        'plugins.systems.process_container_crawler.run_as_another_namespace',
+        side_effect=mocked_run_as_another_namespace)
+    def test_process_container_crawler_incremental(self, *args):
+        fc = ProcessContainerCrawler()
+        context = ContainerContext('123', container=DummyContainer('123'))
+        [(k, f, fname)] = fc.crawl('123', context=context, incremental='True')
+        assert (k, fname) == ('init/123', 'process')
+        [(k, f, fname)] = fc.crawl('123', context=context, incremental='True')
+        assert (k, fname) == ('init/123', 'process-update')
+        assert f == ProcessUpdateFeature(openfiles=[], mmapfiles=[], pid=123,
+                                         ppid=1, threads=1)
+
+        # the namespace session of the containers crawler
+        call = fc.get_namespace_crawl('123', context=context,
+                                      incremental='True')
+        assert call.function is crawl_processes
+        assert call.args == (get_options({'incremental': 'True'}),
+                             {(123, 1000): 'init/123'})
+        # the plugin is not pickled with the call
+        assert pickle.loads(pickle.dumps(call.args)) == call.args
+        [(k, f, fname)] = fc.crawl_from_namespace_result(
+            '123', [], incremental='True')
+        assert (k, fname) == ('init/123', 'process-exit')
+        assert f == ProcessExitFeature(created=1000, pid=123)
+        assert fc.crawl_from_namespace_result(
+            '123', [], incremental='True') == []
+
+    def test_process_container_crawler_incremental_procfs(self):
+        fc = ProcessContainerCrawler()
+        context = ContainerContext('123', container=DummyContainer('123'),
+                                   processes=[PROC_RECORD])
+        [(k, f, fname)] = fc.crawl('123', context=context, incremental='True')
+        assert fname == 'process'
+        # pid 123 reused by a new process
+        context.processes = [PROC_RECORD._replace(create_time=2000.0),
+                             PROC_RECORD._replace(pid=124)]
+        features = fc.crawl('123', context=context, incremental='True')
+        assert [(key, ftype) for (key, _, ftype) in features] == [
+            ('init/123', 'process'), ('init/124', 'process')]
+        features = fc.crawl('123', context=context, incremental='True')
+        assert [ftype for (_, _, ftype) in features] == ['process-update'] * 2
+
+        fc.prepare_crawl([DummyContainer('456')])
+        assert fc.crawl('123', context=context, incremental='True')[0][2] == \
+            'process'
+
+    @mock.patch(
+        'plugins.systems.process_container_crawler.procfs.read_maps',
+        side_effect=lambda pid: ['/lib/a.so', '/lib/b.so', '/lib/a.so'])
+    def test_process_container_crawler_files(self, *args):
+        fc = ProcessContainerCrawler()
+        record = PROC_RECORD._replace(
+            open_files=['/var/log/a', '/var/log/b', '/var/log/a'])
+        context = ContainerContext('123', container=DummyContainer('123'),
+                                   processes=[record])
+        [(k, f, fname)] = fc.crawl('123', context=context,
+                                   get_mmap_files='True', max_files='1')
+        assert f.openfiles == ['/var/log/a']
+        assert f.mmapfiles == ['/lib/a.so']
+        args[0].assert_called_with(123)
+
+        [(k, f, fname)] = fc.crawl('123', context=context,
+                                   get_mmap_files='True', files_summary='True',
+                                   files_summary_top='1')
+        assert f.openfiles == {'count': 3, 'top': ['/var/log/a']}
+        assert f.mmapfiles == {'count': 3, 'top': ['/lib/a.so']}
+
     @mock.patch('plugins.systems.process_vm_crawler.psvmi.context_init',
                 side_effect=lambda dn1, dn2, kv, d, a: 1000)
     @mock.patch('plugins.systems.process_vm_crawler.psvmi.process_iter',
@@ -1273,8 +1438,7 @@ class PluginTests(unittest.TestCase):
     @mock.patch('utils.disk_utils.psutil.disk_usage',
                 side_effect=lambda x: pdiskusage(10, 100))
     @mock.patch(
-        ("plugins.systems.disk_container_crawler.utils.dockerutils."
-         "exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     def test_crawl_disk_partitions_outcontainer_mode(self, *args):
         fc = DiskContainerCrawler()
@@ -1296,11 +1460,17 @@ class PluginTests(unittest.TestCase):
                                                partitionsize=100),
                                    'disk')])
 
+    @mock.patch('utils.metric_utils.time.sleep')
+    @mock.patch('utils.metric_utils.time.time',
+                side_effect=[100.0, 100.1])
     @mock.patch('utils.metric_utils.psutil.process_iter',
                 side_effect=lambda: [Process('init')])
+    @mock.patch('utils.metric_utils._cpu_rates', new_callable=CounterRates)
     def test_crawl_metrics_invm_mode(self, *args):
         fc = MetricHostCrawler()
-        for (k, f, t) in fc.crawl():
+        features = list(fc.crawl())
+        assert len(features) == 1
+        for (k, f, t) in features:
             assert f.cpupct == 30.0
             assert f.mempct == 30.0
             assert f.pname == 'init'
@@ -1310,8 +1480,42 @@ class PluginTests(unittest.TestCase):
             assert f.vms == 20
             assert f.read == 10
             assert f.write == 20
-        assert args[0].call_count == 1
+        assert args[1].call_count == 1
+        assert args[3].call_count == 1
+
+    @mock.patch('utils.metric_utils.time.sleep')
+    @mock.patch('utils.metric_utils.time.time',
+                side_effect=[100.0, 100.1, 110.1])
+    @mock.patch('utils.metric_utils._cpu_rates', new_callable=CounterRates)
+    def test_crawl_metrics_invm_mode_cached(self, *args):
+        process = Process('init')
+        with mock.patch('utils.metric_utils.psutil.process_iter',
+                        side_effect=lambda: [process]):
+            fc = MetricHostCrawler()
+            list(fc.crawl())
+            # 3 cpu seconds in 10 seconds, with no sleep this time
+            process.cpu_time += 2.97
+            [(k, f, t)] = list(fc.crawl())
+        assert f.cpupct == 30.0
+        assert args[2].call_count == 1
 
+    @mock.patch('utils.metric_utils.time.sleep')
+    @mock.patch('utils.metric_utils._cpu_rates', new_callable=CounterRates)
+    def test_crawl_metrics_invm_mode_exited(self, *args):
+        process = Process('init')
+        fc = MetricHostCrawler()
+        with mock.patch('utils.metric_utils.psutil.process_iter',
+                        side_effect=lambda: [process]):
+            list(fc.crawl())
+        assert args[0].get_keys(None) == set([(123, 1000)])
+        # the process exited, and another one started
+        process.pid = 124
+        with mock.patch('utils.metric_utils.psutil.process_iter',
+                        side_effect=lambda: [process]):
+            list(fc.crawl())
+        assert args[0].get_keys(None) == set([(124, 1000)])
+
+    @mock.patch('utils.metric_utils.time.sleep')
     @mock.patch('utils.metric_utils.psutil.process_iter',
                 side_effect=lambda: [Process('init')])
     @mock.patch('utils.metric_utils.round',
@@ -1321,20 +1525,26 @@ class PluginTests(unittest.TestCase):
             fc = MetricHostCrawler()
             for ff in fc.crawl():
                 pass
-        assert args[0].call_count == 1
+        assert args[1].call_count == 1
 
+    @mock.patch('utils.metric_utils.time.sleep')
+    @mock.patch('utils.metric_utils.time.time',
+                side_effect=[100.0, 100.1, 110.1])
     @mock.patch('utils.metric_utils.psutil.process_iter',
                 side_effect=lambda: [Process('init')])
     @mock.patch(
         'plugins.systems.metric_container_crawler.run_as_another_namespace',
         side_effect=mocked_run_as_another_namespace)
     @mock.patch(
-        ("plugins.systems.disk_container_crawler.utils.dockerutils."
-         "exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
+    @mock.patch('utils.metric_utils._cpu_rates', new_callable=CounterRates)
     def test_crawl_metrics_outcontainer_mode(self, *args):
         fc = MetricContainerCrawler()
-        for (k, f, t) in fc.crawl('123'):
+        features = fc.crawl('123')
+        assert len(features) == 1
+        assert args[0].has_sample('123', (123, 1000))
+        for (k, f, t) in features:
             assert f.cpupct == 30.0
             assert f.mempct == 30.0
             assert f.pname == 'init'
@@ -1344,7 +1554,34 @@ class PluginTests(unittest.TestCase):
             assert f.vms == 20
             assert f.read == 10
             assert f.write == 20
-        assert args[0].call_count == 1
+        assert args[1].call_count == 1
+
+        # only the processes with no sample kept by the crawler are sampled
+        # twice, in the container
+        assert args[2].call_args[0][3] == set()
+        fc.crawl('123')
+        assert args[2].call_args[0][3] == set([(123, 1000)])
+        assert args[5].call_count == 1
+
+    @mock.patch('utils.procfs.use_procfs', side_effect=lambda: True)
+    @mock.patch('utils.metric_utils.time.sleep')
+    @mock.patch('utils.metric_utils.time.time',
+                side_effect=[100.0, 100.1])
+    @mock.patch('utils.metric_utils.procfs.get_mem_total',
+                side_effect=lambda: 1000)
+    @mock.patch('utils.metric_utils.procfs.read_cpu_time',
+                side_effect=lambda pid: 10.03)
+    @mock.patch('utils.metric_utils.procfs.read_processes',
+                side_effect=lambda io: [PROC_RECORD])
+    @mock.patch('utils.metric_utils._cpu_rates', new_callable=CounterRates)
+    def test_crawl_metrics_invm_mode_procfs(self, *args):
+        fc = MetricHostCrawler()
+        [(k, f, t)] = list(fc.crawl())
+        assert k == 'init/123'
+        assert f == MetricFeature(
+            cpupct=30.0, mempct=1.0, pname='init', pid=123, read=10, rss=10,
+            status='sleeping', user='root', vms=20, write=20)
+        assert args[2].call_args == mock.call(123)
 
     @mock.patch('plugins.systems.metric_vm_crawler.psvmi.context_init',
                 side_effect=lambda dn1, dn2, kv, d, a: 1000)
@@ -1386,8 +1623,7 @@ class PluginTests(unittest.TestCase):
         'plugins.systems.connection_container_crawler.run_as_another_namespace',
         side_effect=mocked_run_as_another_namespace)
     @mock.patch(
-        ("plugins.systems.connection_container_crawler.utils.dockerutils."
-         "exec_dockerinspect"),
+        'utils.dockerutils.exec_dockerinspect',
         side_effect=lambda long_id: {'State': {'Pid': 123}})
     def test_crawl_connections_outcontainer_mode(self, *args):
         fc = ConnectionContainerCrawler()
@@ -1398,6 +1634,101 @@ class PluginTests(unittest.TestCase):
             assert f.remoteport == '22'
         assert args[0].call_count == 1
 
+    @mock.patch('utils.procfs.use_procfs', side_effect=lambda: True)
+    @mock.patch('utils.connection_utils.procfs.read_connections',
+                side_effect=lambda: {999: ProcConnection(
+                    -1, 2, 1, ('1.1.1.1', 22), ('2.2.2.2', 22),
+                    'ESTABLISHED')})
+    @mock.patch('utils.connection_utils.procfs.read_processes',
+                side_effect=lambda fds: [PROC_RECORD])
+    def test_crawl_connections_invm_mode_procfs(self, *args):
+        fc = ConnectionHostCrawler()
+        # socket 1000 is not an inet socket
+        [(k, f, t)] = list(fc.crawl())
+        assert k == '123/1.1.1.1/22'
+        assert f == ConnectionFeature(
+            localipaddr='1.1.1.1', localport=22, pname='init', pid=123,
+            remoteipaddr='2.2.2.2', remoteport=22, connstatus='ESTABLISHED')
+
+    @mock.patch('utils.connection_utils.procfs.read_connections',
+                side_effect=lambda proc_dir: {999: ProcConnection(
+                    -1, 2, 1, ('1.1.1.1', 22), ('2.2.2.2', 22),
+                    'ESTABLISHED')})
+    def test_crawl_connections_outcontainer_mode_host_processes(self, *args):
+        fc = ConnectionContainerCrawler()
+        context = ContainerContext('123', container=DummyContainer('123'),
+                                   processes=[PROC_RECORD])
+        assert fc.get_namespace_crawl('123', context=context) is None
+        [(k, f, t)] = fc.crawl('123', context=context)
+        assert k == '123/1.1.1.1/22'
+        # the connections of the container network namespace
+        args[0].assert_called_once_with('/proc/1234')
+
+    @mock.patch('utils.procfs.use_procfs', side_effect=lambda: True)
+    @mock.patch('utils.connection_utils.procfs.read_process',
+                side_effect=lambda pid, namespaces, usernames:
+                PROC_RECORD._replace(pid=1, host_pid=pid, pid_namespace=2))
+    @mock.patch(
+        'plugins.systems.connection_container_crawler.procfs.read_socket_pids',
+        side_effect=lambda: {999: [123], 1000: [124]})
+    @mock.patch(
+        'plugins.systems.connection_container_crawler.procfs.read_connections',
+        side_effect=lambda proc_dir: {
+            999: ProcConnection(-1, 2, 1, ('1.1.1.1', 22), ('2.2.2.2', 22),
+                                'ESTABLISHED'),
+            1001: ProcConnection(-1, 2, 1, ('1.1.1.1', 80), (), 'LISTEN')})
+    def test_crawl_connections_outcontainer_mode_procfs(self, *args):
+        fc = ConnectionContainerCrawler()
+        contexts = []
+        for long_id in ['123', '456']:
+            context = ContainerContext(long_id,
+                                       container=DummyContainer(long_id))
+            context._namespace_inodes = {'net': 1, 'pid': 2}
+            contexts.append(context)
+        fc.prepare_crawl(containers=[c.container for c in contexts])
+        for context in contexts:
+            assert fc.get_namespace_crawl(context.long_id,
+                                          context=context) is None
+            [(k, f, t)] = fc.crawl(context.long_id, context=context)
+            # the pid in the container
+            assert k == '1/1.1.1.1/22'
+        # once for both containers, as they share the network namespace
+        assert args[0].call_count == 1
+        assert args[1].call_count == 1
+
+    @mock.patch('utils.procfs.use_procfs', side_effect=lambda: True)
+    @mock.patch('utils.connection_utils.procfs.read_process',
+                side_effect=lambda pid, namespaces, usernames:
+                PROC_RECORD._replace(pid=1, host_pid=pid, pid_namespace=2))
+    @mock.patch(
+        'plugins.systems.connection_container_crawler.procfs.read_socket_pids',
+        side_effect=lambda: time.sleep(0.2) or {999: [123]})
+    @mock.patch(
+        'plugins.systems.connection_container_crawler.procfs.read_connections',
+        side_effect=lambda proc_dir: {
+            999: ProcConnection(-1, 2, 1, ('1.1.1.1', 22), ('2.2.2.2', 22),
+                                'ESTABLISHED')})
+    def test_crawl_connections_outcontainer_mode_procfs_unswept(self, *args):
+        fc = ConnectionContainerCrawler()
+        features = {}
+
+        def crawl(long_id):
+            context = ContainerContext(long_id,
+                                       container=DummyContainer(long_id))
+            context._namespace_inodes = {'net': 1, 'pid': 2}
+            features[long_id] = fc.crawl(long_id, context=context)
+
+        # two containers not in the last sweep, crawled at the same time
+        threads = [threading.Thread(target=crawl, args=(long_id,))
+                   for long_id in ['123', '456']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert [len(features[i]) for i in ['123', '456']] == [1, 1]
+        # one sweep for both
+        assert args[1].call_count == 1
+
     @mock.patch('plugins.systems.connection_vm_crawler.psvmi.context_init',
                 side_effect=lambda dn1, dn2, kv, d, a: 1000)
     @mock.patch('plugins.systems.connection_vm_crawler.psvmi.process_iter',
@@ -1451,7 +1782,7 @@ class PluginTests(unittest.TestCase):
         assert args[1].call_count == 1
 
     @mock.patch(
-        'plugins.systems.memory_container_crawler.psutil.virtual_memory',
+        'utils.host_snapshot.psutil.virtual_memory',
         side_effect=lambda: psutils_memory(
             10,
             10,
@@ -1473,7 +1804,7 @@ class PluginTests(unittest.TestCase):
         assert args[1].call_count == 3  # 3 cgroup files
 
     @mock.patch(
-        'plugins.systems.memory_container_crawler.psutil.virtual_memory',
+        'utils.host_snapshot.psutil.virtual_memory',
         side_effect=lambda: psutils_memory(
             10,
             10,
@@ -1525,7 +1856,7 @@ class PluginTests(unittest.TestCase):
         assert args[0].call_count == 1
 
     @mock.patch(
-        'plugins.systems.cpu_container_crawler.psutil.cpu_times_percent',
+        'utils.host_snapshot.psutil.cpu_times_percent',
         side_effect=lambda percpu: [
             psutils_cpu(
                 10,
@@ -1557,7 +1888,48 @@ class PluginTests(unittest.TestCase):
         assert args[1].call_count == 3  # open for 3 cgroup files
 
     @mock.patch(
-        'plugins.systems.cpu_container_crawler.psutil.cpu_times_percent',
+        'utils.host_snapshot.psutil.cpu_times_percent',
+        side_effect=lambda percpu: [
+            psutils_cpu(
+                10,
+                20,
+                30,
+                40,
+                50,
+                60,
+                70)])
+    @mock.patch('plugins.systems.cpu_container_crawler.CpuContainerCrawler._get_scaling_factor',
+                side_effect=lambda a,b: 1.0)
+    @mock.patch('plugins.systems.cpu_container_crawler.time.sleep')
+    @mock.patch('plugins.systems.cpu_container_crawler.open',
+                side_effect=lambda filename, mode: BytesIO(
+                    '1e7\n' if filename.endswith('usage') else
+                    'user 20\nsystem 20\n'))
+    def test_crawl_cpu_outcontainer_mode_prepared(self, mocked_open,
+                                                  mocked_sleep, *args):
+        fc = CpuContainerCrawler()
+        containers = [DummyContainer('123'), DummyContainer('456')]
+        host_snapshot.take_snapshot()
+        self.addCleanup(host_snapshot.clear_snapshot)
+        fc.prepare_crawl(containers)
+        assert mocked_sleep.call_count == 1
+        assert mocked_open.call_count == 2
+        for container in containers:
+            for (k, f, t) in fc.crawl(container.long_id, context=container):
+                assert f.cpu_util >= 0
+        # no sleeping in crawl, just the usage and cpuacct.stat files
+        assert mocked_sleep.call_count == 1
+        assert mocked_open.call_count == 6
+        # the host cpu times are read once for all the containers
+        assert args[-1].call_count == 1
+
+        # all containers have a previous sample now
+        fc.prepare_crawl(containers)
+        assert mocked_sleep.call_count == 1
+        assert mocked_open.call_count == 6
+
+    @mock.patch(
+        'utils.host_snapshot.psutil.cpu_times_percent',
         side_effect=lambda percpu: [
             psutils_cpu(
                 10,
@@ -1662,6 +2034,27 @@ class PluginTests(unittest.TestCase):
         assert args[0].call_count == 2
         assert args[1].call_count == 2
 
+    @mock.patch('utils.procfs.use_procfs', side_effect=lambda: True)
+    @mock.patch('plugins.systems.interface_container_crawler.DockerContainer',
+                side_effect=lambda container_id: DummyContainer(container_id))
+    @mock.patch(
+        'plugins.systems.interface_container_crawler.procfs.read_net_dev',
+        side_effect=lambda proc_dir: {
+            'eth0': psutils_net(10, 20, 30, 40, 50, 60)})
+    def test_crawl_interface_outcontainer_mode_procfs(self, *args):
+        fc = InterfaceContainerCrawler()
+        assert fc.get_namespace_crawl('123') is None
+        [(k, f, t)] = list(fc.crawl('123'))
+        assert k == 'interface-eth0'
+        # the counters of the container network namespace
+        args[0].assert_called_once_with('/proc/1234')
+
+    def test_crawl_interface_namespace_crawl_pickled(self):
+        fc = InterfaceContainerCrawler()
+        # the plugin (and its counter rates, with a lock) is not part of it
+        call = fc.get_namespace_crawl('123')
+        assert namespace._dumps((call.function, call.args))
+
     @mock.patch('plugins.systems.interface_vm_crawler.psvmi.context_init',
                 side_effect=lambda dn1, dn2, kv, d, a: 1000)
     @mock.patch('plugins.systems.interface_vm_crawler.psvmi.interface_iter',
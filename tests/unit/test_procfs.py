@@ -0,0 +1,166 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import mock
+
+from utils import procfs
+
+# The fields after "pid (name) ": state, ppid, ..., utime (11), stime (12),
+# num_threads (17), starttime (19), vsize (20), rss (21)
+STAT_VALUES = ['S', '1'] + ['0'] * 9 + ['200', '100'] + ['0'] * 4 + \
+    ['3', '0', '500', '4096000', '25']
+
+TCP = """  sl  local_address rem_address   st tx_queue rx_queue tr tm->when \
+retrnsmt   uid  timeout inode
+   0: 0100007F:0050 00000000:0000 0A 00000000:00000000 00:00000000 \
+00000000     0        0 999 1 0000000000000000 100 0 0 10 0
+"""
+
+NET_DEV = """Inter-|   Receive                            |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes \
+packets errs drop fifo colls carrier compressed
+  eth0:  1000      10    1    0    0     0          0         0     2000 \
+     20    2    0    0     0       0          0
+"""
+
+TCP6 = """  sl  local_address                         remote_address         \
+               st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 00000000000000000000000001000000:1F90 \
+00000000000000000000000001000000:D431 01 00000000:00000000 00:00000000 \
+00000000     0        0 1000 1 0000000000000000 20 4 30 10 -1
+"""
+
+
+class ProcfsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.proc = os.path.join(self.tempdir, 'proc')
+        self.open_file = os.path.join(self.tempdir, 'log')
+        self._write('', self.open_file)
+        self._write('cpu  1 2 3\nbtime 1000\n', 'stat')
+        self._write('MemTotal:     2000 kB\n', 'meminfo')
+        self._write('', 'self', 'stat')
+        self._write('123 (my-very-long-na) %s\n' % ' '.join(STAT_VALUES),
+                    '123', 'stat')
+        self._write('/usr/bin/my-very-long-name\x00-v\x00', '123', 'cmdline')
+        self._write('Name:\tmy-very-long-na\nUid:\t0\t1\t1\t1\n',
+                    '123', 'status')
+        self._write('rchar: 1\nread_bytes: 10\nwrite_bytes: 20\n',
+                    '123', 'io')
+        self._write(TCP, 'net', 'tcp')
+        self._write(TCP6, 'net', 'tcp6')
+        os.symlink(self.tempdir, os.path.join(self.proc, '123', 'cwd'))
+        os.makedirs(os.path.join(self.proc, '123', 'fd'))
+        for (fd, path) in [('3', self.open_file), ('4', 'socket:[999]'),
+                           ('5', 'pipe:[1]'), ('6', 'socket:[1000]'),
+                           ('7', self.open_file)]:
+            os.symlink(path, os.path.join(self.proc, '123', 'fd', fd))
+        # exited while reading /proc
+        os.makedirs(os.path.join(self.proc, '456'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _write(self, data, *path):
+        path = os.path.join(self.proc, *path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def test_read_processes(self):
+        [record] = list(procfs.read_processes(proc_dir=self.proc))
+        assert record.pid == 123
+        assert record.ppid == 1
+        assert record.name == 'my-very-long-name'
+        assert record.cmdline == ['/usr/bin/my-very-long-name', '-v']
+        assert record.status == 'sleeping'
+        assert record.create_time == 500.0 / procfs.CLOCK_TICKS + 1000
+        assert record.cpu_time == 300.0 / procfs.CLOCK_TICKS
+        assert record.num_threads == 3
+        assert record.username == 'root'
+        assert record.vms == 4096000
+        assert record.rss == 25 * procfs.PAGE_SIZE
+        assert record.read_bytes is None
+        assert record.open_files is None
+
+    def test_read_processes_io_and_fds(self):
+        [record] = list(procfs.read_processes(io=True, fds=True,
+                                              proc_dir=self.proc))
+        assert (record.read_bytes, record.write_bytes) == (10, 20)
+        assert record.cwd == self.tempdir
+        assert record.open_files == [self.open_file, self.open_file]
+        assert record.sockets == set([999, 1000])
+
+    def test_read_cpu_time(self):
+        assert procfs.read_cpu_time(123, proc_dir=self.proc) == \
+            300.0 / procfs.CLOCK_TICKS
+        assert procfs.read_cpu_time(456, proc_dir=self.proc) is None
+
+    def test_read_start_time(self):
+        assert procfs.read_start_time(123, proc_dir=self.proc) == 500
+        assert procfs.read_start_time(456, proc_dir=self.proc) is None
+
+    def test_read_open_files(self):
+        with mock.patch('utils.procfs.os.stat', wraps=os.stat) as stat:
+            assert procfs.read_open_files(123, proc_dir=self.proc) == \
+                [self.open_file, self.open_file]
+        assert stat.call_count == 1
+        assert procfs.read_open_files(789, proc_dir=self.proc) is None
+
+    def test_read_maps(self):
+        self._write('00400000-00401000 r-xp 00000000 08:01 10   /bin/my app\n'
+                    '00600000-00601000 rw-p 00000000 08:01 10   /bin/my app\n'
+                    '01000000-01021000 rw-p 00000000 00:00 0    [heap]\n'
+                    '7f000000-7f001000 rw-p 00000000 00:00 0 \n',
+                    '123', 'maps')
+        assert procfs.read_maps(123, proc_dir=self.proc) == ['/bin/my app',
+                                                             '/bin/my app']
+        assert procfs.read_maps(456, proc_dir=self.proc) is None
+
+    def test_get_mem_total(self):
+        assert procfs.get_mem_total(proc_dir=self.proc) == 2000 * 1024
+
+    def test_read_connections(self):
+        connections = procfs.read_connections(proc_dir=self.proc)
+        assert connections == {
+            999: procfs.Connection(-1, socket.AF_INET, socket.SOCK_STREAM,
+                                   ('127.0.0.1', 80), (), 'LISTEN'),
+            1000: procfs.Connection(-1, socket.AF_INET6, socket.SOCK_STREAM,
+                                    ('::1', 8080), ('::1', 54321),
+                                    'ESTABLISHED')}
+
+    def test_read_process(self):
+        assert procfs.read_process(123, proc_dir=self.proc).name == \
+            'my-very-long-name'
+        assert procfs.read_process(456, proc_dir=self.proc) is None
+
+    def test_read_socket_pids(self):
+        os.makedirs(os.path.join(self.proc, '124', 'fd'))
+        os.symlink('socket:[999]', os.path.join(self.proc, '124', 'fd', '0'))
+        os.symlink('socket:[999]', os.path.join(self.proc, '124', 'fd', '1'))
+        socket_pids = procfs.read_socket_pids(proc_dir=self.proc)
+        assert sorted(socket_pids.keys()) == [999, 1000]
+        assert sorted(socket_pids[999]) == [123, 124]
+        assert socket_pids[1000] == [123]
+
+    def test_read_net_dev(self):
+        self._write(NET_DEV, 'net', 'dev')
+        assert procfs.read_net_dev(proc_dir=self.proc) == {
+            'eth0': procfs.NetIOCounters(
+                bytes_sent=2000, bytes_recv=1000, packets_sent=20,
+                packets_recv=10, errout=2, errin=1)}
+
+    def test_use_procfs(self):
+        assert not procfs.use_procfs(self.proc)
+        with mock.patch('utils.procfs._enabled', True):
+            assert procfs.use_procfs(self.proc)
+            assert not procfs.use_procfs(self.tempdir)
+
+
+if __name__ == '__main__':
+    unittest.main()